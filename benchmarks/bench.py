@@ -0,0 +1,224 @@
+"""
+Time and peak memory of the main TCRsampler phases on synthetic cohorts.
+
+Usage
+-----
+python -m benchmarks.bench --sizes 10000 100000 1000000 --output results.json
+python -m benchmarks.bench --sizes 10000 100000 --baseline results.json
+
+With --baseline the run exits with status 1 if any phase is slower (or uses more
+memory) than the stored result by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from tcrsampler.sampler import TCRsampler
+from benchmarks.synthetic import write_synthetic_mixcr
+
+__all__ = ['measure', 'run_benchmarks', 'compare']
+
+PHASES = ['generate', 'read_csv', 'clean_mixcr', 'build_background', 'build_background_stratified', 'sample', 'sample_batch']
+
+
+def measure(fn, memory = True):
+  """
+  Call fn() and record its wall time and peak traced memory.
+
+  Parameters
+  ----------
+  fn : callable
+  memory : bool
+    If False, memory is not traced (peak_mb is None) and times are not slowed down by tracing
+
+  Returns
+  -------
+  result : object
+    return value of fn
+  record : dict
+    'seconds' and 'peak_mb'
+
+  Notes
+  -----
+  Peak memory is measured with tracemalloc, which sees numpy and pandas buffers as well as
+  Python objects, relative to the memory allocated when fn is called. Tracing slows down
+  code that allocates many small Python objects, so times are comparable only between runs
+  of this suite with the same memory setting.
+  """
+  if not memory:
+    start = time.perf_counter()
+    result = fn()
+    return result, {'seconds' : time.perf_counter() - start, 'peak_mb' : None}
+  tracemalloc.start()
+  start = time.perf_counter()
+  try:
+    result = fn()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return result, {'seconds' : seconds, 'peak_mb' : peak / 2**20}
+
+
+def _usage(sampler, n_keys, n, seed):
+  keys = list(sampler.ref_dict.keys())
+  rng = np.random.default_rng(seed)
+  pick = rng.choice(len(keys), size = min(n_keys, len(keys)), replace = False)
+  return [[keys[i][0], keys[i][1], n] for i in pick]
+
+
+def run_benchmarks(sizes, n_subjects = 10, seed = 1, max_rows = 100, n_keys = 1000, n = 10, workdir = None, phases = None, memory = True):
+  """
+  Run every phase once per cohort size.
+
+  Parameters
+  ----------
+  sizes : list of int
+    number of clones in each synthetic cohort (10**4 to 10**8)
+  n_subjects : int
+    subjects per cohort
+  seed : int
+    seed of the synthetic cohorts and of the sampled usage tables
+  max_rows : int
+    max_rows passed to build_background
+  n_keys : int
+    number of (v,j) pairs sampled by the 'sample' and 'sample_batch' phases
+  n : int
+    clones sampled per (v,j) pair
+  workdir : str or None
+    directory for the synthetic MiXCR files (a temporary directory by default)
+  phases : list or None
+    subset of PHASES to run ('generate' always runs)
+  memory : bool
+    If False, only times are recorded (see measure)
+
+  Returns
+  -------
+  results : dict
+    {'environment' : {...}, 'results' : {str(size) : {phase : {'seconds', 'peak_mb'}}}}
+  """
+  phases = PHASES if phases is None else phases
+  tmp = tempfile.mkdtemp(prefix = "tcrsampler_bench_") if workdir is None else None
+  workdir = tmp if workdir is None else workdir
+  results = dict()
+  try:
+    for size in sizes:
+      r = dict()
+      filename = os.path.join(workdir, 'synthetic_%d.tsv' % size)
+      _, r['generate'] = measure(lambda: write_synthetic_mixcr(filename, size, n_subjects = n_subjects, seed = seed), memory)
+      if 'read_csv' in phases:
+        _, r['read_csv'] = measure(lambda: pd.read_csv(filename, sep = "\t"), memory)
+      t = TCRsampler(metrics = False)
+      _, record = measure(lambda: t.clean_mixcr(filename = filename, chunksize = 10**6), memory)
+      if 'clean_mixcr' in phases:
+        r['clean_mixcr'] = record
+      if 'build_background_stratified' in phases:
+        _, r['build_background_stratified'] = measure(lambda: t.build_background(max_rows = max_rows, stratify_by_subject = True), memory)
+      _, record = measure(lambda: t.build_background(max_rows = max_rows), memory)
+      if 'build_background' in phases:
+        r['build_background'] = record
+      usage = _usage(t, n_keys, n, seed)
+      if 'sample' in phases:
+        _, r['sample'] = measure(lambda: t.sample(usage, seed = seed), memory)
+      if 'sample_batch' in phases:
+        v, j, ns = zip(*usage)
+        _, r['sample_batch'] = measure(lambda: t.sample_batch(v, j, ns, seed = seed), memory)
+      results[str(size)] = r
+      os.remove(filename)
+  finally:
+    if tmp is not None:
+      shutil.rmtree(tmp, ignore_errors = True)
+  environment = {'python' : platform.python_version(),
+                 'numpy' : np.__version__,
+                 'pandas' : pd.__version__,
+                 'machine' : platform.machine(),
+                 'n_subjects' : n_subjects,
+                 'seed' : seed,
+                 'max_rows' : max_rows,
+                 'memory' : memory}
+  return {'environment' : environment, 'results' : results}
+
+
+def compare(results, baseline, tolerance = 0.25, min_seconds = 0.05, min_mb = 1.0):
+  """
+  List the phases that regressed with respect to a baseline.
+
+  Parameters
+  ----------
+  results : dict
+    output of run_benchmarks
+  baseline : dict
+    stored output of run_benchmarks
+  tolerance : float
+    allowed relative increase of seconds and peak_mb
+  min_seconds : float
+    increases smaller than this many seconds are ignored (timer noise)
+  min_mb : float
+    increases smaller than this many MiB are ignored
+
+  Returns
+  -------
+  regressions : pd.DataFrame
+    one row per (size, phase, metric) above tolerance, with 'baseline', 'current' and 'ratio'
+  """
+  rows = list()
+  slack = {'seconds' : min_seconds, 'peak_mb' : min_mb}
+  for size, phases in results['results'].items():
+    for phase, record in phases.items():
+      old = baseline['results'].get(size, {}).get(phase)
+      if old is None:
+        continue
+      for metric in ['seconds', 'peak_mb']:
+        if record[metric] is None or old[metric] is None:
+          continue
+        if record[metric] > old[metric] * (1 + tolerance) and record[metric] - old[metric] > slack[metric]:
+          rows.append([int(size), phase, metric, old[metric], record[metric], record[metric] / old[metric]])
+  return pd.DataFrame(rows, columns = ['size', 'phase', 'metric', 'baseline', 'current', 'ratio'])
+
+
+def _table(results):
+  rows = [[int(size), phase, rec['seconds'], rec['peak_mb']] for size, phases in results['results'].items() for phase, rec in phases.items()]
+  return pd.DataFrame(rows, columns = ['size', 'phase', 'seconds', 'peak_mb'])
+
+
+def main(argv = None):
+  parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--sizes', type = int, nargs = '+', default = [10**4, 10**5])
+  parser.add_argument('--subjects', type = int, default = 10)
+  parser.add_argument('--seed', type = int, default = 1)
+  parser.add_argument('--max-rows', type = int, default = 100)
+  parser.add_argument('--phases', nargs = '+', choices = PHASES, default = None)
+  parser.add_argument('--workdir', default = None)
+  parser.add_argument('--output', default = None, help = 'write results to this JSON file')
+  parser.add_argument('--baseline', default = None, help = 'JSON file of a previous run to compare against')
+  parser.add_argument('--tolerance', type = float, default = 0.25)
+  parser.add_argument('--no-memory', action = 'store_true', help = 'do not trace memory (faster, untraced timings)')
+  args = parser.parse_args(argv)
+
+  results = run_benchmarks(args.sizes, n_subjects = args.subjects, seed = args.seed, max_rows = args.max_rows,
+                           workdir = args.workdir, phases = args.phases, memory = not args.no_memory)
+  print(_table(results).to_string(index = False))
+  if args.output is not None:
+    with open(args.output, 'w') as fh:
+      json.dump(results, fh, indent = 2)
+  if args.baseline is not None:
+    with open(args.baseline) as fh:
+      baseline = json.load(fh)
+    regressions = compare(results, baseline, tolerance = args.tolerance)
+    if regressions.shape[0] > 0:
+      print("\nRegressions:")
+      print(regressions.to_string(index = False))
+      return 1
+    print("\nNo regressions")
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+__all__ = ['TRBV_GENES', 'TRBJ_GENES', 'synthetic_mixcr_chunks', 'synthetic_mixcr', 'write_synthetic_mixcr']
+
+# Functional TRBV and TRBJ genes, ordered roughly from most to least used in adult
+# peripheral blood; usage falls off as a power of the rank (see _gene_usage)
+TRBV_GENES = ['TRBV20-1', 'TRBV5-1', 'TRBV28', 'TRBV7-9', 'TRBV19', 'TRBV27', 'TRBV6-5', 'TRBV12-3',
+              'TRBV12-4', 'TRBV7-2', 'TRBV18', 'TRBV4-1', 'TRBV9', 'TRBV2', 'TRBV3-1', 'TRBV29-1',
+              'TRBV30', 'TRBV7-8', 'TRBV6-1', 'TRBV7-6', 'TRBV11-2', 'TRBV14', 'TRBV10-3', 'TRBV15',
+              'TRBV6-6', 'TRBV24-1', 'TRBV25-1', 'TRBV4-2', 'TRBV5-6', 'TRBV10-2', 'TRBV7-3', 'TRBV13',
+              'TRBV5-4', 'TRBV4-3', 'TRBV11-3', 'TRBV6-2', 'TRBV5-8', 'TRBV10-1', 'TRBV5-5', 'TRBV7-7',
+              'TRBV11-1', 'TRBV6-4', 'TRBV16', 'TRBV6-9', 'TRBV6-8', 'TRBV7-4', 'TRBV12-5']
+
+TRBJ_GENES = ['TRBJ2-1', 'TRBJ2-7', 'TRBJ2-3', 'TRBJ1-1', 'TRBJ2-5', 'TRBJ1-2', 'TRBJ2-2',
+              'TRBJ1-5', 'TRBJ1-4', 'TRBJ2-4', 'TRBJ1-6', 'TRBJ1-3', 'TRBJ2-6']
+
+_amino_acids = np.frombuffer(b'ACDEFGHIKLMNPQRSTVWY', dtype = np.uint8)
+
+
+def _gene_usage(n, exponent = 1.0):
+  p = 1.0 / np.arange(1, n + 1) ** exponent
+  return p / p.sum()
+
+
+def _cdr3s(rng, n, mean_length = 14, sd_length = 2, min_length = 8, max_length = 24):
+  """
+  Random CDR3s starting with C and ending with F, built as one fixed width byte array.
+  """
+  lengths = np.clip(np.round(rng.normal(mean_length, sd_length, n)), min_length, max_length).astype(np.int64)
+  letters = _amino_acids[rng.integers(0, _amino_acids.shape[0], size = (n, max_length))]
+  letters[:, 0] = ord('C')
+  letters[np.arange(n), lengths - 1] = ord('F')
+  # zero bytes past each CDR3 are dropped when the fixed width bytes are decoded
+  letters[np.arange(max_length)[None, :] >= lengths[:, None]] = 0
+  return letters.view('S%d' % max_length).ravel().astype(str).astype(object)
+
+
+def _subject_sizes(n_rows, n_subjects):
+  sizes = np.full(n_subjects, n_rows // n_subjects, dtype = np.int64)
+  sizes[:n_rows % n_subjects] += 1
+  return sizes
+
+
+def synthetic_mixcr_chunks(n_rows, n_subjects = 10, seed = 1, chunksize = 10**6, alpha = 1.5):
+  """
+  Generate a synthetic MiXCR cohort, chunk by chunk.
+
+  Parameters
+  ----------
+  n_rows : int
+    total number of clones over all subjects
+  n_subjects : int
+    number of subjects; rows are split evenly between them
+  seed : int
+    seed; output is reproducible for a given seed and chunksize
+  chunksize : int
+    maximum number of rows per yielded DataFrame
+  alpha : float
+    power-law exponent of the clone sizes, cloneCount = 1 + Pareto(alpha)
+
+  Yields
+  ------
+  df : pd.DataFrame
+    ['subject','cloneCount','cloneFraction','bestVGene','bestJGene','aaSeqCDR3'] columns, as
+    in MiXCR exports (genes without alleles); cloneFraction sums to 1 within each subject
+  """
+  p_v = _gene_usage(len(TRBV_GENES))
+  p_j = _gene_usage(len(TRBJ_GENES), exponent = 0.7)
+  v_genes = np.array(TRBV_GENES, dtype = object)
+  j_genes = np.array(TRBJ_GENES, dtype = object)
+  for s, size in enumerate(_subject_sizes(n_rows, n_subjects)):
+    rng = np.random.default_rng([seed, s])
+    count = np.floor(1 + rng.pareto(alpha, size)).astype(np.int64)
+    freq = count / count.sum()
+    for start in range(0, size, chunksize):
+      stop = min(start + chunksize, size)
+      n = stop - start
+      yield pd.DataFrame({'subject'       : np.full(n, 'subject_%d' % s, dtype = object),
+                          'cloneCount'    : count[start:stop],
+                          'cloneFraction' : freq[start:stop],
+                          'bestVGene'     : v_genes[rng.choice(len(TRBV_GENES), size = n, p = p_v)],
+                          'bestJGene'     : j_genes[rng.choice(len(TRBJ_GENES), size = n, p = p_j)],
+                          'aaSeqCDR3'     : _cdr3s(rng, n)})
+
+
+def synthetic_mixcr(n_rows, n_subjects = 10, seed = 1, alpha = 1.5):
+  """
+  Generate a synthetic MiXCR cohort as one DataFrame (see synthetic_mixcr_chunks).
+  """
+  return pd.concat(list(synthetic_mixcr_chunks(n_rows, n_subjects = n_subjects, seed = seed, alpha = alpha)), ignore_index = True)
+
+
+def write_synthetic_mixcr(filename, n_rows, n_subjects = 10, seed = 1, chunksize = 10**6, alpha = 1.5):
+  """
+  Write a synthetic MiXCR cohort to a tab separated file without holding it in memory.
+
+  Returns
+  -------
+  filename : str
+  """
+  header = True
+  with open(filename, 'w') as fh:
+    for df in synthetic_mixcr_chunks(n_rows, n_subjects = n_subjects, seed = seed, chunksize = chunksize, alpha = alpha):
+      df.to_csv(fh, sep = "\t", index = False, header = header)
+      header = False
+  return filename
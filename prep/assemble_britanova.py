@@ -3,6 +3,7 @@ import os
 import pandas as pd
 import numpy as np
 from progress.bar import IncrementalBar
+from tcrsampler.validate import validate_cdr3
 
 def assemble_britanova_chord_blood(
 	path = os.path.join('/','Volumes','Samsung_T5','kmayerbl','tcr_data','britanova'),
@@ -31,14 +32,9 @@ def assemble_britanova_chord_blood(
 	df = pd.concat(l)
 	del l
 
-	def _valid_cdr3(cdr3):
-		amino_acids = ['A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L', 'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'Y']
-		valid = np.all([aa in amino_acids for aa in cdr3])
-		return valid
-
 	bar = IncrementalBar('Validate CDR3   ', max = 2, suffix='%(percent)d%%')
 	bar.next()
-	ind = df['cdr3'].apply(lambda x : _valid_cdr3(x))
+	ind, _ = validate_cdr3(df['cdr3'], anchors = False)
 	df = df[ind]
 	bar.next()
 	bar.finish()
@@ -45,7 +45,7 @@ Nature Immunology volume 18, pages393–401(2017)Cite this article
 
 import pandas as pd
 import math
-from tcrdist.adpt_funcs import _valid_cdr3
+from tcrsampler.validate import validate_cdr3
 
 df = pd.read_csv("/Volumes/Samsung_T5/kmayerbl/gd/SRA/output/all_files.clns.tsv", sep = "\t")
 df = df[['allVHitsWithScore',  'allJHitsWithScore', 'aaSeqCDR3', 'nSeqCDR3', 'cloneCount', 'cloneFraction','source']]
@@ -103,8 +103,8 @@ new_cols = {'v':'v_reps', 'j':'j_reps', 'aaSeqCDR3':'cdr3', 'cloneCount':'count'
 dfnew = dfnew[['v','j', 'aaSeqCDR3', 'cloneCount','cloneFraction','source']].rename(columns = new_cols).reset_index(drop = True)
 
 
-dfnew = dfnew[dfnew.cdr3.apply(lambda x : _valid_cdr3(x))]
-dfnew = dfnew[dfnew.cdr3.apply(lambda x : len(x) > 5)]
+ind, _ = validate_cdr3(dfnew.cdr3, anchors = False, min_length = 6)
+dfnew = dfnew[ind]
 
 dfg = dfnew[(dfnew.v_reps.str.startswith('TRG') | dfnew.j_reps.str.startswith('TRG') ) ]
 dfd = dfnew[(dfnew.v_reps.str.startswith('TRD') | dfnew.j_reps.str.startswith('TRD') ) ]
@@ -1,5 +1,5 @@
 from setuptools import setup, find_packages
-PACKAGES = find_packages()
+PACKAGES = find_packages(exclude = ['benchmarks'])
 
 # read the contents of your README file
 from os import path
@@ -27,4 +27,4 @@ install_reqs = [
       'progress>=1.5']
 
 if __name__ == "__main__":
-      setup(**opts, install_requires=install_reqs)
+      setup(**opts, install_requires=install_reqs, extras_require={'parquet': ['pyarrow>=6.0']})
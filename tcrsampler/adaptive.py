@@ -0,0 +1,149 @@
+import re
+import numpy as np
+import pandas as pd
+from tcrsampler.validate import validate_cdr3
+
+__all__ = ['adaptive_to_imgt', 'expand_gene_ties', 'import_adaptive']
+
+# Adaptive ImmuneAccess columns used by import_adaptive and their reference names
+adaptive_columns = {'sample_name'     : 'subject',
+                    'v_gene'          : 'v_reps',
+                    'v_gene_ties'     : 'v_gene_ties',
+                    'j_gene'          : 'j_reps',
+                    'j_gene_ties'     : 'j_gene_ties',
+                    'cdr3_amino_acid' : 'cdr3',
+                    'templates'       : 'count',
+                    'frequency'       : 'freq'}
+
+adaptive_dtypes = {'sample_name' : str, 'v_gene' : str, 'v_gene_ties' : str, 'j_gene' : str, 'j_gene_ties' : str,
+                   'cdr3_amino_acid' : str, 'frequency' : 'Float64', 'templates' : 'Int64'}
+
+
+def adaptive_to_imgt(gene):
+  """
+  Convert an Adaptive gene name to the IMGT convention, e.g. 'TCRBV07-02' -> 'TRBV7-2*01'.
+
+  Parameters
+  ----------
+  gene : str
+
+  Returns
+  -------
+  gene : str
+  """
+  if not isinstance(gene, str):
+    return gene
+  gene = re.sub(r'^TCR', 'TR', gene)
+  gene = re.sub(r'^(TR[ABGD][VDJ])0', r'\1', gene)
+  gene = gene.replace("-0", "-")
+  if gene.find('*0') == -1:
+    gene = gene + "*01"
+  return gene
+
+
+def _explode_ties(df, gene_col, ties_col):
+  """
+  Replace 'unresolved' calls in gene_col by one row per comma separated gene in ties_col.
+  An 'unresolved' call with a missing or empty ties_col is left as NaN.
+  """
+  ties = df[ties_col].where(df[ties_col] != '')
+  genes = df[gene_col].where(df[gene_col] != 'unresolved', ties).astype(object)
+  ok = genes.notna().values
+  n = np.ones(df.shape[0], dtype = np.int64)
+  n[ok] = genes[ok].str.count(",").values + 1
+  out = df.iloc[np.repeat(np.arange(df.shape[0]), n)].reset_index(drop = True)
+  # joining and re-splitting flattens every tie list in row order
+  flat = np.empty(int(n.sum()), dtype = object)
+  flat_ok = np.repeat(ok, n)
+  flat[flat_ok] = ",".join(genes[ok].values).split(",") if ok.any() else []
+  flat[~flat_ok] = np.nan
+  out[gene_col] = flat
+  return out
+
+
+def expand_gene_ties(df):
+  """
+  Expand Adaptive rows with unresolved V or J calls into one row per possible (v,j) combination.
+
+  Parameters
+  ----------
+  df : pd.DataFrame
+    Adaptive export with 'v_gene', 'v_gene_ties', 'j_gene' and 'j_gene_ties' columns
+
+  Returns
+  -------
+  df : pd.DataFrame
+    rows whose v_gene (or j_gene) is 'unresolved' are repeated once per gene listed in
+    v_gene_ties (j_gene_ties); all other columns are copied unchanged. An 'unresolved' 
+    call without ties becomes NaN.
+  """
+  df = _explode_ties(df, 'v_gene', 'v_gene_ties')
+  df = _explode_ties(df, 'j_gene', 'j_gene_ties')
+  return df
+
+
+def import_adaptive(filename = None, df = None, min_length = None, max_length = None, chunksize = None, rejected = None):
+  """
+  Read an Adaptive ImmuneAccess export into a reference table ready for TCRsampler.build_background.
+
+  Parameters
+  ----------
+  filename : str
+    Adaptive .tsv export
+  df : pd.DataFrame
+    Adaptive export already in memory (used instead of filename)
+  min_length : int or None
+    minimum allowed CDR3 length
+  max_length : int or None
+    maximum allowed CDR3 length
+  chunksize : int or None
+    If set, filename is read and converted in chunks of this many rows
+  rejected : dict or None
+    If given, updated with the number of rows dropped per reason: 'unresolved' for rows
+    whose V or J gene is missing or unresolved without ties, and the CDR3 reasons of 
+    tcrsampler.validate.validate_cdr3
+
+  Returns
+  -------
+  df : pd.DataFrame
+    DataFrame with columns ['v_reps','j_reps','cdr3', 'count','freq','subject']
+
+  Notes
+  -----
+  Unresolved genes are expanded with tie lists (expand_gene_ties), gene names are converted
+  to IMGT names with a mapping computed once over the unique names (adaptive_to_imgt) and
+  rows with a missing gene or a missing or non amino acid CDR3 are dropped.
+  """
+  if rejected is None:
+    rejected = dict()
+  if df is None:
+    reader = pd.read_csv(filename,
+                         sep = "\t",
+                         usecols = lambda c: c in adaptive_columns,
+                         dtype = adaptive_dtypes,
+                         chunksize = chunksize)
+    if chunksize is None:
+      return _import_adaptive_chunk(reader, min_length, max_length, rejected)
+    return pd.concat([_import_adaptive_chunk(chunk, min_length, max_length, rejected) for chunk in reader], ignore_index = True)
+  return _import_adaptive_chunk(df, min_length, max_length, rejected)
+
+
+def _import_adaptive_chunk(df, min_length, max_length, rejected):
+  df = df[[c for c in adaptive_columns if c in df.columns]]
+  df = expand_gene_ties(df)
+  resolved = (df['v_gene'].notna() & df['j_gene'].notna()).values
+  rejected['unresolved'] = rejected.get('unresolved', 0) + int(np.count_nonzero(~resolved))
+  df = df[resolved]
+  for col in ['v_gene', 'j_gene']:
+    uniques = pd.unique(df[col].values)
+    mapping = {g : adaptive_to_imgt(g) for g in uniques}
+    df[col] = df[col].map(mapping)
+  df = df.rename(columns = adaptive_columns)
+  ind, cdr3_rejected = validate_cdr3(df['cdr3'], anchors = False, min_length = min_length, max_length = max_length)
+  for reason, n in cdr3_rejected.items():
+    rejected[reason] = rejected.get(reason, 0) + n
+  df = df[ind]
+  columns = ['v_reps','j_reps','cdr3', 'count','freq']
+  if 'subject' in df.columns:
+    columns.append('subject')
+  return df[columns].reset_index(drop = True)
@@ -0,0 +1,1301 @@
+import numpy as np
+import pandas as pd
+from collections.abc import KeysView, ItemsView, ValuesView
+
+__all__ = ['PackedStrings', 'IndexedStrings', 'CompactReference', 'BackgroundBlocks', 'LazyBlocks', 'BlockDict', 'build_blocks']
+
+class PackedStrings():
+  """
+  Read-only sequence of ASCII strings stored in one contiguous byte buffer.
+
+  Attributes
+  ----------
+  buffer : np.ndarray
+    uint8 array holding every string back-to-back
+  offsets : np.ndarray
+    int64 array of length n + 1; string i is buffer[offsets[i]:offsets[i+1]]
+
+  Notes
+  -----
+  Both arrays may be np.memmap instances, in which case strings are decoded
+  straight from the mapped pages.
+  """
+  def __init__(self, buffer, offsets):
+    self.buffer = buffer
+    self.offsets = offsets
+
+  @classmethod
+  def from_strings(cls, strings):
+    """
+    Pack an iterable of strings.
+
+    Parameters
+    ----------
+    strings : iterable of str
+
+    Returns
+    -------
+    packed : PackedStrings
+    """
+    strings = [str(s) for s in strings]
+    lengths = np.fromiter((len(s) for s in strings), dtype = np.int64, count = len(strings))
+    offsets = np.zeros(len(strings) + 1, dtype = np.int64)
+    np.cumsum(lengths, out = offsets[1:])
+    buffer = np.frombuffer("".join(strings).encode('ascii'), dtype = np.uint8)
+    return cls(buffer = buffer, offsets = offsets)
+
+  def __len__(self):
+    return self.offsets.shape[0] - 1
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return self.take(np.arange(len(self))[i])
+    return self.buffer[self.offsets[i]:self.offsets[i+1]].tobytes().decode('ascii')
+
+  def take(self, indices):
+    """
+    Decode the strings at indices.
+
+    Parameters
+    ----------
+    indices : array-like of int
+
+    Returns
+    -------
+    strings : np.ndarray
+      object array of str, one per index (repeated indices are decoded once)
+    """
+    indices = np.asarray(indices, dtype = np.int64)
+    if indices.size == 0:
+      return np.empty(0, dtype = object)
+    unique, inverse = np.unique(indices, return_inverse = True)
+    decoded = np.empty(unique.shape[0], dtype = object)
+    decoded[:] = [self[i] for i in unique]
+    return decoded[inverse.reshape(-1)]
+
+  def to_list(self):
+    return self.take(np.arange(len(self))).tolist()
+
+  def subset(self, indices):
+    """
+    Gather the strings at indices into a new PackedStrings without decoding them.
+
+    Parameters
+    ----------
+    indices : array-like of int
+
+    Returns
+    -------
+    packed : PackedStrings
+    """
+    indices = np.asarray(indices, dtype = np.int64)
+    starts = np.asarray(self.offsets[:-1])[indices]
+    lengths = np.asarray(self.offsets[1:])[indices] - starts
+    offsets = np.zeros(indices.shape[0] + 1, dtype = np.int64)
+    np.cumsum(lengths, out = offsets[1:])
+    # byte i of the new buffer comes from old position i - new_start + old_start
+    source = np.arange(offsets[-1], dtype = np.int64) + np.repeat(starts - offsets[:-1], lengths)
+    return PackedStrings(buffer = np.asarray(self.buffer)[source], offsets = offsets)
+
+  def view(self, indices):
+    """
+    Return the strings at indices as an IndexedStrings that shares this buffer.
+
+    Parameters
+    ----------
+    indices : array-like of int
+
+    Returns
+    -------
+    view : IndexedStrings
+    """
+    return IndexedStrings(self, indices)
+
+  @property
+  def nbytes(self):
+    return self.buffer.nbytes + self.offsets.nbytes
+
+  @classmethod
+  def concatenate(cls, parts):
+    """ Join several PackedStrings into one """
+    lengths = np.concatenate([np.diff(np.asarray(p.offsets)) for p in parts])
+    offsets = np.zeros(lengths.shape[0] + 1, dtype = np.int64)
+    np.cumsum(lengths, out = offsets[1:])
+    buffer = np.concatenate([np.asarray(p.buffer[p.offsets[0]:p.offsets[-1]]) for p in parts])
+    return cls(buffer = buffer.astype(np.uint8), offsets = offsets)
+
+
+class IndexedStrings(PackedStrings):
+  """
+  Subset of a PackedStrings, held as indices into it rather than as a copy of its bytes.
+
+  Attributes
+  ----------
+  strings : PackedStrings
+    underlying strings, shared
+  index : np.ndarray
+    int64 position in strings of every string of the subset
+
+  Notes
+  -----
+  buffer and offsets, needed only to store or hash the strings, are packed on first use.
+  """
+  def __init__(self, strings, indices):
+    self.strings = strings
+    self.index = np.asarray(indices, dtype = np.int64)
+    self._packed = None
+
+  def __len__(self):
+    return self.index.shape[0]
+
+  def __getitem__(self, i):
+    if isinstance(i, (slice, np.ndarray, list)):
+      return self.take(np.arange(len(self))[i])
+    return self.strings[int(self.index[i])]
+
+  def take(self, indices):
+    return self.strings.take(self.index[np.asarray(indices, dtype = np.int64)])
+
+  def subset(self, indices):
+    return self.strings.subset(self.index[np.asarray(indices, dtype = np.int64)])
+
+  def view(self, indices):
+    return IndexedStrings(self.strings, self.index[np.asarray(indices, dtype = np.int64)])
+
+  def pack(self):
+    """ Return the subset as a contiguous PackedStrings (memoized) """
+    if self._packed is None:
+      self._packed = self.strings.subset(self.index)
+    return self._packed
+
+  @property
+  def buffer(self):
+    return self.pack().buffer
+
+  @property
+  def offsets(self):
+    return self.pack().offsets
+
+  @property
+  def nbytes(self):
+    return self.index.nbytes
+
+
+class CompactReference():
+  """
+  Compact, column-oriented copy of a reference DataFrame (ref_df).
+
+  Gene names and subjects are integer codes into shared vocabularies, CDR3s live in one
+  contiguous byte buffer with an offsets array, and count and freq are int32 and float32.
+  A CompactReference can be passed anywhere build_blocks accepts a DataFrame.
+
+  Attributes
+  ----------
+  v_genes : np.ndarray
+    sorted vocabulary of V gene names
+  j_genes : np.ndarray
+    sorted vocabulary of J gene names
+  subjects : np.ndarray or None
+    sorted vocabulary of subject names
+  v_codes : np.ndarray
+    int32 V gene code per row (-1 if missing)
+  j_codes : np.ndarray
+    int32 J gene code per row (-1 if missing)
+  subject_codes : np.ndarray or None
+    int32 subject code per row (-1 if missing)
+  cdr3 : PackedStrings or np.ndarray
+    CDR3 per row
+  count : np.ndarray
+    count per row
+  freq : np.ndarray
+    frequency per row
+
+  Example
+  -------
+  >>> ref = CompactReference.from_dataframe(t.ref_df)
+  >>> ref.memory_usage(t.ref_df)
+  """
+  def __init__(self, v_genes, j_genes, v_codes, j_codes, cdr3, count, freq, subjects = None, subject_codes = None):
+    self.v_genes = v_genes
+    self.j_genes = j_genes
+    self.v_codes = v_codes
+    self.j_codes = j_codes
+    self.cdr3 = cdr3
+    self.count = count
+    self.freq = freq
+    self.subjects = subjects
+    self.subject_codes = subject_codes
+
+  @classmethod
+  def from_dataframe(cls, df, compact = True):
+    """
+    Parameters
+    ----------
+    df : pd.DataFrame
+      DataFrame with ['v_reps','j_reps','cdr3', 'count','freq'] columns (and 'subject' if available)
+    compact : bool
+      If True, CDR3s are packed and count and freq are stored as int32 and float32. If False,
+      CDR3s stay an object array and count and freq keep 64-bit precision (used internally
+      by build_blocks, which only packs the rows it keeps).
+
+    Returns
+    -------
+    ref : CompactReference
+    """
+    v_genes, v_codes = _factorize(df['v_reps'])
+    j_genes, j_codes = _factorize(df['j_reps'])
+    if 'subject' in df.columns:
+      subjects, subject_codes = _factorize(df['subject'])
+    else:
+      subjects, subject_codes = None, None
+    count = _as_count(df['count'])
+    freq = np.asarray(df['freq'], dtype = np.float64)
+    cdr3 = np.asarray(df['cdr3'], dtype = object)
+    if compact:
+      count = count.astype(np.int32 if count.dtype.kind == 'i' else np.float32)
+      freq = freq.astype(np.float32)
+      cdr3 = PackedStrings.from_strings(cdr3)
+    return cls(v_genes = v_genes, 
+               j_genes = j_genes, 
+               v_codes = v_codes, 
+               j_codes = j_codes,
+               cdr3 = cdr3,
+               count = count,
+               freq = freq,
+               subjects = subjects,
+               subject_codes = subject_codes)
+
+  def __len__(self):
+    return self.v_codes.shape[0]
+
+  @property
+  def columns(self):
+    columns = ['v_reps','j_reps','cdr3', 'count','freq']
+    if self.subject_codes is not None:
+      columns.append('subject')
+    return columns
+
+  def take(self, indices):
+    """ Return the rows at indices as a new CompactReference sharing the vocabularies """
+    indices = np.asarray(indices, dtype = np.int64)
+    cdr3 = self.cdr3.subset(indices) if isinstance(self.cdr3, PackedStrings) else self.cdr3[indices]
+    return CompactReference(v_genes = self.v_genes,
+                            j_genes = self.j_genes,
+                            v_codes = self.v_codes[indices],
+                            j_codes = self.j_codes[indices],
+                            cdr3 = cdr3,
+                            count = self.count[indices],
+                            freq = self.freq[indices],
+                            subjects = self.subjects,
+                            subject_codes = None if self.subject_codes is None else self.subject_codes[indices])
+
+  def recode(self, v_genes, j_genes, subjects = None):
+    """
+    Express the codes against other vocabularies, appending names they lack.
+
+    Parameters
+    ----------
+    v_genes, j_genes, subjects : np.ndarray
+      vocabularies to code against (subjects may be None)
+
+    Returns
+    -------
+    ref : CompactReference
+      rows unchanged; each vocabulary starts with the one given, so codes valid
+      against it stay valid
+    """
+    v_genes, v_codes = _recode(v_genes, self.v_genes, self.v_codes)
+    j_genes, j_codes = _recode(j_genes, self.j_genes, self.j_codes)
+    if self.subject_codes is None:
+      subject_codes = None
+    else:
+      subjects, subject_codes = _recode(np.empty(0, dtype = object) if subjects is None else subjects, self.subjects, self.subject_codes)
+    return CompactReference(v_genes = v_genes,
+                            j_genes = j_genes,
+                            v_codes = v_codes,
+                            j_codes = j_codes,
+                            cdr3 = self.cdr3,
+                            count = self.count,
+                            freq = self.freq,
+                            subjects = subjects,
+                            subject_codes = subject_codes)
+
+  @classmethod
+  def concatenate(cls, refs):
+    """
+    Stack the rows of several references.
+
+    Parameters
+    ----------
+    refs : list of CompactReference
+
+    Returns
+    -------
+    ref : CompactReference
+      vocabularies are those of refs[0] extended by the names first seen in later
+      references, so codes of refs[0] are unchanged. Rows of a reference without
+      subjects get subject code -1.
+    """
+    v_genes, j_genes, subjects = refs[0].v_genes, refs[0].j_genes, refs[0].subjects
+    recoded = list()
+    for r in refs:
+      r = r.recode(v_genes, j_genes, subjects)
+      v_genes, j_genes = r.v_genes, r.j_genes
+      subjects = subjects if r.subjects is None else r.subjects
+      recoded.append(r)
+    if subjects is None:
+      subject_codes = None
+    else:
+      subject_codes = np.concatenate([np.full(len(r), -1, dtype = np.int32) if r.subject_codes is None else r.subject_codes for r in recoded])
+    if all(isinstance(r.cdr3, PackedStrings) for r in recoded):
+      cdr3 = PackedStrings.concatenate([r.cdr3 for r in recoded])
+    else:
+      cdr3 = np.concatenate([r.cdr3.take(np.arange(len(r))) if isinstance(r.cdr3, PackedStrings) else np.asarray(r.cdr3, dtype = object) for r in recoded])
+    return cls(v_genes = v_genes,
+               j_genes = j_genes,
+               v_codes = np.concatenate([r.v_codes for r in recoded]),
+               j_codes = np.concatenate([r.j_codes for r in recoded]),
+               cdr3 = cdr3,
+               count = np.concatenate([np.asarray(r.count) for r in recoded]),
+               freq = np.concatenate([np.asarray(r.freq) for r in recoded]),
+               subjects = subjects,
+               subject_codes = subject_codes)
+
+  def take_cdr3(self, indices):
+    """ Return the CDR3s at indices as a PackedStrings """
+    if isinstance(self.cdr3, PackedStrings):
+      return self.cdr3.subset(indices)
+    return PackedStrings.from_strings(self.cdr3[indices])
+
+  def to_dataframe(self, columns = None):
+    """
+    Expand back into the ref_df layout.
+
+    Parameters
+    ----------
+    columns : list or None
+      subset of columns to materialize (default all)
+
+    Returns
+    -------
+    df : pd.DataFrame
+    """
+    columns = self.columns if columns is None else columns
+    decode = lambda vocab, codes: np.where(codes >= 0, vocab[np.maximum(codes, 0)], None) if vocab.shape[0] else np.full(codes.shape[0], None)
+    d = dict()
+    for col in columns:
+      if col == 'v_reps':
+        d[col] = decode(self.v_genes, self.v_codes)
+      elif col == 'j_reps':
+        d[col] = decode(self.j_genes, self.j_codes)
+      elif col == 'subject':
+        d[col] = decode(self.subjects, self.subject_codes)
+      elif col == 'cdr3':
+        d[col] = self.cdr3.take(np.arange(len(self))) if isinstance(self.cdr3, PackedStrings) else self.cdr3
+      else:
+        d[col] = getattr(self, col)
+    return pd.DataFrame(d, columns = columns)
+
+  def memory_usage(self, df = None):
+    """
+    Compare the memory held by this representation with the DataFrame layout.
+
+    Parameters
+    ----------
+    df : pd.DataFrame or None
+      DataFrame to compare against; if None, one is materialized with to_dataframe()
+
+    Returns
+    -------
+    report : pd.DataFrame
+      bytes per column for the 'compact' and 'dataframe' layouts (deep, i.e. including
+      Python string objects) with a 'total' row and their 'ratio'
+
+    Notes
+    -----
+    The DataFrame is measured as pandas stores it. String columns of object dtype hold
+    one Python object per row, and the compact layout is several times smaller (about 6x
+    on the example data). pandas' Arrow-backed string dtype (the default from pandas 3)
+    already packs strings into one buffer, so the CDR3 column is about the same size in
+    both layouts and the savings come from coding genes and subjects and from narrower
+    count and freq (about 2x on the example data).
+    """
+    if df is None:
+      df = self.to_dataframe()
+    vocab_bytes = lambda vocab: 0 if vocab is None else int(pd.Series(vocab, dtype = object).memory_usage(deep = True, index = False))
+    compact = {'v_reps' : self.v_codes.nbytes + vocab_bytes(self.v_genes),
+               'j_reps' : self.j_codes.nbytes + vocab_bytes(self.j_genes),
+               'cdr3'   : self.cdr3.nbytes if isinstance(self.cdr3, PackedStrings) else int(pd.Series(self.cdr3).memory_usage(deep = True, index = False)),
+               'count'  : self.count.nbytes,
+               'freq'   : self.freq.nbytes}
+    if self.subject_codes is not None:
+      compact['subject'] = self.subject_codes.nbytes + vocab_bytes(self.subjects)
+    frame = df[list(compact.keys())].memory_usage(deep = True, index = False)
+    report = pd.DataFrame({'compact' : pd.Series(compact), 'dataframe' : frame})
+    report.loc['total'] = report.sum()
+    report['ratio'] = report['dataframe'] / report['compact']
+    return report
+
+
+class BackgroundBlocks():
+  """
+  Flat storage of a built background, one contiguous block of rows per (v,j) pair.
+
+  Attributes
+  ----------
+  v_genes : np.ndarray
+    sorted vocabulary of V gene names; v_codes index into it
+  j_genes : np.ndarray
+    sorted vocabulary of J gene names; j_codes index into it
+  v_codes : np.ndarray
+    int32 V gene code per row
+  j_codes : np.ndarray
+    int32 J gene code per row
+  cdr3 : PackedStrings
+    CDR3 per row
+  count : np.ndarray
+    count per row
+  freq : np.ndarray
+    frequency per row
+  offsets : np.ndarray
+    int64 array of length n_blocks + 1; block i is rows offsets[i]:offsets[i+1]
+  subjects : np.ndarray or None
+    sorted vocabulary of subject names, if the reference had a subject column
+  subject_codes : np.ndarray or None
+    int32 subject code per row
+  singleton : bool
+    If True, rows keep their original count and freq (which fixed their rank) but are
+    presented and sampled as if count and freq were 1.
+  """
+  def __init__(self, v_genes, j_genes, v_codes, j_codes, cdr3, count, freq, offsets, subjects = None, subject_codes = None, singleton = False):
+    self.v_genes = np.asarray(v_genes, dtype = object)
+    self.j_genes = np.asarray(j_genes, dtype = object)
+    self.v_codes = v_codes
+    self.j_codes = j_codes
+    self.cdr3 = cdr3
+    self.count = count
+    self.freq = freq
+    self.offsets = offsets
+    self.subjects = None if subjects is None else np.asarray(subjects, dtype = object)
+    self.subject_codes = subject_codes
+    self.singleton = singleton
+    self._index = None
+    self._cdf = dict()
+
+  @classmethod
+  def from_ref_dict(cls, ref_dict):
+    """
+    Flatten a dictionary of (v,j) -> pd.DataFrame, as produced by TCRsampler.build_background.
+
+    Parameters
+    ----------
+    ref_dict : dict
+
+    Returns
+    -------
+    blocks : BackgroundBlocks
+    """
+    keys = list(ref_dict.keys())
+    frames = [ref_dict[k] for k in keys]
+    df = pd.concat(frames, ignore_index = True)
+    v_genes, v_codes = np.unique(np.asarray(df['v_reps'], dtype = object).astype(str), return_inverse = True)
+    j_genes, j_codes = np.unique(np.asarray(df['j_reps'], dtype = object).astype(str), return_inverse = True)
+    offsets = np.zeros(len(frames) + 1, dtype = np.int64)
+    np.cumsum([f.shape[0] for f in frames], out = offsets[1:])
+    if 'subject' in df.columns:
+      subjects, subject_codes = np.unique(np.asarray(df['subject'], dtype = object).astype(str), return_inverse = True)
+      subject_codes = subject_codes.astype(np.int32)
+    else:
+      subjects, subject_codes = None, None
+    return cls(v_genes = v_genes,
+               j_genes = j_genes,
+               v_codes = v_codes.astype(np.int32),
+               j_codes = j_codes.astype(np.int32),
+               cdr3 = PackedStrings.from_strings(df['cdr3']),
+               count = _as_count(df['count']),
+               freq = np.asarray(df['freq'], dtype = np.float64),
+               offsets = offsets,
+               subjects = subjects,
+               subject_codes = subject_codes)
+
+  def __len__(self):
+    return self.offsets.shape[0] - 1
+
+  @property
+  def n_rows(self):
+    return int(self.offsets[-1])
+
+  def key(self, gid):
+    """ Return the (v,j) gene name tuple of block gid """
+    start = self.offsets[gid]
+    return (self.v_genes[self.v_codes[start]], self.j_genes[self.j_codes[start]])
+
+  def keys(self):
+    """ Return (v,j) tuples of all blocks in storage order """
+    starts = self.offsets[:-1]
+    return list(zip(self.v_genes[self.v_codes[starts]], self.j_genes[self.j_codes[starts]]))
+
+  @property
+  def index(self):
+    """ dict of (v,j) -> block id, built on first use """
+    if self._index is None:
+      self._index = {k:i for i,k in enumerate(self.keys())}
+    return self._index
+
+  def block_ids(self):
+    """ Return the block id of every row """
+    return np.repeat(np.arange(len(self), dtype = np.int64), np.diff(self.offsets))
+
+  def as_reference(self):
+    """ Return the rows of the background as a CompactReference (arrays are shared, not copied) """
+    return CompactReference(v_genes = self.v_genes,
+                            j_genes = self.j_genes,
+                            v_codes = self.v_codes,
+                            j_codes = self.j_codes,
+                            cdr3 = self.cdr3,
+                            count = self.count,
+                            freq = self.freq,
+                            subjects = self.subjects,
+                            subject_codes = self.subject_codes)
+
+  def pool(self, gids):
+    """
+    Return the rows of several blocks as a background with a single block.
+
+    Parameters
+    ----------
+    gids : array-like of int
+      block ids
+
+    Returns
+    -------
+    pooled : BackgroundBlocks
+      one block holding the rows of gids in order, sampled by their weights across the
+      pool; the CDR3 strings are shared (see IndexedStrings)
+    """
+    gids = np.asarray(gids, dtype = np.int64)
+    starts = self.offsets[gids]
+    lengths = self.offsets[gids + 1] - starts
+    total = int(lengths.sum())
+    rows = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(total, dtype = np.int64)
+    return BackgroundBlocks(v_genes = self.v_genes,
+                            j_genes = self.j_genes,
+                            v_codes = self.v_codes[rows],
+                            j_codes = self.j_codes[rows],
+                            cdr3 = self.cdr3.view(rows),
+                            count = self.count[rows],
+                            freq = self.freq[rows],
+                            offsets = np.array([0, total], dtype = np.int64),
+                            subjects = self.subjects,
+                            subject_codes = None if self.subject_codes is None else self.subject_codes[rows],
+                            singleton = self.singleton)
+
+  def without_subjects(self, codes):
+    """
+    Return a view of the background without the rows of some subjects.
+
+    Parameters
+    ----------
+    codes : array-like of int
+      subject codes to leave out
+
+    Returns
+    -------
+    view : BackgroundBlocks
+      blocks holding the other rows in their current order; (v,j) pairs left without
+      rows are dropped. The CDR3 strings are shared (see IndexedStrings), the per-row
+      numeric arrays of the kept rows are gathered and the sampling tables are
+      computed on first use.
+    """
+    if self.subject_codes is None:
+      raise KeyError("Leaving out subjects requires a 'subject' column in the reference")
+    rows = np.flatnonzero(~np.isin(self.subject_codes, np.asarray(codes, dtype = np.int64)))
+    kept = np.bincount(self.block_ids()[rows], minlength = len(self))
+    offsets = np.zeros(np.count_nonzero(kept) + 1, dtype = np.int64)
+    np.cumsum(kept[kept > 0], out = offsets[1:])
+    return BackgroundBlocks(v_genes = self.v_genes,
+                            j_genes = self.j_genes,
+                            v_codes = self.v_codes[rows],
+                            j_codes = self.j_codes[rows],
+                            cdr3 = self.cdr3.view(rows),
+                            count = self.count[rows],
+                            freq = self.freq[rows],
+                            offsets = offsets,
+                            subjects = self.subjects,
+                            subject_codes = self.subject_codes[rows],
+                            singleton = self.singleton)
+
+  def weights(self, use_frequency = True):
+    """ Return the per-row sampling weights (ones if singleton) """
+    if self.singleton:
+      return np.ones(self.n_rows, dtype = np.float64)
+    return np.asarray(self.freq if use_frequency else self.count, dtype = np.float64)
+
+  def cdf(self, use_frequency = True):
+    """
+    Per-block cumulative selection probabilities, computed once and memoized.
+
+    Parameters
+    ----------
+    use_frequency : bool
+      If True, rows are weighted by frequency. If False, by raw counts.
+
+    Returns
+    -------
+    cdf : np.ndarray
+      float64 array aligned with rows; within each block it increases to exactly 1.0
+
+    Notes
+    -----
+    Drawing u ~ U[0,1) and taking np.searchsorted(cdf[start:stop], u, side = 'right') is how
+    np.random.choice(p = weights / weights.sum()) draws, so seeded results are unchanged,
+    but normalization is paid once per build instead of once per call. Blocks whose
+    weights sum to zero are sampled uniformly.
+    """
+    key = 'freq' if use_frequency else 'count'
+    if key not in self._cdf:
+      self._cdf[key] = _segmented_cdf(self.weights(use_frequency), self.offsets)
+    return self._cdf[key]
+
+  def precompute_cdfs(self):
+    """ Compute both the frequency and count sampling tables """
+    self.cdf(use_frequency = True)
+    self.cdf(use_frequency = False)
+
+  def draw(self, gid, uniforms, use_frequency = True):
+    """
+    Map uniform random numbers to row indices of block gid.
+
+    Parameters
+    ----------
+    gid : int
+      block id
+    uniforms : np.ndarray
+      random numbers in [0,1)
+    use_frequency : bool
+      If True, rows are weighted by frequency. If False, by raw counts.
+
+    Returns
+    -------
+    rows : np.ndarray
+      int64 row indices into the flat arrays
+    """
+    start, stop = int(self.offsets[gid]), int(self.offsets[gid+1])
+    return start + np.searchsorted(self.cdf(use_frequency)[start:stop], uniforms, side = 'right')
+
+  @property
+  def block_table(self):
+    """ Dense (n_v, n_j) array of block ids, -1 where a (v,j) pair has no block """
+    if getattr(self, '_block_table', None) is None:
+      table = np.full((self.v_genes.shape[0], self.j_genes.shape[0]), -1, dtype = np.int64)
+      starts = self.offsets[:-1]
+      table[self.v_codes[starts], self.j_codes[starts]] = np.arange(len(self))
+      self._block_table = table
+    return self._block_table
+
+  def lookup(self, v, j):
+    """
+    Vectorized (v,j) -> block id lookup.
+
+    Parameters
+    ----------
+    v : array-like of str
+    j : array-like of str
+
+    Returns
+    -------
+    gids : np.ndarray
+      int64 block ids, -1 where the (v,j) pair is not in the background
+    """
+    v_codes = pd.Index(self.v_genes).get_indexer(np.asarray(v, dtype = object))
+    j_codes = pd.Index(self.j_genes).get_indexer(np.asarray(j, dtype = object))
+    found = (v_codes >= 0) & (j_codes >= 0)
+    gids = np.full(v_codes.shape[0], -1, dtype = np.int64)
+    gids[found] = self.block_table[v_codes[found], j_codes[found]]
+    return gids
+
+  def keyed_cdf(self, use_frequency = True):
+    """ cdf(use_frequency) plus the block id of every row (see draw_many), memoized """
+    key = 'keyed_' + ('freq' if use_frequency else 'count')
+    if key not in self._cdf:
+      self._cdf[key] = self.cdf(use_frequency) + self.block_ids()
+    return self._cdf[key]
+
+  def draw_many(self, gids, sizes, rng, use_frequency = True):
+    """
+    Draw sizes[i] rows from block gids[i] for every i in one pass.
+
+    Parameters
+    ----------
+    gids : np.ndarray
+      block ids; entries < 0 must have size 0
+    sizes : np.ndarray
+      number of draws per block id
+    rng : np.random.Generator or tcrsampler.streams.RequestStreams
+      with RequestStreams, the draws for gids[i] come from the stream of request i
+    use_frequency : bool
+      If True, rows are weighted by frequency. If False, by raw counts.
+
+    Returns
+    -------
+    rows : np.ndarray
+      int64 row indices, grouped in the order of gids
+
+    Notes
+    -----
+    Adding the block id to each block's CDF gives one non-decreasing array over all
+    rows, so a single np.searchsorted of (gid + u) resolves every draw.
+    """
+    keyed = self.keyed_cdf(use_frequency)
+    rep = np.repeat(np.asarray(gids, dtype = np.int64), sizes)
+    u = rng.uniforms(sizes) if hasattr(rng, 'uniforms') else rng.random(rep.shape[0])
+    rows = np.searchsorted(keyed, rep + u, side = 'right')
+    # gid + u can round up to gid + 1 for u close to 1; keep such draws in their block
+    return np.minimum(rows, self.offsets[rep + 1] - 1)
+
+  def draw_distinct(self, gids, sizes, rng, use_frequency = True):
+    """
+    Draw sizes[i] distinct rows from block gids[i] for every i in one pass, weighted
+    sampling without replacement.
+
+    Parameters
+    ----------
+    gids : np.ndarray
+      block ids; entries < 0 must have size 0
+    sizes : np.ndarray
+      number of draws per block id; a block smaller than its size gives all its rows
+    rng : np.random.Generator or tcrsampler.streams.RequestStreams
+      with RequestStreams, the keys of block gids[i] come from the stream of request i
+    use_frequency : bool
+      If True, rows are weighted by frequency. If False, by raw counts.
+
+    Returns
+    -------
+    rows : np.ndarray
+      int64 row indices, grouped in the order of gids
+    counts : np.ndarray
+      int64 number of rows drawn for each gid, min(sizes[i], block size)
+    """
+    gids = np.asarray(gids, dtype = np.int64)
+    sizes = np.asarray(sizes, dtype = np.int64)
+    starts = self.offsets[np.maximum(gids, 0)]
+    lengths = np.where((gids >= 0) & (sizes > 0), self.offsets[np.maximum(gids, 0) + 1] - starts, 0)
+    # rows of every requested block, back-to-back
+    first = np.cumsum(lengths) - lengths
+    rows = np.repeat(starts - first, lengths) + np.arange(int(lengths.sum()), dtype = np.int64)
+    weights = self.weights(use_frequency)[rows]
+    u = rng.uniforms(lengths) if hasattr(rng, 'uniforms') else rng
+    index, counts = _weighted_top_k(weights, lengths, sizes, u)
+    return rows[index], counts
+
+  def draw_counts(self, gids, sizes, rng, use_frequency = True, max_cells = 2**22):
+    """
+    Draw sizes[i] rows with replacement from block gids[i] for every i, returned as
+    the distinct rows drawn and how many times each was drawn.
+
+    Parameters
+    ----------
+    gids : np.ndarray
+      block ids; entries < 0 must have size 0
+    sizes : np.ndarray
+      number of draws per block id
+    rng : np.random.Generator
+    use_frequency : bool
+      If True, rows are weighted by frequency. If False, by raw counts.
+    max_cells : int
+      upper bound on the size of the padded probability matrix of one multinomial call
+
+    Returns
+    -------
+    rows : np.ndarray
+      int64 row indices of the rows drawn at least once, grouped in the order of gids
+    counts : np.ndarray
+      int64 number of times each row was drawn
+    n_distinct : np.ndarray
+      int64 number of distinct rows drawn for each gid
+
+    Notes
+    -----
+    The counts of each block are one multinomial draw over its weights, so time and
+    memory scale with the block sizes rather than with sizes. Blocks are padded with
+    zero probabilities to a common length and drawn with one Generator.multinomial
+    call per chunk of blocks of similar length.
+    """
+    gids = np.asarray(gids, dtype = np.int64)
+    sizes = np.asarray(sizes, dtype = np.int64)
+    starts = self.offsets[np.maximum(gids, 0)]
+    lengths = np.where((gids >= 0) & (sizes > 0), self.offsets[np.maximum(gids, 0) + 1] - starts, 0)
+    first = np.cumsum(lengths) - lengths
+    counts = np.zeros(int(lengths.sum()), dtype = np.int64)
+    weights = self.weights(use_frequency)
+    order = np.argsort(lengths, kind = 'stable')
+    order = order[lengths[order] > 0]
+    i = 0
+    while i < order.shape[0]:
+      # chunks of blocks sorted by length, so padding stays small
+      stop = i + 1
+      while stop < order.shape[0] and (stop + 1 - i) * lengths[order[stop]] <= max_cells:
+        stop += 1
+      chunk = order[i:stop]
+      width = int(lengths[chunk].max())
+      mask = np.arange(width)[None, :] < lengths[chunk][:, None]
+      idx = starts[chunk][:, None] + np.arange(width)[None, :]
+      w = np.where(mask, np.asarray(weights[np.where(mask, idx, 0)], dtype = np.float64), 0.0)
+      w = np.where(w > 0, w, 0.0)
+      # blocks with no weight are sampled uniformly, as in the CDFs
+      zero = ~(w.sum(axis = 1) > 0)
+      w[zero] = mask[zero]
+      p = w / w.sum(axis = 1, keepdims = True)
+      drawn = rng.multinomial(sizes[chunk], p)
+      counts[(first[chunk][:, None] + np.arange(width)[None, :])[mask]] = drawn[mask]
+      i = stop
+    rows = np.repeat(starts - first, lengths) + np.arange(counts.shape[0], dtype = np.int64)
+    keep = counts > 0
+    block = np.repeat(np.arange(gids.shape[0]), lengths)
+    return rows[keep], counts[keep], np.bincount(block[keep], minlength = gids.shape[0]).astype(np.int64)
+
+  def frame(self, gid):
+    """
+    Materialize block gid as a pd.DataFrame in the layout of a ref_dict value.
+
+    Parameters
+    ----------
+    gid : int
+      block id
+
+    Returns
+    -------
+    df : pd.DataFrame
+      DataFrame with ['v_reps','j_reps','cdr3', 'count','freq'] columns (and 'subject' if available)
+    """
+    start, stop = int(self.offsets[gid]), int(self.offsets[gid+1])
+    v, j = self.key(gid)
+    n = stop - start
+    d = {'v_reps' : [v] * n,
+         'j_reps' : [j] * n,
+         'cdr3'   : self.cdr3.take(np.arange(start, stop)),
+         'count'  : np.ones(n, dtype = np.int64) if self.singleton else np.array(self.count[start:stop]),
+         'freq'   : np.ones(n, dtype = np.float64) if self.singleton else np.array(self.freq[start:stop])}
+    if self.subject_codes is not None:
+      d['subject'] = self.subjects[self.subject_codes[start:stop]]
+    return pd.DataFrame(d)
+
+
+def _factorize(values):
+  """
+  Return (sorted vocabulary, int32 codes) for a column; missing values get code -1.
+  """
+  codes, uniques = pd.factorize(np.asarray(values, dtype = object), sort = True)
+  return np.asarray(uniques, dtype = object), codes.astype(np.int32)
+
+
+def _recode(vocab, old_vocab, codes):
+  """
+  Map codes into old_vocab onto vocab, appending the names of old_vocab that vocab lacks.
+  """
+  vocab = np.asarray(vocab, dtype = object)
+  old_vocab = np.asarray(old_vocab, dtype = object)
+  mapping = pd.Index(vocab).get_indexer(old_vocab)
+  new = mapping < 0
+  if np.any(new):
+    mapping[new] = vocab.shape[0] + np.arange(np.sum(new))
+    vocab = np.concatenate([vocab, old_vocab[new]])
+  codes = np.asarray(codes)
+  return vocab, np.where(codes >= 0, mapping[np.maximum(codes, 0)] if mapping.shape[0] else -1, -1).astype(np.int32)
+
+
+def _as_count(values):
+  """
+  Return counts as int64, or as float64 if they are not all integers (e.g. contain NaN).
+  """
+  a = pd.Series(values)
+  if pd.api.types.is_integer_dtype(a.dtype) and not a.isna().any():
+    return a.to_numpy(dtype = np.int64)
+  return a.to_numpy(dtype = np.float64, na_value = np.nan)
+
+
+def _segmented_cdf(weights, offsets):
+  """
+  Normalized cumulative sum of weights restarted at every block in offsets.
+  """
+  n = weights.shape[0]
+  cdf = np.zeros(n, dtype = np.float64)
+  if n == 0:
+    return cdf
+  sizes = np.diff(offsets)
+  starts = offsets[:-1][sizes > 0]
+  sizes = sizes[sizes > 0]
+  totals = np.add.reduceat(weights, starts)
+  # blocks with no weight are sampled uniformly
+  zero = ~(totals > 0)
+  if np.any(zero):
+    weights = weights.copy()
+    weights[np.repeat(zero, sizes)] = 1.0
+    totals[zero] = sizes[zero]
+  p = weights / np.repeat(totals, sizes)
+  # each block of p sums to 1, so the running sum stays small and subtracting the
+  # running total at the block start loses almost no precision
+  running = np.cumsum(p)
+  base = running[starts] - p[starts]
+  cdf = running - np.repeat(base, sizes)
+  last = starts + sizes - 1
+  cdf /= np.repeat(cdf[last], sizes)
+  cdf[last] = 1.0
+  return cdf
+
+
+def _weighted_top_k(weights, lengths, k, rng):
+  """
+  Weighted sampling without replacement of k[i] items from every segment of weights.
+
+  Parameters
+  ----------
+  weights : np.ndarray
+    non-negative weights of consecutive segments
+  lengths : np.ndarray
+    length of each segment
+  k : np.ndarray
+    items to draw per segment; capped at the segment length
+  rng : np.random.Generator or np.ndarray
+    generator, or one uniform number in [0,1) per item
+
+  Returns
+  -------
+  index : np.ndarray
+    int64 positions into weights, grouped by segment, each group in draw order
+  counts : np.ndarray
+    items drawn per segment, min(k, lengths)
+
+  Notes
+  -----
+  Gumbel-top-k in its exponential race form: every item gets the key log(u) / w and
+  the k largest keys of a segment are a weighted draw without replacement, in the
+  order of successive draws. One lexsort over all segments ranks every key at once.
+  Items with zero weight come last; segments without weight are drawn uniformly.
+  """
+  lengths = np.asarray(lengths, dtype = np.int64)
+  counts = np.minimum(np.asarray(k, dtype = np.int64), lengths)
+  n = weights.shape[0]
+  seg = np.repeat(np.arange(lengths.shape[0]), lengths)
+  w = np.where(weights > 0, weights, 0.0).astype(np.float64)
+  totals = np.bincount(seg, weights = w, minlength = lengths.shape[0])
+  w[(totals <= 0)[seg]] = 1.0
+  with np.errstate(divide = 'ignore'):
+    keys = np.log(rng if isinstance(rng, np.ndarray) else rng.random(n)) / w
+  order = np.lexsort((-keys, seg))
+  starts = np.cumsum(lengths) - lengths
+  position = np.arange(n) - np.repeat(starts, lengths)
+  return order[position < np.repeat(counts, lengths)], counts
+
+
+def _segment_starts(key):
+  """
+  Return the start position of every run of equal values in a sorted 1-D array.
+  """
+  if key.shape[0] == 0:
+    return np.zeros(0, dtype = np.int64)
+  return np.flatnonzero(np.concatenate([[True], key[1:] != key[:-1]]))
+
+
+def build_blocks(df, max_rows = 100, stratify_by_subject = False, use_frequency = True, make_singleton = False):
+  """
+  Build a BackgroundBlocks from a reference DataFrame without iterating over (v,j) groups.
+
+  Parameters
+  ----------
+  df : pd.DataFrame or CompactReference
+    DataFrame with ['v_reps','j_reps','cdr3', 'count','freq'] columns (and 'subject' if stratify_by_subject)
+  max_rows : int
+    Maximum clones per v,j pair (per subject)
+  stratify_by_subject : bool
+    If True, max_rows will apply to v,j,subject. If False, max_rows applies to v,j
+  use_frequency : bool
+    If True, uses frequency for ranking rows. If False, uses raw counts.
+  make_singleton : bool
+    If True, rows are ranked by frequency or counts, but presented and sampled with count and freq of 1.
+
+  Returns
+  -------
+  blocks : BackgroundBlocks
+
+  Notes
+  -----
+  All rows are ordered with one stable np.lexsort on (v, j[, subject], -weight). The rank of
+  a row within its (v,j[,subject]) run is its position minus the start of the run, so the
+  top max_rows of every group are selected with a single boolean mask. Ties in weight keep
+  their input order. Rows with a missing gene (or subject, when stratifying) are dropped, as
+  pandas groupby does.
+  """
+  if isinstance(df, CompactReference):
+    ref = df
+  else:
+    ref = CompactReference.from_dataframe(df, compact = False)
+  v_genes, v_codes = ref.v_genes, ref.v_codes
+  j_genes, j_codes = ref.j_genes, ref.j_codes
+  subjects, subject_codes = ref.subjects, ref.subject_codes
+  if stratify_by_subject and subject_codes is None:
+    raise KeyError("stratify_by_subject = True requires a 'subject' column")
+  weight = np.asarray(ref.freq if use_frequency else ref.count, dtype = np.float64)
+
+  keep = (v_codes >= 0) & (j_codes >= 0)
+  if stratify_by_subject:
+    keep &= subject_codes >= 0
+
+  n_j = max(j_genes.shape[0], 1)
+  vj_key = v_codes.astype(np.int64) * n_j + j_codes
+  if stratify_by_subject:
+    rank_key = vj_key * max(subjects.shape[0], 1) + subject_codes
+  else:
+    rank_key = vj_key
+  order = np.lexsort((-weight, rank_key))
+  order = order[keep[order]]
+
+  # rank of every row within its (v,j[,subject]) run, then keep the top max_rows
+  sorted_key = rank_key[order]
+  starts = _segment_starts(sorted_key)
+  sizes = np.diff(np.append(starts, sorted_key.shape[0]))
+  rank = np.arange(sorted_key.shape[0]) - np.repeat(starts, sizes)
+  order = order[rank < max_rows]
+
+  block_starts = _segment_starts(vj_key[order])
+  offsets = np.append(block_starts, order.shape[0]).astype(np.int64)
+  return BackgroundBlocks(v_genes = v_genes,
+                          j_genes = j_genes,
+                          v_codes = v_codes[order],
+                          j_codes = j_codes[order],
+                          cdr3 = ref.take_cdr3(order),
+                          count = ref.count[order],
+                          freq = ref.freq[order],
+                          offsets = offsets,
+                          subjects = subjects,
+                          subject_codes = None if subject_codes is None else subject_codes[order],
+                          singleton = make_singleton)
+
+
+class LazyBlocks():
+  """
+  Group index over a reference whose (v,j) blocks are built the first time they are used.
+
+  Only the rows of every (v,j) pair are located up front (one stable sort on the integer
+  (v,j) code); ranking, truncation to max_rows and the sampling tables of a pair are
+  computed by block() on first use and memoized. Blocks are identical to the ones
+  build_blocks produces for the whole reference.
+
+  Attributes
+  ----------
+  ref : CompactReference
+    reference rows
+  build_params : dict
+    keyword arguments passed on to build_blocks
+  offsets : np.ndarray
+    int64 array of length n_blocks + 1; the reference rows of block i are
+    order[offsets[i]:offsets[i+1]]
+  order : np.ndarray
+    reference row indices grouped by (v,j), in input order within a pair
+
+  Example
+  -------
+  >>> lazy = LazyBlocks(ref, max_rows = 100)
+  >>> lazy.block(lazy.index[('TRBV9*01','TRBJ2-7*01')]).frame(0)
+  """
+  def __init__(self, ref, max_rows = 100, stratify_by_subject = False, use_frequency = True, make_singleton = False):
+    if not isinstance(ref, CompactReference):
+      ref = CompactReference.from_dataframe(ref, compact = False)
+    if stratify_by_subject and ref.subject_codes is None:
+      raise KeyError("stratify_by_subject = True requires a 'subject' column")
+    self.ref = ref
+    self.build_params = {'max_rows' : max_rows,
+                         'stratify_by_subject' : stratify_by_subject,
+                         'use_frequency' : use_frequency,
+                         'make_singleton' : make_singleton}
+    keep = (ref.v_codes >= 0) & (ref.j_codes >= 0)
+    if stratify_by_subject:
+      keep &= ref.subject_codes >= 0
+    n_j = max(ref.j_genes.shape[0], 1)
+    vj_key = ref.v_codes.astype(np.int64) * n_j + ref.j_codes
+    rows = np.flatnonzero(keep)
+    self.order = rows[np.argsort(vj_key[rows], kind = 'stable')]
+    starts = _segment_starts(vj_key[self.order])
+    self.offsets = np.append(starts, self.order.shape[0]).astype(np.int64)
+    self.v_genes, self.j_genes, self.subjects = ref.v_genes, ref.j_genes, ref.subjects
+    self._index = None
+    self._blocks = dict()
+    self._full = None
+
+  def __len__(self):
+    return self.offsets.shape[0] - 1
+
+  def key(self, gid):
+    """ Return the (v,j) gene name tuple of block gid """
+    row = self.order[self.offsets[gid]]
+    return (self.v_genes[self.ref.v_codes[row]], self.j_genes[self.ref.j_codes[row]])
+
+  def keys(self):
+    """ Return (v,j) tuples of all blocks in storage order """
+    rows = self.order[self.offsets[:-1]]
+    return list(zip(self.v_genes[self.ref.v_codes[rows]], self.j_genes[self.ref.j_codes[rows]]))
+
+  @property
+  def index(self):
+    """ dict of (v,j) -> block id, built on first use """
+    if self._index is None:
+      self._index = {k:i for i,k in enumerate(self.keys())}
+    return self._index
+
+  @property
+  def n_materialized(self):
+    """ number of blocks built so far """
+    return len(self._blocks)
+
+  def block(self, gid):
+    """
+    Return block gid as a BackgroundBlocks holding that single block (block id 0).
+    """
+    if gid not in self._blocks:
+      rows = self.order[self.offsets[gid]:self.offsets[gid+1]]
+      blocks = build_blocks(self.ref.take(rows), **self.build_params)
+      blocks.precompute_cdfs()
+      self._blocks[gid] = blocks
+    return self._blocks[gid]
+
+  def frame(self, gid):
+    """ Materialize block gid as a pd.DataFrame in the layout of a ref_dict value """
+    return self.block(gid).frame(0)
+
+  def materialize(self):
+    """
+    Build (once) and return every block as a single BackgroundBlocks, as build_blocks would.
+    """
+    if self._full is None:
+      self._full = build_blocks(self.ref, **self.build_params)
+      self._full.precompute_cdfs()
+    return self._full
+
+
+class BlockDict(dict):
+  """
+  Lazy, dict-compatible view of BackgroundBlocks, keyed on (v,j) tuples pointing to pd.DataFrame.
+
+  DataFrames are only built the first time a key is accessed and are then memoized,
+  so ref_dict stays cheap for backgrounds with thousands of (v,j) pairs. Keys whose 
+  DataFrame has been handed out (or set) are sampled from that DataFrame, so that edits
+  made to it in place are honored by TCRsampler.sample and sample_background; all other
+  keys are sampled from the blocks. sample_batch and sample_counts always use the blocks.
+
+  Attributes
+  ----------
+  blocks : BackgroundBlocks or LazyBlocks
+  fallback : FallbackIndex or None
+    substitutes for missing keys, set by TCRsampler on first use and reset whenever keys change
+  """
+  def __init__(self, blocks):
+    super().__init__()
+    self.blocks = blocks
+    self.fallback = None
+    self._dropped = set()
+
+  def _in_blocks(self, key):
+    return key in self.blocks.index and key not in self._dropped
+
+  def handed_out(self, key):
+    """ True if a DataFrame of key has been returned to a caller or set by one """
+    return dict.__contains__(self, key)
+
+  def frame(self, key):
+    """ DataFrame of key, without memoizing (and so handing out) a newly built one """
+    if dict.__contains__(self, key):
+      return dict.__getitem__(self, key)
+    if not self._in_blocks(key):
+      raise KeyError(key)
+    return self.blocks.frame(self.blocks.index[key])
+
+  def __getitem__(self, key):
+    if dict.__contains__(self, key):
+      return dict.__getitem__(self, key)
+    if not self._in_blocks(key):
+      raise KeyError(key)
+    frame = self.blocks.frame(self.blocks.index[key])
+    # pooled fallbacks built from the blocks would not see edits to the frame
+    self.fallback = None
+    dict.__setitem__(self, key, frame)
+    return frame
+
+  def __setitem__(self, key, value):
+    self.fallback = None
+    self._dropped.discard(key)
+    dict.__setitem__(self, key, value)
+
+  def __delitem__(self, key):
+    if key not in self:
+      raise KeyError(key)
+    self.fallback = None
+    if dict.__contains__(self, key):
+      dict.__delitem__(self, key)
+    if key in self.blocks.index:
+      self._dropped.add(key)
+
+  def __contains__(self, key):
+    return dict.__contains__(self, key) or self._in_blocks(key)
+
+  def __iter__(self):
+    for key in self.blocks.index:
+      if key not in self._dropped:
+        yield key
+    for key in dict.keys(self):
+      if key not in self.blocks.index:
+        yield key
+
+  def __len__(self):
+    return sum(1 for _ in self)
+
+  def __repr__(self):
+    return f"BlockDict({len(self)} (v,j) blocks)"
+
+  def keys(self):
+    return KeysView(self)
+
+  def values(self):
+    return ValuesView(self)
+
+  def items(self):
+    return ItemsView(self)
+
+  def get(self, key, default = None):
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+  def pop(self, key, *default):
+    try:
+      value = self[key]
+    except KeyError:
+      if default:
+        return default[0]
+      raise
+    del self[key]
+    return value
+
+  def popitem(self):
+    keys = list(self)
+    if len(keys) == 0:
+      raise KeyError('popitem(): dictionary is empty')
+    key = keys[-1]
+    return key, self.pop(key)
+
+  def copy(self):
+    return {k:v for k,v in self.items()}
+
+  def __reduce__(self):
+    # rebuilt from the blocks; only frames that were handed out or set (and so may have
+    # been edited) are pickled as frames
+    handed_out = {k : dict.__getitem__(self, k) for k in dict.keys(self)}
+    return (_restore_block_dict, (self.blocks, set(self._dropped), handed_out))
+
+
+def _restore_block_dict(blocks, dropped, handed_out):
+  d = BlockDict(blocks)
+  for key, value in handed_out.items():
+    dict.__setitem__(d, key, value)
+  d._dropped = dropped
+  return d
@@ -0,0 +1,172 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+from tcrsampler.blocks import CompactReference, PackedStrings
+from tcrsampler.compiled import compile_background, load_compiled_background, FORMAT_VERSION
+
+__all__ = ['BackgroundCache', 'default_cache_dir']
+
+_fingerprint_columns = ['v_reps', 'j_reps', 'cdr3', 'count', 'freq', 'subject']
+
+
+def default_cache_dir():
+  """
+  Return the default cache directory, $TCRSAMPLER_CACHE_DIR or ~/.cache/tcrsampler
+  """
+  return os.environ.get('TCRSAMPLER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'tcrsampler'))
+
+
+class BackgroundCache():
+  """
+  Size-bounded, least-recently-used on-disk cache of built backgrounds.
+
+  Each entry is a compiled background (see tcrsampler.compiled) named by a fingerprint
+  of the reference data and the build_background parameters, so a repeated build with
+  identical inputs is replaced by memory-mapping the stored result.
+
+  Attributes
+  ----------
+  path : str
+    cache directory
+  max_bytes : int
+    once the cache grows beyond this size, least recently used entries are removed
+
+  Example
+  -------
+  >>> t.build_background(max_rows = 100, cache = BackgroundCache(max_bytes = 2 * 1024**3))
+  """
+  def __init__(self, path = None, max_bytes = 2 * 1024**3):
+    self.path = default_cache_dir() if path is None else path
+    self.max_bytes = max_bytes
+
+  @classmethod
+  def resolve(cls, cache):
+    """
+    Turn the cache argument of build_background into a BackgroundCache.
+
+    Parameters
+    ----------
+    cache : BackgroundCache, str or True
+      a cache, a cache directory, or True for the default directory
+    """
+    if isinstance(cache, cls):
+      return cache
+    if cache is True:
+      return cls()
+    if isinstance(cache, str):
+      return cls(path = cache)
+    raise TypeError("cache must be a BackgroundCache, a directory name or True")
+
+  def fingerprint(self, df, params):
+    """
+    Hash the reference columns used by build_background together with its parameters.
+
+    Parameters
+    ----------
+    df : pd.DataFrame or CompactReference
+      reference data
+    params : dict
+      build_background keyword arguments
+
+    Returns
+    -------
+    key : str
+      hex digest naming the cache entry
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps({'format_version' : FORMAT_VERSION, 'params' : params}, sort_keys = True).encode())
+    if isinstance(df, CompactReference):
+      for a in [df.v_genes, df.j_genes, df.subjects]:
+        h.update(json.dumps(None if a is None else [str(x) for x in a]).encode())
+      for a in [df.v_codes, df.j_codes, df.subject_codes, df.count, df.freq]:
+        h.update(b'' if a is None else np.ascontiguousarray(a).tobytes())
+      if isinstance(df.cdr3, PackedStrings):
+        h.update(np.asarray(df.cdr3.buffer).tobytes())
+        h.update(np.asarray(df.cdr3.offsets).tobytes())
+      else:
+        h.update(pd.util.hash_pandas_object(pd.Series(df.cdr3), index = False).values.tobytes())
+      return h.hexdigest()
+    for col in _fingerprint_columns:
+      if col in df.columns:
+        h.update(col.encode())
+        h.update(pd.util.hash_pandas_object(df[col], index = False).values.tobytes())
+    return h.hexdigest()
+
+  def _entry(self, key):
+    return os.path.join(self.path, key)
+
+  def load(self, key, sampler):
+    """
+    Populate sampler from the entry named key.
+
+    Returns
+    -------
+    hit : bool
+      False if there is no such entry
+    """
+    path = self._entry(key)
+    if not os.path.isfile(os.path.join(path, 'meta.json')):
+      return False
+    try:
+      load_compiled_background(path, sampler = sampler)
+    except (OSError, ValueError):
+      # unreadable or stale entry; drop it and rebuild
+      shutil.rmtree(path, ignore_errors = True)
+      return False
+    os.utime(path, None)
+    return True
+
+  def store(self, key, sampler):
+    """
+    Write the built background of sampler as entry key, then evict down to max_bytes.
+
+    An existing entry is kept: the same key means the same background, so an entry stored
+    by another process (even while this one was writing) counts as a hit.
+    """
+    try:
+      compile_background(sampler, self._entry(key), overwrite = False)
+    except FileExistsError:
+      os.utime(self._entry(key), None)
+    self.evict(keep = key)
+
+  def entries(self):
+    """
+    Return (key, size in bytes, last use time) of every entry, least recently used first.
+    """
+    if not os.path.isdir(self.path):
+      return []
+    entries = list()
+    for key in os.listdir(self.path):
+      path = self._entry(key)
+      if key.startswith('.') or not os.path.isdir(path):
+        continue
+      size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+      entries.append((key, size, os.path.getmtime(path)))
+    return sorted(entries, key = lambda x: x[2])
+
+  def evict(self, keep = None):
+    """
+    Remove least recently used entries until the cache fits in max_bytes.
+
+    Parameters
+    ----------
+    keep : str or None
+      key that must not be evicted (e.g. the entry just written)
+    """
+    entries = self.entries()
+    total = np.sum([size for _, size, _ in entries])
+    for key, size, _ in entries:
+      if total <= self.max_bytes:
+        break
+      if key == keep:
+        continue
+      shutil.rmtree(self._entry(key), ignore_errors = True)
+      total -= size
+
+  def clear(self):
+    """ Remove every entry """
+    for key, _, _ in self.entries():
+      shutil.rmtree(self._entry(key), ignore_errors = True)
@@ -0,0 +1,252 @@
+import os
+import json
+import threading
+import tempfile
+import pandas as pd
+from tcrsampler.setup_db import sha256sum
+from tcrsampler.compiled import COMPILED_SUFFIX, load_compiled_background
+from tcrsampler.parquet import PARQUET_SUFFIX, parquet_summary
+
+__all__ = ['Catalog', 'MANIFEST_NAME', 'default_db_path']
+
+MANIFEST_NAME = "manifest.json"
+
+# files in db/ that are gene tables of tcrdist, not backgrounds
+_not_backgrounds = ['alphabeta_db.tsv', 'gammadelta_db.tsv']
+
+_species = ['human', 'mouse']
+_chains = {'alpha' : 'alpha', 'beta' : 'beta', 'gamma' : 'gamma', 'delta' : 'delta',
+           'a' : 'alpha', 'b' : 'beta', 'g' : 'gamma', 'd' : 'delta'}
+
+# manifests are rewritten whole; concurrent installs in one process take turns
+_lock = threading.Lock()
+
+
+def default_db_path():
+  """ Return the db/ folder of the package, where default backgrounds are installed """
+  return os.path.join(os.path.dirname(os.path.realpath(__file__)), 'db')
+
+
+def _is_background_file(filename):
+  return (filename.endswith('sv') or filename.endswith(PARQUET_SUFFIX)) and filename not in _not_backgrounds
+
+
+def _infer_species_chain(name):
+  """
+  Guess species and chain from a file name such as 'britanova_human_beta_t_cb.tsv.sampler.tsv'
+  or 'new_nextgen_chains_mouse_A.tsv'.
+  """
+  tokens = name.split(".")[0].lower().split("_")
+  species = next((t for t in tokens if t in _species), None)
+  chain = next((_chains[t] for t in tokens if t in _chains and (len(t) > 1 or t == tokens[-1])), None)
+  return species, chain
+
+
+class Catalog():
+  """
+  Manifest of the backgrounds installed in a db/ folder.
+
+  The manifest (db/manifest.json) holds one record per background with its row and
+  subject counts, species, chain, source, build parameters, SHA-256 checksum and the
+  compiled copy if there is one. It is written when backgrounds are installed
+  (tcrsampler.setup_db) or compiled (TCRsampler.compile_default_background), so listing
+  and querying backgrounds reads one small JSON file and no background.
+
+  Parameters
+  ----------
+  path : str or None
+    db/ folder (default: the package's)
+
+  Example
+  -------
+  >>> cat = Catalog()
+  >>> cat.query(species = 'human', chain = 'beta')
+  >>> t = cat.open('britanova_human_beta_t_cb.tsv.sampler.tsv')
+  """
+  fields = ['name', 'rows', 'subjects', 'species', 'chain', 'source', 'build_params', 'sha256', 'bytes', 'compiled']
+
+  def __init__(self, path = None):
+    self.path = default_db_path() if path is None else path
+    self._records = None
+
+  @property
+  def manifest_path(self):
+    return os.path.join(self.path, MANIFEST_NAME)
+
+  @property
+  def records(self):
+    """ dict of name -> record, read from the manifest on first use """
+    if self._records is None:
+      self._records = self._read()
+    return self._records
+
+  def _read(self):
+    if not os.path.isfile(self.manifest_path):
+      return dict()
+    with open(self.manifest_path) as fh:
+      return {r['name'] : r for r in json.load(fh)['backgrounds']}
+
+  def _update(self, records):
+    """
+    Merge records into the manifest on disk, re-reading it first so that records
+    written by other Catalog objects are kept; the file is replaced atomically.
+    """
+    with _lock:
+      current = self._read()
+      current.update({r['name'] : r for r in records})
+      os.makedirs(self.path, exist_ok = True)
+      fd, tmp = tempfile.mkstemp(prefix = ".manifest_", dir = self.path)
+      try:
+        with os.fdopen(fd, 'w') as fh:
+          json.dump({'backgrounds' : [current[k] for k in sorted(current)]}, fh, indent = 1)
+        os.replace(tmp, self.manifest_path)
+      except BaseException:
+        os.remove(tmp)
+        raise
+      self._records = current
+
+  def names(self):
+    """ Return the sorted names of cataloged backgrounds whose file or compiled copy is present """
+    return sorted(name for name, r in self.records.items()
+                  if os.path.exists(os.path.join(self.path, name)) or
+                     (r.get('compiled') is not None and os.path.isdir(os.path.join(self.path, r['compiled']))))
+
+  def unregistered(self):
+    """ Return the sorted names of background files in the folder that have no record """
+    if not os.path.isdir(self.path):
+      return list()
+    return sorted(f for f in os.listdir(self.path) if _is_background_file(f) and f not in self.records)
+
+  def get(self, name):
+    """
+    Return the record of a background.
+
+    Raises
+    ------
+    KeyError
+      if name is not in the catalog
+    """
+    if name not in self.records:
+      raise KeyError(f"{name} is not in the catalog of {self.path}; available: {self.names()}")
+    return self.records[name]
+
+  def query(self, **filters):
+    """
+    Return cataloged backgrounds as a pd.DataFrame, one row per background.
+
+    Parameters
+    ----------
+    **filters
+      field = value pairs a record must match (e.g. species = 'human', chain = 'beta');
+      a value may also be a list of accepted values or a callable returning a bool
+
+    Returns
+    -------
+    df : pd.DataFrame
+      with columns Catalog.fields
+    """
+    rows = list()
+    for name in self.names():
+      r = self.records[name]
+      keep = True
+      for field, value in filters.items():
+        x = r.get(field)
+        if callable(value):
+          keep = bool(value(x))
+        elif isinstance(value, (list, tuple, set)):
+          keep = x in value
+        else:
+          keep = x == value
+        if not keep:
+          break
+      if keep:
+        rows.append([r.get(f) for f in self.fields])
+    return pd.DataFrame(rows, columns = self.fields)
+
+  def register(self, name, source = None, sampler = None, **metadata):
+    """
+    Add or refresh the record of a background file in the folder.
+
+    Parameters
+    ----------
+    name : str
+      file name in the folder
+    source : str or None
+      where the file came from (e.g. its download URL); kept from an existing record if None
+    sampler : TCRsampler or None
+      sampler built from the file; its build parameters, reference rows and compiled copy
+      are recorded without re-reading the file
+    **metadata
+      other fields to set (e.g. species = 'human', chain = 'beta'), overriding the ones
+      inferred from the name
+
+    Returns
+    -------
+    record : dict
+    """
+    filename = os.path.join(self.path, name)
+    record = dict(self._read().get(name, {'name' : name}))
+    record['species'], record['chain'] = _infer_species_chain(name)
+    if source is not None:
+      record['source'] = source
+    record.setdefault('source', None)
+    if os.path.isfile(filename):
+      record['sha256'] = sha256sum(filename)
+      record['bytes'] = os.path.getsize(filename)
+    if sampler is not None and sampler._ref_df is not None:
+      df = sampler._ref_df
+    elif name.endswith(PARQUET_SUFFIX) and os.path.exists(filename):
+      # row and subject counts come from the metadata and the subject column only
+      df = None
+      record['rows'], record['subjects'] = parquet_summary(filename)
+    elif os.path.isfile(filename):
+      from tcrsampler.sampler import TCRsampler
+      df = TCRsampler._read_background_file(filename)
+    else:
+      df = None
+    if df is not None:
+      record['rows'] = int(df.shape[0])
+      record['subjects'] = int(df['subject'].nunique()) if 'subject' in df.columns else None
+    if sampler is not None:
+      record['build_params'] = sampler.build_params
+    compiled = name + COMPILED_SUFFIX
+    record['compiled'] = compiled if os.path.isdir(os.path.join(self.path, compiled)) else None
+    for f in self.fields:
+      record.setdefault(f, None)
+    record.update(metadata)
+    self._update([record])
+    return record
+
+  def open(self, name, mmap = True, **kwargs):
+    """
+    Return a TCRsampler for a cataloged background.
+
+    The compiled copy is memory-mapped if there is one; otherwise the file is read
+    and built with the recorded build parameters.
+
+    Parameters
+    ----------
+    name : str
+    mmap : bool
+      passed to load_compiled_background
+    **kwargs
+      passed to TCRsampler (e.g. metrics = False)
+
+    Returns
+    -------
+    sampler : TCRsampler
+    """
+    from tcrsampler.sampler import TCRsampler
+    r = self.get(name)
+    t = TCRsampler(**kwargs)
+    t.default_bkgd = name
+    filename = os.path.join(self.path, name)
+    compiled = None if r.get('compiled') is None else os.path.join(self.path, r['compiled'])
+    if compiled is not None and os.path.isdir(compiled):
+      load_compiled_background(compiled, sampler = t, mmap = mmap)
+      t._ref_df_path = filename if os.path.exists(filename) else None
+      return t
+    t.ref_df = t._read_background_file(filename)
+    params = dict(r.get('build_params') or {})
+    t.build_background(**params)
+    return t
@@ -0,0 +1,197 @@
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+from tcrsampler.blocks import PackedStrings, BackgroundBlocks, LazyBlocks, BlockDict
+
+__all__ = ['compile_background', 'load_compiled_background', 'COMPILED_SUFFIX']
+
+COMPILED_SUFFIX = ".tcrs"
+FORMAT_VERSION = 1
+
+_freq_dicts = ['vj_freq', 'v_freq', 'j_freq', 'vj_occur_freq', 'v_occur_freq', 'j_occur_freq']
+
+
+def _to_arrays(sampler):
+  """
+  Split a built TCRsampler into a dict of flat NumPy arrays and a JSON-serializable meta dict.
+  """
+  blocks = sampler.blocks
+  if blocks is None:
+    blocks = BackgroundBlocks.from_ref_dict(sampler.ref_dict)
+  elif isinstance(blocks, LazyBlocks):
+    blocks = blocks.materialize()
+  arrays = {'v_codes'      : blocks.v_codes,
+            'j_codes'      : blocks.j_codes,
+            'cdr3_buffer'  : blocks.cdr3.buffer,
+            'cdr3_offsets' : blocks.cdr3.offsets,
+            'count'        : blocks.count,
+            'freq'         : blocks.freq,
+            'offsets'      : blocks.offsets}
+  if blocks.subject_codes is not None:
+    arrays['subject_codes'] = blocks.subject_codes
+  # sampling tables are stored too, so a loaded background samples without computing them
+  for use_frequency, key in [(True, 'freq'), (False, 'count')]:
+    arrays['cdf_' + key] = blocks.cdf(use_frequency)
+    arrays['cdf_keyed_' + key] = blocks.keyed_cdf(use_frequency)
+
+  meta = {'format_version' : FORMAT_VERSION,
+          'default_background' : sampler.default_bkgd,
+          'build_params' : getattr(sampler, 'build_params', None),
+          'v_genes' : [str(x) for x in blocks.v_genes],
+          'j_genes' : [str(x) for x in blocks.j_genes],
+          'subjects': None if blocks.subjects is None else [str(x) for x in blocks.subjects],
+          'singleton' : bool(blocks.singleton)}
+  # Tuple keyed dictionaries are stored as [v, j, f] lists, gene keyed dictionaries as {gene: f}
+  for name in _freq_dicts:
+    d = getattr(sampler, name)
+    if name.startswith('vj_'):
+      meta[name] = [[v, j, float(f)] for (v, j), f in d.items()]
+    else:
+      meta[name] = {k: float(f) for k, f in d.items()}
+  return arrays, meta
+
+
+def _from_arrays(arrays, meta, sampler):
+  """
+  Populate sampler from arrays and meta as produced by _to_arrays.
+  """
+  blocks = BackgroundBlocks(v_genes = meta['v_genes'],
+                            j_genes = meta['j_genes'],
+                            v_codes = arrays['v_codes'],
+                            j_codes = arrays['j_codes'],
+                            cdr3 = PackedStrings(buffer = arrays['cdr3_buffer'], offsets = arrays['cdr3_offsets']),
+                            count = arrays['count'],
+                            freq = arrays['freq'],
+                            offsets = arrays['offsets'],
+                            subjects = meta['subjects'],
+                            subject_codes = arrays.get('subject_codes'),
+                            singleton = meta['singleton'])
+  # backgrounds compiled without sampling tables compute them on first use
+  blocks._cdf.update({k[len('cdf_'):] : a for k, a in arrays.items() if k.startswith('cdf_')})
+  for name in _freq_dicts:
+    if name.startswith('vj_'):
+      setattr(sampler, name, {(v, j): f for v, j, f in meta[name]})
+    else:
+      setattr(sampler, name, dict(meta[name]))
+  sampler.build_params = meta['build_params']
+  sampler.blocks = blocks
+  sampler.ref_dict = BlockDict(blocks)
+  sampler.compiled_path = None
+  # statistics of an earlier build no longer describe this background
+  sampler.stats = None
+  sampler._build_df = None
+  return sampler
+
+
+def _move_into_place(tmp, path, overwrite):
+  """
+  Rename the directory tmp to path. A new path appears atomically; an existing one is
+  moved aside to a sibling first, so it is never deleted before its replacement is ready.
+  """
+  try:
+    os.rename(tmp, path)
+    return
+  except OSError:
+    if not os.path.isdir(path):
+      raise
+  if not overwrite:
+    raise FileExistsError(f"{path} already exists")
+  old = tempfile.mkdtemp(prefix = ".old_", dir = os.path.dirname(path))
+  try:
+    os.replace(path, old)
+  except FileNotFoundError:
+    pass
+  try:
+    os.rename(tmp, path)
+  except OSError:
+    # another writer put its directory in place meanwhile; keep it
+    if not os.path.isdir(path):
+      raise
+    shutil.rmtree(tmp, ignore_errors = True)
+  shutil.rmtree(old, ignore_errors = True)
+
+
+def compile_background(sampler, path, overwrite = True):
+  """
+  Write a built TCRsampler background to a compiled, memory-mappable directory.
+
+  Parameters
+  ----------
+  sampler : TCRsampler
+    sampler on which build_background has been run
+  path : str
+    destination directory, conventionally ending in '.tcrs'
+  overwrite : bool
+    If True, an existing directory at path is replaced. If False, FileExistsError is
+    raised if path exists, including when another process creates it while this one writes.
+
+  Returns
+  -------
+  path : str
+
+  Notes
+  -----
+  The directory holds one .npy file per column (gene codes, CDR3 byte buffer and
+  offsets, counts, frequencies, the per-(v,j) block offset table and the sampling
+  tables of BackgroundBlocks.cdf and keyed_cdf) and a meta.json with the gene
+  vocabularies and the six precomputed frequency dictionaries. Memory-mapped loads
+  therefore share the sampling tables through the page cache too.
+  The directory is written next to path and renamed into place, so readers never see
+  a partially written background.
+  """
+  if sampler.ref_dict is None:
+    raise ValueError("TCRsampler has no background; run build_background() before compiling")
+  path = os.path.abspath(path)
+  if not overwrite and os.path.isdir(path):
+    raise FileExistsError(f"{path} already exists")
+  arrays, meta = _to_arrays(sampler)
+  parent = os.path.dirname(path)
+  os.makedirs(parent, exist_ok = True)
+  tmp = tempfile.mkdtemp(prefix = ".tmp_", dir = parent)
+  try:
+    for name, a in arrays.items():
+      np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(a))
+    with open(os.path.join(tmp, 'meta.json'), 'w') as fh:
+      json.dump(meta, fh)
+    _move_into_place(tmp, path, overwrite)
+  except BaseException:
+    shutil.rmtree(tmp, ignore_errors = True)
+    raise
+  return path
+
+
+def load_compiled_background(path, sampler = None, mmap = True):
+  """
+  Load a compiled background written by compile_background.
+
+  Parameters
+  ----------
+  path : str
+    compiled background directory
+  sampler : TCRsampler or None
+    sampler to populate; a new empty TCRsampler is created if None
+  mmap : bool
+    If True, arrays are memory-mapped read-only, so pages are loaded on demand and
+    shared between processes by the OS. If False, arrays are read into memory.
+
+  Returns
+  -------
+  sampler : TCRsampler
+  """
+  if sampler is None:
+    from tcrsampler.sampler import TCRsampler
+    sampler = TCRsampler()
+  with open(os.path.join(path, 'meta.json'), 'r') as fh:
+    meta = json.load(fh)
+  if meta.get('format_version') != FORMAT_VERSION:
+    raise ValueError(f"{path} has compiled format version {meta.get('format_version')}, expected {FORMAT_VERSION}; recompile it")
+  arrays = dict()
+  for fn in os.listdir(path):
+    if fn.endswith('.npy'):
+      arrays[fn[:-4]] = np.load(os.path.join(path, fn), mmap_mode = 'r' if mmap else None)
+  _from_arrays(arrays, meta, sampler)
+  if mmap:
+    sampler.compiled_path = os.path.abspath(path)
+  return sampler
@@ -0,0 +1,118 @@
+import numpy as np
+
+__all__ = ['FALLBACK_POLICIES', 'FallbackIndex', 'strip_allele', 'is_pooled']
+
+# name -> description of the substitute key it looks up
+FALLBACK_POLICIES = {'allele' : 'same V and J genes, ignoring the allele (e.g. TRBV9*02 -> TRBV9*01)',
+                     'v'      : 'same V gene, any J gene: the (v,j) blocks of the V gene pooled, key (v, None)',
+                     'j'      : 'same J gene, any V gene: the (v,j) blocks of the J gene pooled, key (None, j)'}
+
+
+def strip_allele(gene):
+  """
+  Remove the allele from a gene name, e.g. 'TRBV9*01' -> 'TRBV9'.
+  """
+  if not isinstance(gene, str):
+    return gene
+  return gene.split("*")[0]
+
+
+def is_pooled(key):
+  """ True if key is a V-only (v, None) or J-only (None, j) key returned by FallbackIndex.resolve """
+  return key[0] is None or key[1] is None
+
+
+class FallbackIndex():
+  """
+  Substitute keys for (v,j) pairs that are not in a background.
+
+  The index stores the most frequent (v,j) key of every allele-stripped (v,j) pair, and
+  the (v,j) keys of every V gene and every J gene, so a missing key is resolved with at
+  most one dictionary lookup per fallback policy.
+
+  Parameters
+  ----------
+  keys : iterable of tuple
+    (v,j) keys of the background (e.g. ref_dict.keys())
+  weights : dict or None
+    (v,j) -> weight used to pick among candidate substitutes (e.g. vj_freq). Keys
+    missing from weights rank last; ties keep the order of keys.
+
+  Attributes
+  ----------
+  by_v : dict
+    V gene -> its (v,j) keys, most frequent first
+  by_j : dict
+    J gene -> its (v,j) keys, most frequent first
+  by_allele : dict
+    allele-stripped (v,j) -> most frequent (v,j) key
+  pools : dict
+    V-only and J-only keys -> pooled background, memoized by TCRsampler
+
+  Example
+  -------
+  >>> fb = FallbackIndex(t.ref_dict.keys(), weights = t.vj_freq)
+  >>> fb.resolve('TRBV9*02', 'TRBJ2-7*01', policy = ['allele', 'v'])
+  ('TRBV9*01', 'TRBJ2-7*01')
+  >>> fb.resolve('TRBV9*01', 'TRBJ9*01', policy = 'v')
+  ('TRBV9*01', None)
+  >>> fb.members(('TRBV9*01', None))
+  [('TRBV9*01', 'TRBJ2-7*01'), ('TRBV9*01', 'TRBJ2-1*01'), ...]
+  """
+  def __init__(self, keys, weights = None):
+    keys = list(keys)
+    if weights is None:
+      weights = dict()
+    w = np.array([weights.get(k, -np.inf) for k in keys], dtype = np.float64)
+    self.by_v = dict()
+    self.by_j = dict()
+    self.by_allele = dict()
+    self.pools = dict()
+    for i in np.argsort(-w, kind = 'stable'):
+      v, j = keys[i]
+      self.by_v.setdefault(v, list()).append(keys[i])
+      self.by_j.setdefault(j, list()).append(keys[i])
+      self.by_allele.setdefault((strip_allele(v), strip_allele(j)), keys[i])
+
+  def resolve(self, v, j, policy):
+    """
+    Return the substitute for (v,j) under the first policy that has one.
+
+    Parameters
+    ----------
+    v : str
+    j : str
+    policy : str or list of str
+      policies tried in order, see FALLBACK_POLICIES
+
+    Returns
+    -------
+    key : tuple or None
+      (v,j) key of the background ('allele'), V-only key (v, None) ('v'), J-only key
+      (None, j) ('j'), or None if no policy applies. See members.
+    """
+    if isinstance(policy, str):
+      policy = [policy]
+    for p in policy:
+      if p == 'allele':
+        key = self.by_allele.get((strip_allele(v), strip_allele(j)))
+      elif p == 'v':
+        key = (v, None) if v in self.by_v else None
+      elif p == 'j':
+        key = (None, j) if j in self.by_j else None
+      else:
+        raise ValueError(f"Unknown fallback policy {p}; expected one of {list(FALLBACK_POLICIES)}")
+      if key is not None:
+        return key
+    return None
+
+  def members(self, key):
+    """
+    Return the (v,j) keys of the background a key stands for: all keys of the gene for a
+    V-only or J-only key, [key] otherwise.
+    """
+    if key[1] is None:
+      return self.by_v.get(key[0], [])
+    if key[0] is None:
+      return self.by_j.get(key[1], [])
+    return [key]
@@ -0,0 +1,180 @@
+import time
+import tracemalloc
+import pandas as pd
+from progress.bar import IncrementalBar
+
+__all__ = ['Metrics', 'ProgressBars', 'Silent']
+
+
+class ProgressBars():
+  """
+  Metrics consumer that shows one progress bar per phase.
+
+  Parameters
+  ----------
+  phases : tuple
+    phases that get a bar; by default those that always showed one (sampling does not)
+  """
+  def __init__(self, phases = ('load', 'clean', 'statistics', 'build')):
+    self.phases = phases
+    self._bar = None
+
+  def phase_started(self, phase, label):
+    if phase in self.phases:
+      self._bar = IncrementalBar(label, max = 1, suffix='%(percent)d%%')
+
+  def phase_finished(self, record):
+    if self._bar is not None:
+      self._bar.next();self._bar.finish()
+      self._bar = None
+
+
+class _Phase():
+  """
+  Context manager timing one phase; code inside updates the record it yields.
+  """
+  def __init__(self, metrics, phase, label):
+    self.metrics = metrics
+    self.record = {'phase' : phase, 'seconds' : None, 'rows' : None, 'groups' : None, 'peak_mb' : None}
+    self.label = phase if label is None else label
+    self._tracing = False
+
+  def __enter__(self):
+    for consumer in self.metrics.consumers:
+      if hasattr(consumer, 'phase_started'):
+        consumer.phase_started(self.record['phase'], self.label)
+    if self.metrics.memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+      self._tracing = True
+    self._start = time.perf_counter()
+    return self.record
+
+  def __exit__(self, exc_type, exc, tb):
+    self.record['seconds'] = time.perf_counter() - self._start
+    if self.metrics.memory:
+      self.record['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+      if self._tracing:
+        tracemalloc.stop()
+    if exc_type is not None:
+      return False
+    if self.metrics.keep_records:
+      self.metrics.records.append(self.record)
+    for consumer in self.metrics.consumers:
+      if hasattr(consumer, 'phase_finished'):
+        consumer.phase_finished(self.record)
+      elif callable(consumer):
+        consumer(self.record)
+    return False
+
+
+class Metrics():
+  """
+  Per-phase instrumentation of a TCRsampler.
+
+  Every instrumented phase ('load', 'clean', 'statistics', 'build', 'sample', 'sample_batch',
+  'sample_counts', 'synthesize') produces a record dict with the phase name, wall 'seconds', 'rows' processed,
+  'groups' ((v,j) pairs) built or sampled, and 'peak_mb' if memory is True. Records are passed
+  to every consumer when the phase ends and, if keep_records is True, kept in order in .records.
+
+  Parameters
+  ----------
+  consumers : list or None
+    objects with phase_started(phase, label) and/or phase_finished(record) methods (e.g.
+    ProgressBars()), or callables called with each finished record
+  memory : bool
+    If True, peak memory is traced with tracemalloc (slows down phases that allocate many
+    Python objects). Peak memory of a phase nested in another traced phase is the peak since
+    the outer phase started.
+  keep_records : bool
+    If True, every record is appended to .records. The default metrics of TCRsampler (progress
+    bars only) keep none, so a long-lived sampler does not grow with every sample call.
+
+  Example
+  -------
+  >>> m = Metrics(consumers = [print])
+  >>> t = TCRsampler(metrics = m)
+  >>> t.clean_mixcr(filename = fn); t.build_background()
+  >>> m.to_dataframe()
+  """
+  def __init__(self, consumers = None, memory = False, keep_records = True):
+    self.consumers = list() if consumers is None else list(consumers)
+    self.memory = memory
+    self.keep_records = keep_records
+    self.records = list()
+
+  @classmethod
+  def resolve(cls, metrics):
+    """
+    Turn the metrics argument of TCRsampler into a metrics object.
+
+    Parameters
+    ----------
+    metrics : Metrics, Silent, None or False
+      None shows progress bars and keeps no records (the default), False is Silent()
+    """
+    if metrics is None:
+      return cls(consumers = [ProgressBars()], keep_records = False)
+    if metrics is False:
+      return Silent()
+    if isinstance(metrics, (cls, Silent)):
+      return metrics
+    raise TypeError("metrics must be a Metrics, Silent, None or False")
+
+  def phase(self, phase, label = None):
+    """
+    Time a phase.
+
+    Parameters
+    ----------
+    phase : str
+      phase name recorded in the record
+    label : str or None
+      text shown by progress bars (default phase)
+
+    Returns
+    -------
+    context : context manager
+      yields the record dict, in which the phase sets 'rows' and 'groups'
+    """
+    return _Phase(self, phase, label)
+
+  def to_dataframe(self):
+    """ Return all records as a pd.DataFrame, one row per phase run """
+    return pd.DataFrame(self.records, columns = ['phase', 'seconds', 'rows', 'groups', 'peak_mb'])
+
+  def clear(self):
+    self.records = list()
+
+
+class _NullRecord(dict):
+  def __setitem__(self, key, value):
+    pass
+
+
+class _NullPhase():
+  def __enter__(self):
+    return _null_record
+
+  def __exit__(self, exc_type, exc, tb):
+    return False
+
+
+_null_record = _NullRecord()
+_null_phase = _NullPhase()
+
+
+class Silent():
+  """
+  Metrics object that records and shows nothing; every phase is a shared no-op context.
+  """
+  consumers = ()
+  records = ()
+
+  def phase(self, phase, label = None):
+    return _null_phase
+
+  def to_dataframe(self):
+    return pd.DataFrame(columns = ['phase', 'seconds', 'rows', 'groups', 'peak_mb'])
+
+  def clear(self):
+    pass
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from tcrsampler.compiled import compile_background, load_compiled_background
+from tcrsampler.shared import SharedBackground
+
+__all__ = ['sample_many']
+
+# Background loaded once per worker process by _init_worker
+_worker_sampler = None
+
+
+def _init_worker(path):
+  global _worker_sampler
+  _worker_sampler = load_compiled_background(path, mmap = True)
+
+
+def _init_shared_worker(handle):
+  global _worker_sampler
+  _worker_sampler = SharedBackground.attach(handle)
+
+
+def _usage_arrays(usage):
+  """
+  Split a usage table (list of [v, j, n] or DataFrame with 'v_reps', 'j_reps', 'n') into arrays.
+  """
+  if isinstance(usage, pd.DataFrame):
+    return usage['v_reps'].values, usage['j_reps'].values, usage['n'].values
+  if len(usage) == 0:
+    return np.empty(0, dtype = object), np.empty(0, dtype = object), np.empty(0, dtype = np.int64)
+  v, j, n = zip(*usage)
+  return np.array(v, dtype = object), np.array(j, dtype = object), np.array(n, dtype = np.int64)
+
+
+def _sample_task(sampler, usage, seed_seq, depth, use_frequency):
+  v, j, n = _usage_arrays(usage)
+  return sampler.sample_batch(v, j, n, depth = depth, seed = np.random.default_rng(seed_seq), use_frequency = use_frequency)
+
+
+def _worker_task(args):
+  return _sample_task(_worker_sampler, *args)
+
+
+def sample_many(sampler, usage_tables, depth = 1, seed = 1, use_frequency = True, max_workers = None, shared_memory = False):
+  """
+  Sample backgrounds for many usage tables in parallel processes.
+
+  Parameters
+  ----------
+  sampler : TCRsampler
+    sampler with a built (or compiled) background
+  usage_tables : list
+    one usage table per repertoire, each a list of (v-gene, j-gene, n) or a
+    DataFrame with 'v_reps', 'j_reps' and 'n' columns
+  depth : int
+    mulitple of the number of times to sample for a given frequncy.
+  seed : int or np.random.SeedSequence
+    root seed; table i is sampled with the i-th stream of SeedSequence(seed).spawn
+  use_frequency : bool
+    If True, uses frequency for sampling proportionaly. If False, uses raw counts.
+  max_workers : int or None
+    number of worker processes (None for os.cpu_count()). With max_workers = 1 the
+    tables are sampled in this process.
+  shared_memory : bool
+    If True, the background is published once into shared memory (tcrsampler.shared.SharedBackground)
+    instead of being memory-mapped from a compiled background directory.
+
+  Returns
+  -------
+  results : list
+    one (cdr3, offsets) tuple per usage table, in input order, as returned by TCRsampler.sample_batch
+
+  Notes
+  -----
+  Every table gets its own independent random stream spawned from seed, so results are
+  identical regardless of max_workers or the order in which tasks complete.
+
+  Workers do not receive a pickled copy of the background. The sampler is memory-mapped
+  from its compiled background directory (compiled to a temporary directory first if it
+  has none), or attached from shared memory, so the OS shares one copy of the pages
+  between all workers.
+  """
+  assert isinstance(depth, int)
+  seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+  streams = seed_seq.spawn(len(usage_tables))
+  tasks = [(usage, stream, depth, use_frequency) for usage, stream in zip(usage_tables, streams)]
+
+  if max_workers == 1 or len(tasks) <= 1:
+    return [_sample_task(sampler, *task) for task in tasks]
+
+  if shared_memory:
+    with SharedBackground.publish(sampler) as shared:
+      with ProcessPoolExecutor(max_workers = max_workers, initializer = _init_shared_worker, initargs = (shared.handle,)) as executor:
+        return list(executor.map(_worker_task, tasks))
+
+  tmp = None
+  path = sampler.compiled_path
+  if path is None or not os.path.isdir(path):
+    tmp = tempfile.mkdtemp(prefix = "tcrsampler_")
+    path = compile_background(sampler, os.path.join(tmp, 'background.tcrs'))
+  try:
+    with ProcessPoolExecutor(max_workers = max_workers, initializer = _init_worker, initargs = (path,)) as executor:
+      return list(executor.map(_worker_task, tasks))
+  finally:
+    if tmp is not None:
+      shutil.rmtree(tmp, ignore_errors = True)
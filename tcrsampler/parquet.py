@@ -0,0 +1,130 @@
+import os
+import pandas as pd
+
+__all__ = ['write_parquet_background', 'read_parquet_background', 'parquet_summary', 'PARQUET_SUFFIX']
+
+PARQUET_SUFFIX = ".parquet"
+
+# rows are sorted on these columns so every row group covers a narrow range of each
+_sort_columns = ['subject', 'v_reps', 'j_reps']
+
+
+def _pyarrow():
+  try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.dataset
+    import pyarrow.parquet
+  except ImportError:
+    raise ImportError("Parquet backgrounds require pyarrow; install it with pip install pyarrow (or pip install tcrsampler[parquet])")
+  return pyarrow
+
+
+def write_parquet_background(df, path, row_group_size = 2**16, partition_by_subject = False):
+  """
+  Write a background DataFrame as Parquet, laid out for selective reads.
+
+  Parameters
+  ----------
+  df : pd.DataFrame
+    background with ['v_reps','j_reps','cdr3','subject','count','freq'] columns (as
+    the .tsv files in db/ or TCRsampler.ref_df)
+  path : str
+    destination .parquet file, or directory if partition_by_subject
+  row_group_size : int
+    maximum rows per row group
+  partition_by_subject : bool
+    If True, write a directory with one subject=<name>/ partition per subject, so reads
+    filtered on subject open only those files
+
+  Returns
+  -------
+  path : str
+
+  Notes
+  -----
+  Rows are sorted by subject, V gene and J gene, so each row group holds a contiguous
+  range of (subject, v, j) and its min/max statistics let read_parquet_background skip
+  row groups that cannot match a filter. Gene and subject columns are dictionary encoded.
+  """
+  pa = _pyarrow()
+  by = [c for c in _sort_columns if c in df.columns]
+  df = df.sort_values(by, kind = 'stable').reset_index(drop = True)
+  table = pa.Table.from_pandas(df, preserve_index = False)
+  if partition_by_subject:
+    if 'subject' not in df.columns:
+      raise KeyError("partition_by_subject requires a 'subject' column")
+    pa.parquet.write_to_dataset(table, root_path = path, partition_cols = ['subject'],
+                                row_group_size = row_group_size, use_dictionary = True)
+  else:
+    pa.parquet.write_table(table, path, row_group_size = row_group_size, use_dictionary = True)
+  return path
+
+
+def read_parquet_background(path, columns = None, subjects = None, v_genes = None, j_genes = None):
+  """
+  Read a Parquet background, or the part of it that is needed.
+
+  Parameters
+  ----------
+  path : str
+    .parquet file or directory (e.g. written with partition_by_subject)
+  columns : list or None
+    columns to read (default all)
+  subjects : list or None
+    keep only rows of these subjects
+  v_genes : list or None
+    keep only rows with these V genes
+  j_genes : list or None
+    keep only rows with these J genes
+
+  Returns
+  -------
+  df : pd.DataFrame
+
+  Notes
+  -----
+  Only the requested columns are read, and the filters are pushed down to pyarrow,
+  which skips partitions and row groups whose statistics exclude them before decoding
+  any data.
+
+  Example
+  -------
+  >>> df = read_parquet_background('wirasinha_mouse_beta.parquet', subjects = ['s1', 's2'],
+  ...                              columns = ['v_reps','j_reps','cdr3','subject','count','freq'])
+  """
+  pa = _pyarrow()
+  partitioning = 'hive' if os.path.isdir(path) else None
+  dataset = pa.dataset.dataset(path, format = 'parquet', partitioning = partitioning)
+  expression = None
+  for name, values in [('subject', subjects), ('v_reps', v_genes), ('j_reps', j_genes)]:
+    if values is None:
+      continue
+    if name not in dataset.schema.names:
+      raise KeyError(f"{path} has no '{name}' column to filter on")
+    # partition values are read back as strings
+    values = [str(x) for x in values] if pa.types.is_string(dataset.schema.field(name).type) else list(values)
+    e = pa.dataset.field(name).isin(values)
+    expression = e if expression is None else expression & e
+  table = dataset.to_table(columns = columns, filter = expression)
+  df = table.to_pandas()
+  for name in df.columns:
+    # dictionary encoded columns come back as categoricals
+    if isinstance(df[name].dtype, pd.CategoricalDtype):
+      df[name] = df[name].astype(object)
+  return df
+
+
+def parquet_summary(path):
+  """
+  Return the number of rows and of subjects (None without a subject column) of a Parquet
+  background, from its metadata and subject column only.
+  """
+  pa = _pyarrow()
+  partitioning = 'hive' if os.path.isdir(path) else None
+  dataset = pa.dataset.dataset(path, format = 'parquet', partitioning = partitioning)
+  rows = dataset.count_rows()
+  if 'subject' not in dataset.schema.names:
+    return rows, None
+  subjects = dataset.to_table(columns = ['subject']).column('subject')
+  return rows, len(pa.compute.unique(subjects))
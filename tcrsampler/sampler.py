@@ -5,8 +5,18 @@ import numpy as np
 import warnings
 import random 
 import time
-from progress.bar import IncrementalBar
 from tcrsampler.setup_db import install_all_next_gen, install_nextgen_data_to_db, select_files
+from tcrsampler.blocks import BackgroundBlocks, BlockDict, CompactReference, LazyBlocks, build_blocks, _weighted_top_k
+from tcrsampler.compiled import compile_background, load_compiled_background, COMPILED_SUFFIX
+from tcrsampler.cache import BackgroundCache
+from tcrsampler.catalog import Catalog
+from tcrsampler.stats import BackgroundStats
+from tcrsampler.validate import validate_cdr3, valid_cdr3
+from tcrsampler.adaptive import import_adaptive
+from tcrsampler.fallback import FallbackIndex, is_pooled
+from tcrsampler.metrics import Metrics
+from tcrsampler.streams import RequestStreams, RNG_MODES
+from tcrsampler.parquet import read_parquet_background, PARQUET_SUFFIX
 
 __all__ = ['TCRsampler']
 
@@ -18,10 +28,22 @@ class TCRsampler():
   ----------
   default_background: str or None
     string name of background file, expected in db/ directory of package source if setup_db step are run.
-  ref_df : pd.DataFrame
-    Dataframe of reference CDR$, but contain columns ['v_reps','j_reps','cdr3', 'count','freq']
+  ref_df : pd.DataFrame or CompactReference
+    Dataframe of reference CDR$, but contain columns ['v_reps','j_reps','cdr3', 'count','freq'] (see .compact())
   ref_dict : dict
     dictionary keyed on tuples that point to dataframe of CDR3s
+  blocks : BackgroundBlocks or None
+    flat (v,j)-blocked storage of the background that ref_dict is a view of
+  stats : BackgroundStats or None
+    (v,j) contingency tables the frequency dictionaries below are derived from
+  build_params : dict or None
+    keyword arguments of the last build_background call
+  compiled_path : str or None
+    compiled background directory that blocks are memory-mapped from, if any
+  metrics : Metrics or Silent
+    per-phase timing records of load, clean, statistics, build and sample (see tcrsampler.metrics).
+    Set with TCRsampler(metrics = ...): None (default) shows progress bars without keeping records, Metrics() records
+    phases (optionally passing them to callbacks) and False is silent.
 
   vj_freq : dict
     dictionary keyed on  V,J gene name tuples pointing to frequency of V,J-gene pairings by FREQUENCY METHOD
@@ -55,34 +77,169 @@ class TCRsampler():
 
   N is currently determined by taking the number of clones in the least diverse subject 
   (i.e., the subject with the fewest clones). In this case the ~102,000 clones are considered 
-  from each sample. 
+  from each sample. N can be set with build_background(occur_n = N) or changed afterwards 
+  with set_occurrence_cutoff(N).
 
   Notes:
   Default data from Britanova OV, Shugay M, Merzlyak EM, Staroverov DB, Putintseva EV, Turchaninova MA, Mamedov IZ, Pogorelyy MV, Bolotin DA, Izraelson M, et al. Dynamics of individual T cell repertoires: from cord blood to centenarians. J Immunol. 2016;196:5005–5013. doi: 10.4049/jimmunol.1600005.
 
   """
-  def __init__(self, default_background = None):
+  def __init__(self, default_background = None, metrics = None):
+    self.metrics = Metrics.resolve(metrics)
     self.default_bkgd = default_background
     self.ref_df = None
     self.ref_dict = None
+    self.blocks = None
+    self.stats = None
+    self.build_params = None
+    self.compiled_path = None
+    self.missing_report = None
+    self._build_df = None
 
     if default_background is not None:
       path_to_db = os.path.join(os.path.dirname(os.path.realpath(__file__)),'db')
       path_to_db_bkgd = os.path.join(path_to_db, self.default_bkgd)
-      if not os.path.isfile(path_to_db_bkgd):
+      if path_to_db_bkgd.endswith(COMPILED_SUFFIX):
+        path_to_compiled = path_to_db_bkgd
+        path_to_db_bkgd = path_to_db_bkgd[:-len(COMPILED_SUFFIX)]
+      else:
+        path_to_compiled = path_to_db_bkgd + COMPILED_SUFFIX
+      if os.path.isdir(path_to_compiled):
+        # Compiled backgrounds are memory-mapped; ref_df is only read if it is accessed
+        with self.metrics.phase('load', label = f'Loading {self.default_bkgd}') as record:
+          load_compiled_background(path_to_compiled, sampler = self)
+          record['rows'], record['groups'] = self.blocks.n_rows, len(self.blocks)
+        self._ref_df_path = path_to_db_bkgd if os.path.exists(path_to_db_bkgd) else None
+      elif not (os.path.isfile(path_to_db_bkgd) or (path_to_db_bkgd.endswith(PARQUET_SUFFIX) and os.path.isdir(path_to_db_bkgd))):
         raise OSError(f'{path_to_db_bkgd} default file not found. Download a default background using python -c "from tcrsampler.setup_db import install_all_next_gen; install_all_next_gen(dry_run = False)"')
       else:
-        bar = IncrementalBar(f'Loading {self.default_bkgd}', max = 2, suffix='%(percent)d%%')
-        bar.next()
-        if path_to_db_bkgd.endswith(".csv"):
-          sep = ","
-        elif path_to_db_bkgd.endswith(".tsv"):
-          sep = "\t"
-        self.ref_df= pd.read_csv(path_to_db_bkgd, sep = sep)
-        bar.next()
-        bar.finish()
+        with self.metrics.phase('load', label = f'Loading {self.default_bkgd}') as record:
+          self.ref_df = self._read_background_file(path_to_db_bkgd)
+          record['rows'] = self.ref_df.shape[0]
         self.build_background()
-  
+
+  @property
+  def ref_df(self):
+    if self._build_pending and self._ref_df is self._build_base:
+      self._build_df
+    if self._ref_df is None and getattr(self, '_ref_df_path', None) is not None:
+      self._ref_df = self._read_background_file(self._ref_df_path)
+      self._ref_df_path = None
+    return self._ref_df
+
+  @ref_df.setter
+  def ref_df(self, df):
+    self._ref_df = df
+    self._ref_df_path = None
+
+  @property
+  def _build_df(self):
+    # rows appended by add_subject are joined to the reference in one concatenation, on first use
+    if self._build_pending:
+      base = self._build_base
+      if isinstance(base, CompactReference):
+        joined = CompactReference.concatenate([base] + self._build_pending)
+      else:
+        joined = pd.concat([base] + self._build_pending, ignore_index = True, sort = False)
+      if self._ref_df is base:
+        self._ref_df = joined
+      self._build_base = joined
+      self._build_pending = list()
+    return self._build_base
+
+  @_build_df.setter
+  def _build_df(self, df):
+    self._build_base = df
+    self._build_pending = list()
+
+  @staticmethod
+  def _read_background_file(path, subjects = None, v_genes = None, j_genes = None):
+    if path.endswith(PARQUET_SUFFIX):
+      return read_parquet_background(path, subjects = subjects, v_genes = v_genes, j_genes = j_genes)
+    if path.endswith(".csv"):
+      sep = ","
+    elif path.endswith(".tsv"):
+      sep = "\t"
+    df = pd.read_csv(path, sep = sep)
+    for col, values in [('subject', subjects), ('v_reps', v_genes), ('j_reps', j_genes)]:
+      if values is not None:
+        df = df[df[col].isin(values)].reset_index(drop = True)
+    return df
+
+  def read_background(self, path, subjects = None, v_genes = None, j_genes = None):
+    """
+    Read a background file into .ref_df, optionally only some of its subjects and genes.
+
+    Parameters
+    ----------
+    path : str
+      .tsv, .csv or .parquet background (a .parquet may be a partitioned directory, see
+      tcrsampler.parquet.write_parquet_background)
+    subjects : list or None
+      keep only rows of these subjects
+    v_genes : list or None
+      keep only rows with these V genes
+    j_genes : list or None
+      keep only rows with these J genes
+
+    Notes
+    -----
+    Parquet backgrounds push the filters down to the reader, which skips the partitions
+    and row groups that do not match; text files are read in full and then filtered.
+
+    Example
+    -------
+    >>> t.read_background('wirasinha_mouse_beta.parquet', subjects = ['s1', 's2'])
+    >>> t.build_background()
+    """
+    self.ref_df = self._read_background_file(path, subjects = subjects, v_genes = v_genes, j_genes = j_genes)
+    return self.ref_df
+
+  @classmethod
+  def compile_default_background(self, default_background):
+    """
+    Build a default background from the /db/ folder and write it next to the source file
+    as a compiled background (<default_background>.tcrs), which TCRsampler(default_background = ...)
+    then memory-maps instead of re-reading and re-building.
+
+    Parameters
+    ----------
+    default_background : str
+      string name of background file in db/ directory
+
+    Returns
+    -------
+    path : str
+      path to the compiled background directory
+    """
+    path_to_db = os.path.join(os.path.dirname(os.path.realpath(__file__)),'db')
+    path_to_db_bkgd = os.path.join(path_to_db, default_background)
+    if not os.path.isfile(path_to_db_bkgd):
+      raise OSError(f'{path_to_db_bkgd} default file not found.')
+    t = TCRsampler()
+    t.default_bkgd = default_background
+    t.ref_df = t._read_background_file(path_to_db_bkgd)
+    t.build_background()
+    path = t.compile_background(path_to_db_bkgd + COMPILED_SUFFIX)
+    Catalog(path_to_db).register(default_background, sampler = t)
+    return path
+
+  def compile_background(self, path):
+    """
+    Write the built background to a compiled directory that can be memory-mapped with
+    tcrsampler.compiled.load_compiled_background.
+
+    Parameters
+    ----------
+    path : str
+      destination directory, conventionally ending in '.tcrs'
+
+    Returns
+    -------
+    path : str
+    """
+    return compile_background(sampler = self, path = path)
+
   @classmethod
   def currently_available_backgrounds(self):
     """ 
@@ -93,12 +250,17 @@ class TCRsampler():
     Returns
     -------
     available_tsv_and_csv : list
+
+    Notes
+    -----
+    Names come from the db/ manifest (see tcrsampler.catalog.Catalog, which also holds
+    rows, subjects, species and chain of each background), plus any background file
+    installed without a record.
     """
-    path_to_db = os.path.join(os.path.dirname(os.path.realpath(__file__)),'db')
-    available_tsv_and_csv = [f for f in os.listdir(path_to_db) if f.endswith('sv') and f not in ['alphabeta_db.tsv', 'gammadelta_db.tsv']]
-    for filename in sorted(available_tsv_and_csv):
+    catalog = Catalog()
+    available_tsv_and_csv = sorted(set(catalog.names()) | set(catalog.unregistered()))
+    for filename in available_tsv_and_csv:
       sys.stdout.write(f"{filename}\n")
-    available_tsv_and_csv =  sorted(available_tsv_and_csv)
     return available_tsv_and_csv
 
   @classmethod
@@ -113,7 +275,7 @@ class TCRsampler():
 
     Notes
     -----
-    This function will only work on OSX/Linus systems.
+    Set the TCRSAMPLER_DB_MIRROR environment variable to install from a local mirror.
     """
     install_all_next_gen(dry_run = dry_run)
   
@@ -136,7 +298,7 @@ class TCRsampler():
 
     These .zip file contain multiple backgound files. 
 
-    This function will only work on OSX/Linus systems
+    download_from may also be a local directory or file:// URL holding the same files.
     """
     install_nextgen_data_to_db(download_file = download_file, download_from = download_from, dry_run = dry_run)
 
@@ -172,67 +334,153 @@ class TCRsampler():
     >>> _valid_cdr3("AA.A")
     False
     """
-    amino_acids = ['A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L', 'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'Y']
-    valid = np.all([aa in amino_acids for aa in cdr3])
-    return valid
+    return valid_cdr3(cdr3)
+
+  # MiXCR columns used by clean_mixcr, their new names and the dtypes they are read with
+  _mixcr_columns = {'bestVGene'     : ('v_reps', str),
+                    'bestJGene'     : ('j_reps', str),
+                    'aaSeqCDR3'     : ('cdr3', str),
+                    'cloneCount'    : ('count', np.float64),
+                    'cloneFraction' : ('freq', np.float64),
+                    'subject'       : ('subject', str)}
 
-  def clean_mixcr(self, filename = None, df = None):
+  def _clean_mixcr_chunk(self, df):
     """
+    Select, rename and validate the rows of one MiXCR table (or chunk of one).
+
     Parameters
     ----------
-    filenname : str
-      name of mixcr standard output flat .tsv
+    df : pd.DataFrame
+      MiXCR output with at least ['bestVGene','bestJGene', 'aaSeqCDR3','cloneCount', 'cloneFraction'] columns
 
-    Assigns
+    Returns
     -------
-    self.ref_df : pd.DataFrame  
-      DataFarme with columns ['v_reps','j_reps','cdr3', 'count']
+    df : pd.DataFrame
+      DataFrame with columns ['v_reps','j_reps','cdr3', 'count','freq'] (and 'subject' if present)
     """
-    if df is None:
-      df = pd.read_csv(filename, sep = "\t")
+    rename_these_columns = {k:v for k,(v,_) in self._mixcr_columns.items() if k in df.columns}
+    df = df[list(rename_these_columns.keys())].rename(columns = rename_these_columns)
     
-    bar = IncrementalBar('Clean Mixcr     ', max = 1, suffix='%(percent)d%%')
+    ind, rejected = validate_cdr3(df['cdr3'])
+    df = df[ind]
+    for reason, n in rejected.items():
+      self.cdr3_rejected[reason] = self.cdr3_rejected.get(reason, 0) + n
     
+    columns = ['v_reps','j_reps','cdr3', 'count','freq']
     if 'subject' in df.columns:
-      select_these_columns = ['bestVGene','bestJGene', 'aaSeqCDR3','cloneCount', 'cloneFraction','subject']
-    else:
-      select_these_columns = ['bestVGene','bestJGene', 'aaSeqCDR3','cloneCount', 'cloneFraction']
-    
-    rename_these_columns = {'subject':'subject',
-                            'bestVGene':'v_reps',
-                            'bestJGene':'j_reps', 
-                            'aaSeqCDR3':'cdr3',
-                            'cloneCount':'count',
-                            'cloneFraction':'freq'}
-
-    df.rename(columns =rename_these_columns, inplace = True)
-    df['v_reps'] = df['v_reps'].apply(lambda x: f"{x}*01")
-    df['j_reps'] = df['j_reps'].apply(lambda x: f"{x}*01")
-    
-    ind = df['cdr3'].str.startswith('C') & df['cdr3'].str.endswith('F')
-    df = df[ind]
+      columns.append('subject')
+    df = df[columns].reset_index(drop = True)
+    df['v_reps'] = df['v_reps'] + "*01"
+    df['j_reps'] = df['j_reps'] + "*01"
+    return df
 
-    ind = df['cdr3'].apply(lambda x: self._valid_cdr3(cdr3= x))
-    df = df[ind]
-    df = df[rename_these_columns.values()]
-    if 'subject' in df.columns:
-      df = df[['v_reps','j_reps','cdr3', 'count','freq','subject']].copy().reset_index(drop = True)
-    else:
-      df = df[['v_reps','j_reps','cdr3', 'count','freq']].copy().reset_index(drop = True)
-    bar.next()
-    bar.finish()
+  def _mixcr_count_dtype(self, df):
+    """
+    Set the dtype of count once for the whole cleaned MiXCR table, so that chunked and 
+    unchunked reads agree: int64 when every count is a whole number, float64 otherwise.
+    """
+    count = df['count']
+    if count.dtype.kind == 'f' and np.all(np.mod(count.values, 1) == 0):
+      df['count'] = count.astype(np.int64)
+    return df
+
+  def clean_mixcr(self, filename = None, df = None, chunksize = None):
+    """
+    Parameters
+    ----------
+    filenname : str
+      name of mixcr standard output flat .tsv
+    df : pd.DataFrame
+      mixcr output already in memory (used instead of filename)
+    chunksize : int or None
+      If set, filename is streamed in chunks of this many rows, so only the cleaned
+      rows, never the full raw table, are held in memory.
+
+    Assigns
+    -------
+    self.ref_df : pd.DataFrame  
+      DataFarme with columns ['v_reps','j_reps','cdr3', 'count', 'freq'] (and 'subject' if present)
+    self.cdr3_rejected : dict
+      number of rows dropped per reason, see tcrsampler.validate.validate_cdr3
+
+    Notes
+    -----
+    When reading from filename only the six needed columns are parsed, with explicit dtypes.
+    Genes are given the '*01' allele suffix and CDR3s are kept only if they start with C, end
+    with F and contain only the 20 standard amino acids (tcrsampler.validate.validate_cdr3);
+    both steps operate on whole columns.
+    """
+    self.cdr3_rejected = dict()
+    with self.metrics.phase('clean', label = 'Clean Mixcr     ') as record:
+      if df is None:
+        dtype = {k:dt for k,(_,dt) in self._mixcr_columns.items()}
+        reader = pd.read_csv(filename, 
+                             sep = "\t", 
+                             usecols = lambda c: c in self._mixcr_columns, 
+                             dtype = dtype, 
+                             chunksize = chunksize)
+        if chunksize is None:
+          df = self._clean_mixcr_chunk(reader)
+        else:
+          df = pd.concat([self._clean_mixcr_chunk(chunk) for chunk in reader], ignore_index = True)
+      else:
+        df = self._clean_mixcr_chunk(df)
+      df = self._mixcr_count_dtype(df)
+      record['rows'] = df.shape[0] + sum(self.cdr3_rejected.values())
     self.ref_df = df
 
+  def clean_adaptive(self, filename = None, df = None, chunksize = None):
+    """
+    Parameters
+    ----------
+    filenname : str
+      name of Adaptive ImmuneAccess .tsv export
+    df : pd.DataFrame
+      Adaptive export already in memory (used instead of filename)
+    chunksize : int or None
+      If set, filename is read and converted in chunks of this many rows
+
+    Assigns
+    -------
+    self.ref_df : pd.DataFrame  
+      DataFarme with columns ['v_reps','j_reps','cdr3', 'count', 'freq', 'subject'], 
+      see tcrsampler.adaptive.import_adaptive
+    self.cdr3_rejected : dict
+      number of rows dropped per reason, including 'unresolved' for rows without a V or J gene
+    """
+    self.cdr3_rejected = dict()
+    with self.metrics.phase('clean', label = 'Clean Adaptive  ') as record:
+      self.ref_df = import_adaptive(filename = filename, df = df, chunksize = chunksize, rejected = self.cdr3_rejected)
+      record['rows'] = self.ref_df.shape[0]
+
+  def compact(self):
+    """
+    Replace ref_df with a CompactReference, which integer-codes genes and subjects, packs
+    CDR3s into one byte buffer and stores count and freq as int32 and float32. 
+    build_background accepts either form.
+
+    Returns
+    -------
+    report : pd.DataFrame
+      memory used per column by the compact and DataFrame layouts, see CompactReference.memory_usage
+    """
+    df = self.ref_df
+    self.ref_df = CompactReference.from_dataframe(df)
+    return self.ref_df.memory_usage(df)
+
   def build_background( self, 
                         df = None, 
                         max_rows = 100, 
                         stratify_by_subject = False, 
                         use_frequency= True, 
-                        make_singleton = False):
+                        make_singleton = False,
+                        occur_n = None,
+                        cache = None,
+                        lazy = False):
     """
     Parameters
     ----------
-    df : pd.DataFrame
+    df : pd.DataFrame or CompactReference
       DataFrame with ['v_reps','j_reps','cdr3', 'count','freq'] columns
     max_rows : int
       Maximum clones per v,j pair (per subject)  
@@ -243,128 +491,353 @@ class TCRsampler():
     make_singleton : bool
       If True, background is still sorted by frequency or counts, but final fequency and counts values are overridden
       and set to 1. 
+    occur_n : int or None
+      Number of top clones per subject used for the OCCURRENCE METHOD. If None, the number of clones 
+      in the least diverse subject. Can be changed later with .set_occurrence_cutoff()
+    cache : BackgroundCache, str, True or None
+      If not None, the background is looked up in (and after building, stored to) an on-disk cache keyed on
+      a fingerprint of df and the parameters above. True uses the default cache directory
+      (see tcrsampler.cache.default_cache_dir), a str names a cache directory. A background
+      loaded from the cache has no self.stats, so set_occurrence_cutoff, add_subject,
+      remove_subject and without_subjects are not available on it.
+    lazy : bool
+      If True, only the (v,j) group index and the frequency dictionaries are computed; each (v,j)
+      block is ranked, truncated and given its sampling tables the first time it is sampled or
+      accessed in ref_dict (see tcrsampler.blocks.LazyBlocks). Operations that need every block
+      (sample_batch, compile_background, caching, add_subject) build the rest at once. Ignored,
+      with a warning, if cache is given: cached backgrounds are built whole and memory-mapped.
     Assigns
     -------
-    self.ref_dict : dict
-      dictionary keyed on (v,j) tuples pointing to pd.DataFrame
+    self.stats : BackgroundStats
+      (v,j) contingency tables the six frequency dictionaries are derived from
+    self.vj_freq, self.v_freq, self.j_freq, self.vj_occur_freq, self.v_occur_freq, self.j_occur_freq : dict
+    self.blocks : BackgroundBlocks or LazyBlocks
+      flat arrays holding the top max_rows clones of every (v,j) pair, one contiguous block per pair
+    self.ref_dict : BlockDict
+      dictionary keyed on (v,j) tuples pointing to pd.DataFrame, built lazily from self.blocks
     """
     if df is None:
       df = self.ref_df
 
-    if use_frequency:
-      col = 'freq'
+    build_params = {'max_rows' : max_rows,
+                    'stratify_by_subject' : stratify_by_subject,
+                    'use_frequency' : use_frequency,
+                    'make_singleton' : make_singleton,
+                    'occur_n' : occur_n}
+    if cache is not None:
+      if lazy:
+        warnings.warn("lazy = True is ignored when a cache is given; cached backgrounds are built whole and memory-mapped")
+      cache = BackgroundCache.resolve(cache)
+      cache_key = cache.fingerprint(df, build_params)
+      if cache.load(cache_key, sampler = self):
+        # the cache holds no statistics; drop those of any previous build
+        self.stats = None
+        self._build_df = None
+        return
+
+    # genes and subjects are factorized once for both the statistics and the background blocks
+    if isinstance(df, CompactReference):
+      ref = df
     else:
-      col = 'count'
+      ref = CompactReference.from_dataframe(df, compact = False)
 
-    dfg =df.groupby(['v_reps','j_reps'])
+    # V_J PROBABILITIES BY THE SEQUENCE FREQUENCY AND UNIQUE N CLONES METHODS (see NOTES), 
+    # from one (v,j) contingency table and one ranking of clones within subjects
+    with self.metrics.phase('statistics', label = 'V-J Statistics     ') as record:
+      self.stats = BackgroundStats(ref, occur_n = occur_n)
+      self._assign_frequency_dicts()
+      record['rows'], record['groups'] = len(ref), len(self.vj_freq)
 
-    #bar = IncrementalBar('Build Background', max = dfg.ngroups, suffix='%(percent)d%%')
-    
-    bar = IncrementalBar('V-J Frequency Dict ', max = 3, suffix='%(percent)d%%')
-    # V_J OCCURRENCE PROBABILITIES BY THE SEQUENCE FREQUENCY METHOD
-    vj = dfg['freq'].sum().reset_index()
-
-    # Divide frequency by sum of total frequncy across all subjects, assumes most subject frequency columns sum roughly to 1
-    bar.next()
-    vj = vj.assign(freq = np.divide(vj.freq,vj.freq.sum()))
-
-    # Assign a tuple key_dictionary to < .vj_freq >
-    self.vj_freq = {(v,j):f for v,j,f in vj.to_dict('split')['data']}
-    bar.next()
-    # Calculate the marginal V-gene frequencies
-    dfg = df.groupby(['v_reps'])
-    v_only = dfg['freq'].sum().reset_index()
-    v_only = v_only.assign(freq = np.divide(v_only.freq, v_only.freq.sum()))
-    self.v_freq = {v:f for v,f in v_only.to_dict('split')['data']}
-          # TEST THAT assert np.isclose(np.sum([k for _,k in t.v_freq.items()]), 1.0)
-    # Calculate the marginal J-gene frequencies
-    dfg = df.groupby(['j_reps'])
-    j_only = dfg['freq'].sum().reset_index()
-    j_only = j_only.assign(freq = np.divide(j_only.freq, j_only.freq.sum()))
-    self.j_freq = {j:f for j,f in j_only.to_dict('split')['data']}
-          
-    bar.next();bar.finish()
-
-    # V_J OCCURRENCE PROBABILITIES BY THE UNIQUE N CLONES METHOD (see NOTES)
-    bar = IncrementalBar('V-J Occurrence Dict', max = 3, suffix='%(percent)d%%')
-    df_gb_sub = df.\
-      sort_values(['freq','subject'], ascending = False).\
-      groupby(['subject'])
-      # Count # of clone per subject.
-    nclone_per_subject = [group.shape[0] for _,group in df_gb_sub]
-      # Set N to be the number of clones in the subject with the fewest clones
-    N = np.min(nclone_per_subject )
-      # Take only the top N from each subject, and count how often these occured
-      # (note thate we ignore the frequency which reflects clonal expansion)
-    bar.next()
-    vj_occur = df_gb_sub.head(N).groupby(['v_reps', 'j_reps']).\
-      size().\
-      reset_index().\
-      rename(columns = {0:'occur'})
-    vj_occur = vj_occur.assign(occur = np.divide(vj_occur.occur, vj_occur.occur.sum()))
-    assert np.isclose(vj_occur.occur.sum(), 1.0, rtol = 0.000001)
-    self.vj_occur_freq = {(v,j):f for v,j,f in vj_occur.to_dict('split')['data']}
-
-    bar.next()
-    # Calculate the marginal V-gene frequencies
-    v_occur = df_gb_sub.head(N).groupby(['v_reps']).\
-      size().\
-      reset_index().\
-      rename(columns = {0:'occur'})
-    v_occur = v_occur.assign(occur = np.divide(v_occur.occur, v_occur.occur.sum()))
-    assert np.isclose(vj_occur.occur.sum(), 1.0, rtol = 0.000001)
-    self.v_occur_freq = {v:f for v,f in v_occur.to_dict('split')['data']}
-
-    # Calculate the marginal J-gene frequencies
-    j_occur = df_gb_sub.head(N).groupby(['j_reps']).\
-      size().\
-      reset_index().\
-      rename(columns = {0:'occur'})
-    j_occur = j_occur.assign(occur = np.divide(j_occur.occur, j_occur.occur.sum()))
-    assert np.isclose(j_occur.occur.sum(), 1.0, rtol = 0.000001)
-    self.j_occur_freq = {j:f for j,f in j_occur.to_dict('split')['data']}
-
-    bar.next();bar.finish()
-
-
-    dfg =df.groupby(['v_reps','j_reps'])
-    bar = IncrementalBar('Build Background   ', max = dfg.ngroups, suffix='%(percent)d%%')
-    d = dict()
-
-    for i,group in dfg:
-  
-      bar.next()
-      # CASE:  stratify_by_subject = False
-      if not stratify_by_subject:
-        if group.shape[0] > 0:
-          if group.shape[0] > max_rows:
-            n = max_rows
-          else:
-            n = group.shape[0]
-          d[i] =group.sort_values([col], ascending = False).reset_index(drop = True).iloc[0:n,].copy()
-      else: # CASE:  stratify_by_subject = True, another nested groupby, and max_rows applies to subject
-        dfgg = group.groupby(['subject'])
-        for ii , ggroup in dfgg:
-          if ggroup.shape[0] > 0:
-            if ggroup.shape[0] > max_rows:
-              n = max_rows
-            else:
-              n = ggroup.shape[0]
-            if i not in d.keys():
-              d[i] = ggroup.sort_values([col], ascending = False).reset_index(drop = True).iloc[0:n,].copy()
-            else: 
-              dii = ggroup.sort_values([col], ascending = False).reset_index(drop = True).iloc[0:n,].copy()
-              d[i] = pd.concat([d[i],dii])
-    bar.finish()
-    
-    if make_singleton:
-      for k,v in d.items():
-        v['count'] = 1
-        v['freq']  = 1
+    with self.metrics.phase('build', label = 'Build Background   ') as record:
+      if lazy and cache is None:
+        self.blocks = LazyBlocks( ref = ref,
+                                  max_rows = max_rows,
+                                  stratify_by_subject = stratify_by_subject,
+                                  use_frequency = use_frequency,
+                                  make_singleton = make_singleton)
+      else:
+        self.blocks = build_blocks( df = ref, 
+                                    max_rows = max_rows,
+                                    stratify_by_subject = stratify_by_subject, 
+                                    use_frequency = use_frequency,
+                                    make_singleton = make_singleton)
+        self.blocks.precompute_cdfs()
+      self.ref_dict = BlockDict(self.blocks)
+      record['rows'], record['groups'] = len(ref), len(self.blocks)
+    self.build_params = build_params
+    self.compiled_path = None
+    # rows of the statistics line up with df, which add_subject and remove_subject keep in sync
+    self._build_df = df
+    if cache is not None:
+      cache.store(cache_key, sampler = self)
+
+  def _assign_frequency_dicts(self):
+    for name, d in self.stats.frequency_dicts().items():
+      setattr(self, name, d)
+
+  def set_occurrence_cutoff(self, occur_n = None):
+    """
+    Recompute vj_occur_freq, v_occur_freq and j_occur_freq from the top occur_n clones of each
+    subject, reusing the ranking from build_background.
+
+    Parameters
+    ----------
+    occur_n : int or None
+      number of top clones per subject; None uses the number of clones in the least diverse subject
+    """
+    if self.stats is None:
+      raise ValueError("TCRsampler has no reference statistics; run build_background() without cache (compiled and cached backgrounds do not keep them)")
+    self.stats.set_occurrence_cutoff(occur_n)
+    self._assign_frequency_dicts()
+    if self.build_params is not None:
+      self.build_params['occur_n'] = occur_n
+
+  def _all_blocks(self):
+    """
+    Return self.blocks with every block built, first materializing a lazy background.
+    """
+    if isinstance(self.blocks, LazyBlocks):
+      lazy = self.blocks
+      self.blocks = lazy.materialize()
+      if isinstance(self.ref_dict, BlockDict) and self.ref_dict.blocks is lazy:
+        self.ref_dict.blocks = self.blocks
+    return self.blocks
+
+  def _check_incremental(self):
+    if self.stats is None or self._build_base is None or self.blocks is None:
+      raise ValueError("Incremental updates require a background built with build_background()")
+    if self.stats.active is not None:
+      raise ValueError("Views returned by without_subjects() cannot be updated")
+    if self._all_blocks().subjects is None:
+      raise KeyError("Incremental updates require a 'subject' column in the reference")
+
+  def _update_background(self, candidates, df = None):
+    """ 
+    Rebuild blocks from the candidate rows and refresh everything derived from them; df, 
+    if given, replaces the reference.
+    """
+    params = self.build_params
+    self.blocks = build_blocks( df = candidates,
+                                max_rows = params['max_rows'],
+                                stratify_by_subject = params['stratify_by_subject'],
+                                use_frequency = params['use_frequency'],
+                                make_singleton = params['make_singleton'])
+    self.blocks.precompute_cdfs()
+    self.ref_dict = BlockDict(self.blocks)
+    self._assign_frequency_dicts()
+    if df is not None:
+      if self._build_df is self.ref_df:
+        self.ref_df = df
+      self._build_df = df
+    self.compiled_path = None
+
+  def add_subject(self, df, subject = None):
+    """
+    Add the clones of one or more new subjects to a built background.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+      DataFrame with ['v_reps','j_reps','cdr3', 'count','freq'] columns (and 'subject')
+    subject : str or None
+      subject name assigned to every row of df; required if df has no 'subject' column
+
+    Assigns
+    -------
+    self.blocks, self.ref_dict, self.stats and the six frequency dictionaries are updated
+    as if build_background had been run with the rows of df appended to the reference;
+    the reference (ref_df) itself gets the rows appended.
+
+    Notes
+    -----
+    A clone outside the top max_rows of its (v,j) group cannot get back in when rows are
+    added, so the new blocks are the top max_rows of the current block rows merged with the
+    new rows. The statistics add the contribution of the new rows to the stored (v,j) tables;
+    only the occurrence table is recounted if the subject lowers the default occur_n.
+
+    The new rows are kept apart from the reference and the per-row statistics, and joined to
+    them once, when these are next needed (ref_df, remove_subject, without_subjects), so a
+    series of add_subject calls costs time in the size of the subjects and of the background
+    blocks, not of the whole cohort.
+
+    Example
+    -------
+    >>> t.add_subject(new_donor_df, subject = 'donor_17')
+    """
+    self._check_incremental()
+    if subject is not None:
+      df = df.assign(subject = subject)
+    if 'subject' not in df.columns:
+      raise KeyError("add_subject requires a 'subject' column or the subject argument")
+    # a compacted reference stores float32 frequencies; code the new rows the same way
+    new = CompactReference.from_dataframe(df, compact = isinstance(self._build_base, CompactReference))
+    present = self.stats.subjects[self.stats.clones_per_subject > 0]
+    if np.any(np.isin(new.subjects, present)):
+      raise ValueError(f"Subjects already in the background: {sorted(set(new.subjects) & set(present))}")
+
+    candidates = CompactReference.concatenate([self.blocks.as_reference(), new])
+    new = new.recode(candidates.v_genes, candidates.j_genes, candidates.subjects)
+    self.stats.extend_vocab(new.v_genes, new.j_genes, new.subjects)
+    self.stats.add(new)
+
+    self._build_pending.append(new if isinstance(self._build_base, CompactReference) else df.copy())
+    self._update_background(candidates)
+
+  def remove_subject(self, subject):
+    """
+    Remove all clones of a subject from a built background.
+
+    Parameters
+    ----------
+    subject : str
+      subject name
+
+    Assigns
+    -------
+    self.blocks, self.ref_dict, self.stats and the six frequency dictionaries are updated
+    as if build_background had been run without the subject; the subject's rows are
+    dropped from the reference (ref_df).
+
+    Notes
+    -----
+    With stratify_by_subject the subject's blocks are simply dropped. Otherwise, only the
+    (v,j) groups in which the subject had a clone in the background are re-ranked from the
+    reference, since clones of other subjects may move up into the top max_rows. Finding the
+    subject's rows scans the whole reference, so each call costs time in the size of the cohort.
+    """
+    self._check_incremental()
+    stats = self.stats
+    code = pd.Index(stats.subjects).get_indexer([subject])[0]
+    if code < 0 or stats.clones_per_subject[code] == 0:
+      raise KeyError(f"{subject} is not in the background")
+    build_df = self._build_df
+    assert len(build_df) == stats.v_codes.shape[0], "reference rows no longer match the statistics"
+    rows = stats.subject_codes == code
+
+    # the blocks and the statistics share their vocabularies
+    b = self.blocks
+    drop = b.subject_codes == code
+    n_j = max(b.j_genes.shape[0], 1)
+    block_key = b.v_codes.astype(np.int64) * n_j + b.j_codes
+    if self.build_params['stratify_by_subject']:
+      candidates = b.as_reference().take(np.flatnonzero(~drop))
+    else:
+      affected = np.unique(block_key[drop])
+      ref_key = stats.v_codes.astype(np.int64) * n_j + stats.j_codes
+      valid = (stats.v_codes >= 0) & (stats.j_codes >= 0)
+      ref_rows = np.flatnonzero(np.isin(ref_key, affected) & valid & ~rows)
+      if isinstance(build_df, CompactReference):
+        regrouped = build_df.take(ref_rows)
+      else:
+        regrouped = CompactReference.from_dataframe(build_df.iloc[ref_rows], compact = False)
+      candidates = CompactReference.concatenate([b.as_reference().take(np.flatnonzero(~np.isin(block_key, affected))), regrouped])
+    stats.remove(rows)
+
+    if isinstance(build_df, CompactReference):
+      build_df = build_df.take(np.flatnonzero(~rows))
+    else:
+      build_df = build_df[~rows].reset_index(drop = True)
+    self._update_background(candidates, build_df)
+
+  def without_subjects(self, subjects):
+    """
+    Return a view of the background that leaves out one or more subjects, e.g. for
+    leave-one-subject-out comparisons.
+
+    Parameters
+    ----------
+    subjects : str or list of str
+      subject names
+
+    Returns
+    -------
+    view : TCRsampler
+      sampler whose blocks, ref_dict, stats and six frequency dictionaries are those of the
+      background without the subjects. This sampler is left unchanged.
+
+    Notes
+    -----
+    The view is the background build_background would produce without the subjects, but
+    the reference is not re-read or re-sorted. Its blocks are the current block rows of the
+    other subjects, masked by subject code, sharing the CDR3 strings of this background (see
+    tcrsampler.blocks.IndexedStrings). Its statistics share the per-row arrays of self.stats
+    and subtract the contribution of the subjects from copies of the (v,j) tables (see
+    BackgroundStats.excluding).
 
-    self.ref_dict = d
+    Without stratify_by_subject, max_rows applies across subjects: in a (v,j) group where
+    the subjects had clones among the top max_rows, clones of other subjects move up. Those
+    groups alone are re-selected from the reference, as in remove_subject, and the view's
+    blocks are then gathered into new arrays.
 
-  def sample_background(self,v,j,n=1, d= None, depth = 1, seed =1, use_frequency= True ):
+    Views are read-only: add_subject and remove_subject are not available on them.
+
+    Example
+    -------
+    >>> for s in t.stats.subjects:
+    ...   loo = t.without_subjects(s)
+    ...   loo.sample([['TRBV9*01','TRBJ2-7*01', 2]])
+    """
+    if self.stats is None or self.blocks is None:
+      raise ValueError("Leaving out subjects requires a background built with build_background()")
+    if isinstance(subjects, str):
+      subjects = [subjects]
+    subjects = list(subjects)
+    blocks = self._all_blocks()
+    if blocks.subjects is None or self.stats.subjects is None:
+      raise KeyError("Leaving out subjects requires a 'subject' column in the reference")
+    stats = self.stats
+    codes = pd.Index(stats.subjects).get_indexer(subjects)
+    missing = [s for s, c in zip(subjects, codes) if c < 0 or stats.clones_per_subject[c] == 0]
+    if missing:
+      raise KeyError(f"{missing} not in the background")
+
+    view = TCRsampler(metrics = self.metrics)
+    view.default_bkgd = self.default_bkgd
+    view.build_params = None if self.build_params is None else dict(self.build_params)
+    view.stats = stats.excluding(np.isin(stats.subject_codes, codes))
+    view._assign_frequency_dicts()
+    view.blocks = blocks.without_subjects(pd.Index(blocks.subjects).get_indexer(subjects))
+    # rows of view.stats still line up with the reference; view.stats.active masks them
+    view._build_df = self._build_df
+    if not self.build_params['stratify_by_subject']:
+      view.blocks = view._reselect_truncated(view.blocks)
+    view.blocks.precompute_cdfs()
+    view.ref_dict = BlockDict(view.blocks)
+    return view
+
+  def _reselect_truncated(self, blocks):
+    """
+    Re-select from the reference the (v,j) groups of blocks that hold fewer than
+    min(max_rows, clones of the pair left in self.stats) rows, leaving the others as they are.
+    """
+    stats = self.stats
+    params = self.build_params
+    vi, ji = np.nonzero(stats.clone_table > 0)
+    expected = np.minimum(stats.clone_table[vi, ji], params['max_rows'])
+    gids = blocks.lookup(stats.v_genes[vi], stats.j_genes[ji])
+    held = np.where(gids >= 0, np.diff(blocks.offsets)[np.maximum(gids, 0)], 0)
+    short = held < expected
+    if not np.any(short):
+      return blocks
+    n_j = max(stats.j_genes.shape[0], 1)
+    ref_key = stats.v_codes.astype(np.int64) * n_j + stats.j_codes
+    valid = (stats.v_codes >= 0) & (stats.j_codes >= 0)
+    ref_rows = np.flatnonzero(np.isin(ref_key, vi[short].astype(np.int64) * n_j + ji[short]) & valid & stats._active_rows())
+    build_df = self._build_df
+    assert len(build_df) == stats.v_codes.shape[0], "reference rows no longer match the statistics"
+    if isinstance(build_df, CompactReference):
+      regrouped = build_df.take(ref_rows)
+    else:
+      regrouped = CompactReference.from_dataframe(build_df.iloc[ref_rows], compact = False)
+    kept = np.flatnonzero(~np.isin(blocks.block_ids(), gids[short & (gids >= 0)]))
+    candidates = CompactReference.concatenate([blocks.as_reference().take(kept), regrouped])
+    return build_blocks( df = candidates,
+                         max_rows = params['max_rows'],
+                         stratify_by_subject = False,
+                         use_frequency = params['use_frequency'],
+                         make_singleton = params['make_singleton'])
+
+  def sample_background(self,v,j,n=1, d= None, depth = 1, seed =1, use_frequency= True, fallback = None, replace = True, rng = 'legacy', index = 0):
     """
     Parameters
     ----------
@@ -382,10 +855,26 @@ class TCRsampler():
       random number generating seed
     use_frequency : bool
       If True, uses frequency for sampling proportionaly. If False, uses raw counts. 
+    fallback : str, list of str or None
+      If v,j is not in d, sample the substitute found by these policies, tried in order:
+      'allele' (same genes ignoring the allele), 'v' (same V, any J: the rows of every (v,j)
+      pair of the V gene, pooled) or 'j' (same J, any V, pooled likewise).
+      See tcrsampler.fallback.FallbackIndex. None (default) does not substitute.
+    replace : bool
+      If False, draws distinct background rows (weighted sampling without replacement), at
+      most as many as the v,j has. Draws come from np.random.default_rng(seed), so they differ
+      from replace = True for the same seed.
+    rng : str
+      'legacy' (default) seeds the global NumPy RNG with seed, 'generator' uses
+      np.random.default_rng(seed), and 'philox' the counter-based stream of (seed, v, j, index),
+      which gives the same draws as request index of .sample(..., rng = 'philox')
+    index : int
+      request index of the 'philox' stream
 
     Returns
     -------
     r: list
+      [None] (with a warning) if v,j is not available
 
     Example 
     -------
@@ -394,41 +883,421 @@ class TCRsampler():
     if d is None:
       d = self.ref_dict
 
+    assert isinstance(v, str)
+    assert isinstance(j, str)
+    assert isinstance(d, dict)
+    assert isinstance(depth, int)
+    assert isinstance(seed, int)
 
+    key = (v,j)
+    if fallback is not None and key not in d:
+      key = self._fallback_index(d).resolve(v, j, fallback) or key
+    self._check_rng(rng, RNG_MODES)
+    if rng == 'generator':
+      seed = np.random.default_rng(seed)
+    stream = RequestStreams(seed, [(v,j)], [index]) if rng == 'philox' else None
+    r = self._sample_key(key, n = n, d = d, depth = depth, seed = seed, use_frequency = use_frequency, replace = replace, stream = stream)
+    if r is None:
+      warnings.warn(f"({v},{j} gene usage not available")
+      r = [None]
+    return r
+
+  def _fallback_index(self, d):
+    """
+    Return the FallbackIndex of d, memoized on ref_dict (a BlockDict).
+    """
+    if isinstance(d, BlockDict):
+      if d.fallback is None:
+        d.fallback = FallbackIndex(d.keys(), weights = getattr(self, 'vj_freq', None))
+      return d.fallback
+    return FallbackIndex(d.keys(), weights = getattr(self, 'vj_freq', None))
+
+  def _pooled(self, d, key):
+    """
+    Return the background of a V-only (v, None) or J-only (None, j) fallback key, pooling
+    the rows of all its (v,j) pairs: a BackgroundBlocks with one block if they are in
+    self.blocks, else the concatenated frames of d (None if the gene has no pair).
+    Memoized on the FallbackIndex of d.
+    """
+    index = self._fallback_index(d)
+    if key not in index.pools:
+      members = index.members(key)
+      if not members:
+        return None
+      if not isinstance(self.blocks, LazyBlocks) and all(self._uses_blocks(d, k) for k in members):
+        index.pools[key] = self.blocks.pool([self.blocks.index[k] for k in members])
+      else:
+        frames = [d.frame(k) if isinstance(d, BlockDict) else d[k] for k in members]
+        index.pools[key] = pd.concat(frames, ignore_index = True)
+    return index.pools[key]
+
+  def _sample_key(self, key, n, d, depth, seed, use_frequency, replace = True, stream = None):
+    """
+    Sample n * depth CDR3s of key from d, or return None if key is not in d.
+
+    Draws use the legacy global RNG seeded with seed, unless seed is a np.random.Generator,
+    replace is False (np.random.default_rng(seed)) or stream (the RequestStreams of this
+    one request) is given.
+    """
     if use_frequency:
       col = 'freq'
     else:
       col = 'count'
+
+    if stream is not None:
+      rng = stream
+    elif isinstance(seed, np.random.Generator) or not replace:
+      rng = np.random.default_rng(seed)
+    else:
+      rng = None
+
+    blocks, subdf = None, None
+    if is_pooled(key):
+      pooled = self._pooled(d, key)
+      if pooled is None:
+        return None
+      if isinstance(pooled, BackgroundBlocks):
+        blocks, gid = pooled, 0
+      else:
+        subdf = pooled
+    elif self._uses_blocks(d, key):
+      gid = self.blocks.index[key]
+      if isinstance(self.blocks, LazyBlocks):
+        blocks, gid = self.blocks.block(gid), 0
+      else:
+        blocks = self.blocks
+
+    if blocks is not None:
+      if not replace:
+        rows, _ = blocks.draw_distinct([gid], [n * depth], rng = rng, use_frequency = use_frequency)
+        return blocks.cdr3.take(rows).tolist()
+      if rng is not None:
+        rows = blocks.draw_many([gid], [n * depth], rng = rng, use_frequency = use_frequency)
+        return blocks.cdr3.take(rows).tolist()
+      np.random.seed(seed) 
+      rows = blocks.draw(gid, np.random.random_sample(n * depth), use_frequency = use_frequency)
+      return blocks.cdr3.take(rows).tolist()
+
+    if subdf is None:
+      try:
+        subdf = d[key]
+      except KeyError:
+        return None
+
+    if rng is not None:
+      weights = subdf[ col ].to_numpy(dtype = np.float64)
+      if not replace:
+        u = rng.uniforms([weights.shape[0]]) if stream is not None else rng
+        index, _ = _weighted_top_k(weights, [weights.shape[0]], [n * depth], u)
+      else:
+        u = rng.uniforms([n * depth]) if stream is not None else rng.random(n * depth)
+        cdf = np.cumsum(weights)
+        index = np.minimum(np.searchsorted(cdf, u * cdf[-1], side = 'right'), weights.shape[0] - 1)
+      return subdf['cdr3'].iloc[index].to_list()
+
+    selection_probability = \
+      subdf[ col ] / np.sum(subdf[ col ])
+
+    np.random.seed(seed) 
     
-    assert isinstance(v, str)
-    assert isinstance(j, str)
-    assert isinstance(d, dict)
+    probabalistic_selection_index = \
+      np.random.choice( range(subdf.shape[0]),
+      size = n * depth,
+      p=selection_probability)
+
+    r = subdf.iloc[probabalistic_selection_index,]['cdr3'].to_list()
+    return r
+
+
+  def sample_batch(self, v, j = None, n = None, depth = 1, seed = 1, use_frequency = True, return_index = False, replace = True, rng = 'generator', index = None):
+    """
+    Sample CDR3s for many (v,j,n) requests at once.
+
+    Parameters
+    ----------
+    v : array-like of str or pd.DataFrame
+      v-gene names, or a DataFrame with 'v_reps', 'j_reps' and 'n' columns
+    j : array-like of str
+      j-gene names, parallel to v (ignored if v is a DataFrame)
+    n : array-like of int
+      number of cdr3 samples to draw for each v,j (ignored if v is a DataFrame)
+    depth : int
+      mulitple of the number of times to sample for a given frequncy.
+    seed : int, np.random.SeedSequence or np.random.Generator
+      seed for the single np.random.Generator used for all draws
+    use_frequency : bool
+      If True, uses frequency for sampling proportionaly. If False, uses raw counts.
+    return_index : bool
+      If True, also return the background row index of every draw
+    replace : bool
+      If False, each request draws distinct rows (weighted sampling without replacement,
+      see BackgroundBlocks.draw_distinct), at most as many as its (v,j) pair has
+    rng : str
+      'generator' (default) draws all requests from one np.random.Generator; 'philox' draws
+      request i from the counter-based stream of (seed, v, j, index[i]), as .sample(..., rng = 'philox')
+    index : array-like of int or None
+      request indices of the 'philox' streams, by default 0 .. len(v) - 1
+
+    Returns
+    -------
+    cdr3 : np.ndarray
+      object array of all sampled CDR3s
+    offsets : np.ndarray
+      int64 array of length len(v) + 1; the draws for request i are cdr3[offsets[i]:offsets[i+1]].
+      Requests for a (v,j) pair not in the background get an empty slice.
+    rows : np.ndarray
+      only if return_index is True; int64 row indices into self.blocks
+
+    Notes
+    -----
+    Draws come from a np.random.Generator rather than the legacy global RNG, so they
+    differ from .sample for the same seed, but are reproducible for a given seed.
+    Draws come from the background as built (self.blocks); unlike .sample, they do not
+    see frames set in, or edited through, self.ref_dict.
+
+    Example
+    -------
+    >>> cdr3, offsets = t.sample_batch(['TRBV9*01','TRBV7-7*01'], ['TRBJ2-7*01', 'TRBJ2-4*01'], [2, 4])
+    """
     assert isinstance(depth, int)
-    assert isinstance(seed, int)
+    if self.blocks is None:
+      raise ValueError("TCRsampler has no background; run build_background() first")
+    blocks = self._all_blocks()
+    if isinstance(v, pd.DataFrame):
+      v, j, n = v['v_reps'].values, v['j_reps'].values, v['n'].values
+    self._check_rng(rng, ['generator', 'philox'])
+    if rng == 'philox':
+      rng = RequestStreams(seed, zip(v, j), index)
+    else:
+      rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
 
-    try:
-      subdf = d[(v,j)]
-  
-      selection_probability = \
-        subdf[ col ] / np.sum(subdf[ col ])
+    with self.metrics.phase('sample_batch') as record:
+      gids = blocks.lookup(v, j)
+      sizes = np.where(gids >= 0, np.asarray(n, dtype = np.int64) * depth, 0)
+      if replace:
+        rows = blocks.draw_many(gids, sizes, rng = rng, use_frequency = use_frequency)
+      else:
+        rows, sizes = blocks.draw_distinct(gids, sizes, rng = rng, use_frequency = use_frequency)
+      offsets = np.zeros(gids.shape[0] + 1, dtype = np.int64)
+      np.cumsum(sizes, out = offsets[1:])
+      cdr3 = blocks.cdr3.take(rows)
+      record['rows'], record['groups'] = rows.shape[0], gids.shape[0]
+    if return_index:
+      return cdr3, offsets, rows
+    return cdr3, offsets
 
-      np.random.seed(seed) 
-      
-      probabalistic_selection_index = \
-        np.random.choice( range(subdf.shape[0]),
-        size = n * depth,
-        p=selection_probability)
+  def sample_counts(self, v_j_usage, depth = 1, seed = 1, use_frequency = True, fallback = None):
+    """
+    Sample a reference dictionary based on v and j gene usage, returning the distinct CDR3s
+    drawn for every request with the number of times each was drawn, instead of n * depth strings.
 
-      r = subdf.iloc[probabalistic_selection_index,]['cdr3'].to_list()
-      return r
+    Parameters
+    ----------
+    v_j_usage : list of lists or list of tuples (v-gene. j-gene, n), or pd.DataFrame
+      e.g., ['TRBV9*01','TRBJ2-7*01', 2],['TRBV7-7*01', 'TRBJ2-4*01', 4], or a DataFrame
+      with 'v_reps', 'j_reps' and 'n' columns
+    depth : int
+      mulitple of the number of times to sample for a given frequncy.
+    seed : int, np.random.SeedSequence or np.random.Generator
+      seed for the single np.random.Generator used for all draws
+    use_frequency : bool
+      If True, uses frequency for sampling proportionaly. If False, uses raw counts.
+    fallback : str, list of str or None
+      policies used to substitute (v,j) pairs that are not in the background, see sample_background
 
-    except KeyError:
-      warnings.warn(f"({v},{j} gene usage not available")
-      r = [None]
-      return r
+    Returns
+    -------
+    df : pd.DataFrame
+      ['request','v_reps','j_reps','cdr3','count'] columns, one row per distinct CDR3 drawn
+      for each request (request is its position in v_j_usage; v_reps and j_reps are the
+      requested genes). The counts of a request sum to n * depth. Requests without a
+      background (or fallback) have no rows and are listed in .missing_report, as in .sample.
+
+    Notes
+    -----
+    The counts of a request are one multinomial draw over the weights of its (v,j) block
+    (BackgroundBlocks.draw_counts), so time and memory scale with the block size, not with
+    n * depth. The counts follow the same distribution as tallying .sample(..., depth = depth),
+    but are not the tallies of its draws for the same seed. As in .sample_batch, draws come
+    from the background as built and do not see frames set in or edited through self.ref_dict.
+
+    Example
+    -------
+    >>> t.sample_counts([['TRBV9*01','TRBJ2-7*01', 2],['TRBV7-7*01', 'TRBJ2-4*01', 4] ], depth = 1000)
+    """
+    assert isinstance(depth, int)
+    if self.blocks is None:
+      raise ValueError("TCRsampler has no background; run build_background() first")
+    if isinstance(v_j_usage, pd.DataFrame):
+      v_j_usage = list(zip(v_j_usage['v_reps'], v_j_usage['j_reps'], v_j_usage['n']))
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    blocks = self._all_blocks()
+
+    with self.metrics.phase('sample_counts') as record:
+      keys, missing = self._resolve_keys(v_j_usage, self.ref_dict, fallback)
+      gids = blocks.lookup([k[0] for k in keys], [k[1] for k in keys])
+      sizes = np.where(gids >= 0, np.asarray([n for _,_,n in v_j_usage], dtype = np.int64) * depth, 0)
+      rows, counts, n_distinct = blocks.draw_counts(gids, sizes, rng = rng, use_frequency = use_frequency)
+      request = np.repeat(np.arange(len(v_j_usage)), n_distinct)
+      cdr3 = [blocks.cdr3.take(rows)]
+      requests, tallies = [request], [counts]
+      # V-only and J-only fallbacks draw from the pooled rows of their gene
+      index = None
+      for i, key in enumerate(keys):
+        if is_pooled(key):
+          index = self._fallback_index(self.ref_dict) if index is None else index
+          members = [blocks.index[k] for k in index.members(key) if k in blocks.index]
+          if not members:
+            continue
+          pooled = blocks.pool(members)
+          rows, counts, _ = pooled.draw_counts([0], [v_j_usage[i][2] * depth], rng = rng, use_frequency = use_frequency)
+          cdr3.append(pooled.cdr3.take(rows))
+          requests.append(np.full(rows.shape[0], i, dtype = np.int64))
+          tallies.append(counts)
+      request = np.concatenate(requests)
+      order = np.argsort(request, kind = 'stable')
+      request = request[order]
+      df = pd.DataFrame({'request' : request,
+                         'v_reps' : np.array([v for v,_,_ in v_j_usage], dtype = object)[request],
+                         'j_reps' : np.array([j for _,j,_ in v_j_usage], dtype = object)[request],
+                         'cdr3' : np.concatenate(cdr3)[order],
+                         'count' : np.concatenate(tallies)[order]})
+      record['rows'], record['groups'] = df.shape[0], len(v_j_usage)
+
+    self._report_missing(missing)
+    return df
+
+  def synthesize(self, n, method = 'frequency', seed = 1, use_frequency = True):
+    """
+    Generate a synthetic repertoire of n clones whose V-J usage follows the background.
+
+    Parameters
+    ----------
+    n : int
+      number of clones
+    method : str
+      'frequency' draws (v,j) pairs from vj_freq, 'occurrence' from vj_occur_freq (see NOTES of TCRsampler)
+    seed : int, np.random.SeedSequence or np.random.Generator
+      seed for the single np.random.Generator used for all draws
+    use_frequency : bool
+      If True, CDR3s are drawn proportionaly to frequency. If False, uses raw counts.
+
+    Returns
+    -------
+    df : pd.DataFrame
+      n rows with ['v_reps','j_reps','cdr3'] columns, grouped by (v,j)
 
+    Notes
+    -----
+    The number of clones of every (v,j) pair comes from one multinomial draw over the
+    distribution, renormalized over the pairs present in the background; all CDR3s are
+    then drawn with one BackgroundBlocks.draw_many call and gathered by row index.
 
-  def sample(self, v_j_usage, depth = 1, seed = 1, flatten = False, use_frequency= True):
+    Example
+    -------
+    >>> df = t.synthesize(n = 10**6, method = 'occurrence', seed = 2)
+    """
+    if method == 'frequency':
+      dist = self.vj_freq
+    elif method == 'occurrence':
+      dist = self.vj_occur_freq
+    else:
+      raise ValueError("method must be 'frequency' or 'occurrence'")
+    if self.blocks is None:
+      raise ValueError("TCRsampler has no background; run build_background() first")
+    blocks = self._all_blocks()
+    rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+
+    with self.metrics.phase('synthesize') as record:
+      keys = list(dist.keys())
+      gids = blocks.lookup([k[0] for k in keys], [k[1] for k in keys])
+      p = np.array(list(dist.values()), dtype = np.float64)
+      p = np.where(gids >= 0, p, 0.0)
+      if not p.sum() > 0:
+        raise ValueError(f"vj_{method[:5]}_freq has no (v,j) pair present in the background")
+      sizes = rng.multinomial(n, p / p.sum())
+      rows = blocks.draw_many(gids, sizes, rng = rng, use_frequency = use_frequency)
+      df = pd.DataFrame({'v_reps' : blocks.v_genes[blocks.v_codes[rows]],
+                         'j_reps' : blocks.j_genes[blocks.j_codes[rows]],
+                         'cdr3'   : blocks.cdr3.take(rows)})
+      record['rows'], record['groups'] = df.shape[0], int(np.count_nonzero(sizes))
+    return df
+
+  def _sample_requests(self, keys, sizes, d, rng, use_frequency, replace):
+    """
+    Draw sizes[i] CDR3s of keys[i] for every i, with one BackgroundBlocks.draw_many or
+    draw_distinct call for all keys in self.blocks. rng is a np.random.Generator shared by
+    all requests or their RequestStreams. Returns a list of lists, [None] for keys not in d.
+    """
+    streams = rng if isinstance(rng, RequestStreams) else None
+    result = [None] * len(keys)
+    batched = list()
+    if self.blocks is not None and not isinstance(self.blocks, LazyBlocks):
+      batched = [i for i, key in enumerate(keys) if self._uses_blocks(d, key)]
+    if batched:
+      gids = [self.blocks.index[keys[i]] for i in batched]
+      counts = [sizes[i] for i in batched]
+      source = rng if streams is None else streams.take(batched)
+      if replace:
+        rows = self.blocks.draw_many(gids, counts, rng = source, use_frequency = use_frequency)
+      else:
+        rows, counts = self.blocks.draw_distinct(gids, counts, rng = source, use_frequency = use_frequency)
+      cdr3 = self.blocks.cdr3.take(rows)
+      for i, r in zip(batched, np.split(cdr3, np.cumsum(counts)[:-1])):
+        result[i] = r.tolist()
+    for i, key in enumerate(keys):
+      if result[i] is None:
+        r = self._sample_key(key, n = sizes[i], d = d, depth = 1, seed = rng, use_frequency = use_frequency, replace = replace,
+                             stream = None if streams is None else streams.take([i]))
+        result[i] = [None] if r is None else r
+    return result
+
+  def _resolve_keys(self, v_j_usage, d, fallback):
+    """
+    Return the key sampled for every (v,j,n) request, substituted under the fallback policies
+    if (v,j) is not in d, and a dict (v,j) -> (requests, total n, substitute) of missing pairs.
+    """
+    substitutes = None
+    missing = dict()
+    keys = list()
+    for v,j,n in v_j_usage:
+      key = (v,j)
+      if key not in d:
+        if fallback is not None:
+          if substitutes is None:
+            substitutes = self._fallback_index(d)
+          key = substitutes.resolve(v, j, fallback) or key
+        requests, total, _ = missing.get((v,j), (0, 0, None))
+        missing[(v,j)] = (requests + 1, total + n, key if key != (v,j) else None)
+      keys.append(key)
+    return keys, missing
+
+  def _report_missing(self, missing):
+    """
+    Assign self.missing_report from the missing pairs of _resolve_keys and warn once if any.
+    """
+    self.missing_report = pd.DataFrame([[v, j, requests, total, sub] for (v, j), (requests, total, sub) in missing.items()],
+                                       columns = ['v_reps', 'j_reps', 'requests', 'n', 'fallback'])
+    if missing:
+      unresolved = int(self.missing_report['fallback'].isna().sum())
+      warnings.warn(f"{len(missing)} (v,j) gene usages not available ({unresolved} without fallback); see .missing_report")
+
+  @staticmethod
+  def _check_rng(rng, modes):
+    if rng not in modes:
+      raise ValueError(f"rng must be one of {list(modes)}, not {rng!r}; see tcrsampler.streams.RNG_MODES")
+
+  def _uses_blocks(self, d, key):
+    """
+    True if key can be sampled from the precomputed tables in self.blocks rather than from d[key],
+    i.e. d[key] has never been handed out, so cannot have been edited.
+    """
+    return isinstance(d, BlockDict) and \
+      d.blocks is self.blocks and \
+      key in d and \
+      not d.handed_out(key)
+
+  def sample(self, v_j_usage, depth = 1, seed = 1, flatten = False, use_frequency= True, fallback = None, replace = True, rng = 'legacy', index = None):
     """
     Sample a reference dictionary based on v and j gene usage 
 
@@ -442,11 +1311,39 @@ class TCRsampler():
       random number initialization
     flatten : bool
       if true return a single list, if false a list of lists 
+    use_frequency : bool
+      If True, uses frequency for sampling proportionaly. If False, uses raw counts. 
+    fallback : str, list of str or None
+      policies used to substitute (v,j) pairs that are not in the background, see sample_background
+    replace : bool
+      If False, every request gets distinct background CDR3s (weighted sampling without
+      replacement), at most as many as its (v,j) pair has. All requests are drawn together
+      from one np.random.default_rng(seed) (unless rng is 'philox'), so results differ from
+      replace = True.
+    rng : str
+      source of random numbers (see tcrsampler.streams.RNG_MODES). 'legacy' (default) seeds the
+      global NumPy RNG with seed before every request, so every request with the same (v,j)
+      gets the same draws. 'generator' draws all requests from one np.random.default_rng(seed).
+      'philox' draws request i from a counter-based stream keyed on (seed, v, j, index[i]): the
+      result of a request does not depend on the other requests, on their order, or on the
+      process or thread it runs in, and the global RNG is not touched.
+    index : list of int or None
+      request indices of the 'philox' streams, by default 0 .. len(v_j_usage) - 1. To sample a
+      subset of a usage table (e.g. on a worker), pass the subset's positions in the full table
+      to get exactly the draws of the full call.
     
     Returns 
     -------
     result : list
-      list of lists if flatten is False, list if flatten is True 
+      list of lists if flatten is False, list if flatten is True. Pairs without a background
+      (or fallback) give [None].
+
+    Assigns
+    -------
+    self.missing_report : pd.DataFrame
+      one row per distinct requested (v,j) pair that is not in the background, with the number
+      of 'requests', the total 'n' requested and the 'fallback' key used (None if none applied).
+      A single warning summarizes it, instead of one warning per pair.
 
     Example
     -------
@@ -455,14 +1352,28 @@ class TCRsampler():
     assert isinstance(v_j_usage, list)
     assert isinstance(depth, int)
     assert isinstance(seed, int)
+    self._check_rng(rng, RNG_MODES)
 
+    d = self.ref_dict
     result = list()
-    for v,j,n in v_j_usage:
-      r = self.sample_background(v = v, j = j, n = n, depth = depth, seed = seed, use_frequency= use_frequency)
-      result.append(r)
+    with self.metrics.phase('sample') as record:
+      keys, missing = self._resolve_keys(v_j_usage, d, fallback)
+      if replace and rng == 'legacy':
+        for key, (_,_,n) in zip(keys, v_j_usage):
+          r = self._sample_key(key, n = n, d = d, depth = depth, seed = seed, use_frequency = use_frequency)
+          result.append([None] if r is None else r)
+      elif keys:
+        if rng == 'philox':
+          source = RequestStreams(seed, [(v,j) for v,j,_ in v_j_usage], index)
+        else:
+          source = np.random.default_rng(seed)
+        result = self._sample_requests(keys, [n * depth for _,_,n in v_j_usage], d = d, rng = source,
+                                       use_frequency = use_frequency, replace = replace)
+      record['rows'], record['groups'] = sum(len(r) for r in result), len(v_j_usage)
+
+    self._report_missing(missing)
 
     if flatten:
       result = list(np.concatenate(result))
 
     return result
-
@@ -1,6 +1,14 @@
 import os
 import sys
-__all__ = ['install_nextgen_data_to_db']
+import shutil
+import hashlib
+import zipfile
+import warnings
+import urllib.request
+from urllib.parse import quote, urlparse
+from urllib.request import url2pathname
+from concurrent.futures import ThreadPoolExecutor
+__all__ = ['install_nextgen_data_to_db', 'install_all_next_gen', 'fetch_file', 'extract_zip', 'sha256sum']
 
 
 select_files = ["wiraninha_sampler.zip",
@@ -29,7 +37,184 @@ address = { "ravens_samplers.zip"                             : "https://www.dro
             "new_nextgen_chains_human_D.tsv"                  : 'https://www.dropbox.com/s/8ysciqrcywdsryp/new_nextgen_chains_human_B.tsv?dl=1'}
 
 
-def install_nextgen_data_to_db(download_file, download_from = "dropbox", dry_run = False):
+# Known SHA-256 digests of the files in address, filename -> hex digest. Files without an
+# entry are verified against a SHA256SUMS file of the mirror they come from, if any.
+checksums = dict()
+
+# Environment variable naming a default mirror (local directory or file:// URL)
+MIRROR_ENV = "TCRSAMPLER_DB_MIRROR"
+
+download_sources = ["dropbox"]
+
+
+def _db_path():
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), "db")
+
+
+def _is_mirror(download_from):
+    return download_from.startswith("file://") or os.path.isdir(download_from)
+
+
+def _mirror_url(mirror, filename):
+    if mirror.startswith("file://"):
+        return mirror.rstrip("/") + "/" + quote(filename)
+    return "file://" + quote(os.path.abspath(os.path.join(mirror, filename)))
+
+
+def _mirror_checksums(mirror):
+    """
+    Read the SHA256SUMS file ('<hex digest>  <filename>' lines) of a mirror, if present.
+    """
+    path = url2pathname(urlparse(mirror).path) if mirror.startswith("file://") else mirror
+    sums = os.path.join(path, "SHA256SUMS")
+    result = dict()
+    if os.path.isfile(sums):
+        with open(sums) as fh:
+            for line in fh:
+                parts = line.split()
+                if len(parts) == 2:
+                    result[parts[1].lstrip("*")] = parts[0].lower()
+    return result
+
+
+def sha256sum(filename, chunk_size = 2**20):
+    """
+    Return the SHA-256 hex digest of a file, read in chunks.
+    """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _is_up_to_date(destination, sha256):
+    """
+    A file is up to date if it matches the expected digest or, without one, the digest
+    recorded in its .sha256 file when its download completed.
+    """
+    if not os.path.isfile(destination):
+        return False
+    if sha256 is None:
+        record = destination + ".sha256"
+        if not os.path.isfile(record):
+            return False
+        with open(record) as fh:
+            sha256 = fh.read().split()[0]
+    return sha256sum(destination) == sha256.lower()
+
+
+def fetch_file(url, destination, sha256 = None, timeout = 60, chunk_size = 2**20):
+    """
+    Download one file, resuming a previous partial download and verifying its checksum.
+
+    Parameters
+    ----------
+    url : string
+        http(s):// or file:// URL
+    destination : string
+        path of the downloaded file
+    sha256 : string or None
+        expected SHA-256 hex digest; if None the file is not verified, but its digest is
+        recorded so later calls can tell it is up to date
+    timeout : float
+        seconds to wait for the server
+    chunk_size : int
+        bytes read and written at a time
+
+    Returns
+    -------
+    status : string
+        'skipped' if destination was already up to date, else 'downloaded'
+
+    Notes
+    -----
+    Data is written to destination + '.part' and moved in place once complete. A
+    .part file left by an interrupted download is resumed with an HTTP Range request
+    (or restarted if the server does not support ranges). A file whose digest does not
+    match sha256 is deleted and ValueError is raised.
+    """
+    if _is_up_to_date(destination, sha256):
+        return 'skipped'
+    part = destination + ".part"
+    offset = os.path.getsize(part) if os.path.isfile(part) else 0
+    request = urllib.request.Request(url)
+    if offset > 0:
+        request.add_header("Range", f"bytes={offset}-")
+    try:
+        response = urllib.request.urlopen(request, timeout = timeout)
+    except urllib.error.HTTPError as e:
+        if e.code != 416:
+            raise
+        # 416: the part file already holds the whole file
+        response = None
+    if response is not None:
+        with response:
+            # only a 206 continues the part file; anything else is the whole file
+            mode = 'ab' if offset > 0 and getattr(response, 'status', None) == 206 else 'wb'
+            with open(part, mode) as fh:
+                shutil.copyfileobj(response, fh, chunk_size)
+    digest = sha256sum(part)
+    if sha256 is not None and digest != sha256.lower():
+        os.remove(part)
+        raise ValueError(f"SHA-256 of {url} is {digest}, expected {sha256}")
+    os.replace(part, destination)
+    with open(destination + ".sha256", 'w') as fh:
+        fh.write(f"{digest}  {os.path.basename(destination)}\n")
+    return 'downloaded'
+
+
+def extract_zip(filename, destination, overwrite = False):
+    """
+    Extract a zip archive member by member, streaming each one to disk.
+
+    Parameters
+    ----------
+    filename : string
+        path of the .zip file
+    destination : string
+        directory the members are extracted into
+    overwrite : bool
+        if False, members already extracted with the right size are left alone
+
+    Returns
+    -------
+    extracted : list
+        paths of the members written
+    """
+    root = os.path.realpath(destination)
+    extracted = list()
+    with zipfile.ZipFile(filename) as zf:
+        for info in zf.infolist():
+            target = os.path.realpath(os.path.join(root, info.filename))
+            if os.path.commonpath([root, target]) != root:
+                raise ValueError(f"{info.filename} in {filename} would be extracted outside {destination}")
+            if info.is_dir():
+                os.makedirs(target, exist_ok = True)
+                continue
+            if not overwrite and os.path.isfile(target) and os.path.getsize(target) == info.file_size:
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok = True)
+            with zf.open(info) as src, open(target + ".part", 'wb') as dst:
+                shutil.copyfileobj(src, dst, 2**20)
+            os.replace(target + ".part", target)
+            extracted.append(target)
+    return extracted
+
+
+def _register(path, installed, source):
+    """
+    Record installed background files in the manifest of the db/ folder.
+    """
+    from tcrsampler.catalog import Catalog, _is_background_file
+    catalog = Catalog(path)
+    for filename in installed:
+        name = os.path.relpath(filename, path)
+        if _is_background_file(name):
+            catalog.register(name, source = source)
+
+
+def install_nextgen_data_to_db(download_file, download_from = "dropbox", dry_run = False, sha256 = None, raise_errors = False):
     """
     Function installs next-gen files
 
@@ -38,48 +223,102 @@ def install_nextgen_data_to_db(download_file, download_from = "dropbox", dry_run
     download_file : string
         "new_nextgen_chains_mouse_A.tsv"
     download_from : string 
-        'dropbox' is only currently available option
+        'dropbox', or a mirror: a local directory or file:// URL holding files with the
+        same names (e.g. a shared cache on an air-gapped cluster)
     dry_run : bool 
         if True, download commands are printed but no executed
+    sha256 : string or None
+        expected SHA-256 hex digest (default from checksums, or the mirror's SHA256SUMS file)
+    raise_errors : bool
+        if True, a failed download raises; by default it is reported with a warning
     Returns
     -------
     curl_url_cmd : string
         the command for installing to tcrdist/db/alphabeta_db.tsv_files/*
 
+    Notes
+    -----
+    Files already installed and unchanged are not downloaded again, interrupted downloads
+    are resumed, and .zip files are extracted into the db/ folder. Installed backgrounds
+    are recorded in db/manifest.json (see tcrsampler.catalog.Catalog).
     """
     if not isinstance(download_from, str):
         raise TypeError('The <download_from> arg must be a string')
     
-    download_sources = ["dropbox"]
-    if download_from not in download_sources:
-        raise KeyError(f"the <download_from> arg must be be one of the following {download_sources}")
+    if not isinstance(download_file, str):
+        raise TypeError('The <download_file> arg must be a string')
 
-    if download_from is download_sources:
-        if download_file not in address.keys():
-            raise KeyError("download_file must be in {}".format(",".join(map(str,address.keys()))))
+    mirror = _is_mirror(download_from)
+    if download_from not in download_sources and not mirror:
+        raise KeyError(f"the <download_from> arg must be be one of the following {download_sources}, a directory or a file:// URL")
+
+    if download_file not in address.keys():
+        raise KeyError("download_file must be in {}".format(",".join(map(str,address.keys()))))
 
     # Where the file is to be installed
-    path_file = os.path.realpath(__file__)
-    path = os.path.dirname(path_file)
-    install_path = os.path.join(path, "db", download_file) #<----- ALPHA BETA destination
+    path = _db_path()
+    install_path = os.path.join(path, download_file) #<----- ALPHA BETA destination
+
+    if mirror:
+        url = _mirror_url(download_from, download_file)
+        if sha256 is None:
+            sha256 = _mirror_checksums(download_from).get(download_file)
+    else:
+        url = address[download_file]
+    if sha256 is None:
+        sha256 = checksums.get(download_file)
 
     def generate_curl(filename, download_link):
         return('curl -o {} {} -L'.format(filename, download_link))
 
-    curl_url_cmd = generate_curl(install_path, address[download_file])
+    curl_url_cmd = generate_curl(install_path, url)
     sys.stdout.write("RUNNING: {}\n".format(curl_url_cmd) )
 
     if dry_run is False:
-        os.system(curl_url_cmd)
-        if os.path.isfile(install_path) and install_path.endswith(".zip"):
-            os.system('unzip {} -d {}'.format(install_path, os.path.join(path, "db")))
+        try:
+            status = fetch_file(url, install_path, sha256 = sha256)
+            if install_path.endswith(".zip"):
+                installed = extract_zip(install_path, path, overwrite = status == 'downloaded')
+            else:
+                installed = [install_path] if status == 'downloaded' else []
+            _register(path, installed, source = url)
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            if raise_errors:
+                raise
+            warnings.warn(f"Could not install {download_file} from {url}: {e}")
+        else:
+            sys.stdout.write("{}: {}\n".format(status.upper(), download_file))
 
     return(curl_url_cmd)
 
 
-def install_all_next_gen(dry_run = False):
+def install_all_next_gen(dry_run = False, download_from = None, max_workers = 4, raise_errors = False):
+    """
+    Install all files in select_files, downloading up to max_workers at a time.
+
+    Parameters
+    ----------
+    dry_run : bool
+        if True, download commands are printed but no executed
+    download_from : string or None
+        'dropbox' or a mirror (see install_nextgen_data_to_db); by default the
+        TCRSAMPLER_DB_MIRROR environment variable if set, else 'dropbox'
+    max_workers : int
+        number of concurrent downloads
+    raise_errors : bool
+        if True, raise the first failed download after all have been tried
 
+    Returns
+    -------
+    curl_url_cmds : list
+        the command for each file
+    """
+    if download_from is None:
+        download_from = os.environ.get(MIRROR_ENV, "dropbox")
 
-    for fn in select_files:
-        install_nextgen_data_to_db(download_file = fn, download_from = 'dropbox', dry_run = dry_run )
+    def install(fn):
+        return install_nextgen_data_to_db(download_file = fn, download_from = download_from, dry_run = dry_run, raise_errors = raise_errors)
 
+    with ThreadPoolExecutor(max_workers = max(1, max_workers)) as ex:
+        futures = [ex.submit(install, fn) for fn in select_files]
+    return [f.result() for f in futures]
@@ -0,0 +1,131 @@
+import numpy as np
+from multiprocessing import shared_memory
+from tcrsampler.compiled import _to_arrays, _from_arrays
+
+__all__ = ['SharedBackground']
+
+# byte alignment of every array in the shared segment
+_ALIGN = 64
+
+
+def _open_segment(name):
+  """
+  Attach to an existing segment without registering it for cleanup by this process.
+  """
+  try:
+    return shared_memory.SharedMemory(name = name, track = False)
+  except TypeError:
+    # Python < 3.13 has no track argument; worker processes share the resource tracker
+    # of the publishing process, so the segment still lives until it is unlinked
+    return shared_memory.SharedMemory(name = name)
+
+
+class SharedBackground():
+  """
+  A built background published once into one multiprocessing.shared_memory segment.
+
+  Worker processes attach to it by name and get a read-only TCRsampler whose blocks,
+  CDR3 buffer and sampling tables are views of the shared pages, so memory does not grow
+  with the number of workers and workers start without reading or building anything.
+
+  Attributes
+  ----------
+  handle : dict
+    small picklable description (segment name, array layout and background metadata)
+    passed to SharedBackground.attach in the workers
+
+  Example
+  -------
+  >>> with SharedBackground.publish(t) as shared:
+  ...   with ProcessPoolExecutor(32, initializer = init, initargs = (shared.handle,)) as ex:
+  ...     ...
+  >>> # in a worker
+  >>> t = SharedBackground.attach(handle)
+  >>> t.sample([['TRBV9*01','TRBJ2-7*01', 2]])
+
+  Notes
+  -----
+  The publishing process owns the segment: it must stay alive while workers use it, and
+  close() (or leaving the with block) unlinks it. Compiled backgrounds (see
+  tcrsampler.compiled) are the file-backed alternative, shared through the page cache.
+  """
+  def __init__(self, shm, handle):
+    self.shm = shm
+    self.handle = handle
+
+  @classmethod
+  def publish(cls, sampler):
+    """
+    Copy the background of a built sampler, with its precomputed sampling tables, into a
+    new shared memory segment.
+
+    Parameters
+    ----------
+    sampler : TCRsampler
+
+    Returns
+    -------
+    shared : SharedBackground
+    """
+    # the arrays include the sampling tables, so workers do not each compute their own copy
+    arrays, meta = _to_arrays(sampler)
+
+    layout = dict()
+    size = 0
+    for name, a in arrays.items():
+      a = np.asarray(a)
+      size = -(-size // _ALIGN) * _ALIGN
+      layout[name] = (size, a.dtype.str, a.shape)
+      size += a.nbytes
+    shm = shared_memory.SharedMemory(create = True, size = max(size, 1))
+    for name, a in arrays.items():
+      offset, dtype, shape = layout[name]
+      view = np.ndarray(shape, dtype = dtype, buffer = shm.buf, offset = offset)
+      view[...] = a
+      del view
+    return cls(shm, {'name' : shm.name, 'layout' : layout, 'meta' : meta})
+
+  @staticmethod
+  def attach(handle, sampler = None):
+    """
+    Attach to a published background.
+
+    Parameters
+    ----------
+    handle : dict
+      SharedBackground.handle of the publishing process
+    sampler : TCRsampler or None
+      sampler to populate (a new, silent one by default)
+
+    Returns
+    -------
+    sampler : TCRsampler
+      sampler whose background arrays are read-only views of the shared segment
+    """
+    if sampler is None:
+      from tcrsampler.sampler import TCRsampler
+      sampler = TCRsampler(metrics = False)
+    shm = _open_segment(handle['name'])
+    arrays = dict()
+    for name, (offset, dtype, shape) in handle['layout'].items():
+      a = np.ndarray(tuple(shape), dtype = dtype, buffer = shm.buf, offset = offset)
+      a.flags.writeable = False
+      arrays[name] = a
+    _from_arrays(arrays, handle['meta'], sampler)
+    # the views are only valid while the segment stays mapped
+    sampler._shared_memory = shm
+    return sampler
+
+  def close(self):
+    """ Release and remove the segment (publishing process only) """
+    if self.shm is not None:
+      self.shm.close()
+      self.shm.unlink()
+      self.shm = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    self.close()
+    return False
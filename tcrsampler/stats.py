@@ -0,0 +1,306 @@
+import copy
+import numpy as np
+import pandas as pd
+from tcrsampler.blocks import CompactReference
+
+__all__ = ['BackgroundStats']
+
+
+def _rank_within_subject(freq, subject_codes):
+  """
+  Rank rows within their subject by descending freq (ties keep their input order); -1 without subject.
+  """
+  has_subject = subject_codes >= 0
+  order = np.lexsort((-freq, subject_codes))
+  order = order[has_subject[order]]
+  sorted_subjects = subject_codes[order]
+  if sorted_subjects.shape[0]:
+    starts = np.flatnonzero(np.concatenate([[True], sorted_subjects[1:] != sorted_subjects[:-1]]))
+  else:
+    starts = np.zeros(0, dtype = np.int64)
+  sizes = np.diff(np.append(starts, sorted_subjects.shape[0]))
+  rank = np.full(freq.shape[0], -1, dtype = np.int64)
+  rank[order] = np.arange(order.shape[0]) - np.repeat(starts, sizes)
+  return rank
+
+
+_row_fields = ['v_codes', 'j_codes', 'freq', 'subject_codes', 'subject_rank']
+
+def _row_array(name):
+  """ Read-only property of one per-row array of BackgroundStats, joining pending chunks when it is read """
+  return property(lambda self: self._consolidated()[name])
+
+
+class BackgroundStats():
+  """
+  V-J usage statistics of a reference, computed in one pass.
+
+  Attributes
+  ----------
+  v_genes : np.ndarray
+    V gene vocabulary (rows of the tables)
+  j_genes : np.ndarray
+    J gene vocabulary (columns of the tables)
+  subjects : np.ndarray or None
+    subject vocabulary subject codes index into
+  freq_table : np.ndarray
+    float64 (n_v, n_j) sum of freq per v,j pair (FREQUENCY METHOD)
+  clone_table : np.ndarray
+    int64 (n_v, n_j) number of rows per v,j pair
+  subject_rank : np.ndarray
+    rank of every row within its subject by descending freq (-1 for rows without a subject)
+  clones_per_subject : np.ndarray
+    number of rows per subject code
+  occur_n : int
+    number of top clones per subject used by the OCCURRENCE METHOD
+  occur_table : np.ndarray
+    int64 (n_v, n_j) number of v,j rows among the top occur_n clones of every subject
+
+  Notes
+  -----
+  Rows are sorted once, by subject and descending freq, to rank them within their subject.
+  Changing the occurrence cutoff (set_occurrence_cutoff) reuses those ranks, so it is a single
+  np.bincount rather than another sort. All six distributions are normalized slices of the two
+  (v,j) tables; marginal V and J distributions are their row and column sums.
+
+  The per-row gene codes, frequencies, subjects and ranks are kept as sufficient statistics,
+  in the row order of the reference, so subjects can be added (add) or removed (remove) by
+  adding or subtracting only their own contribution to the tables. excluding does the same
+  on a copy of the tables, leaving these statistics unchanged.
+
+  The rows of every add are kept as a chunk of their own and only joined to the others 
+  (in one concatenation) when the per-row arrays are next read, so add costs time in the
+  number of added rows, not the number of rows already present, unless it changes the 
+  default occur_n. remove, excluding and set_occurrence_cutoff scan all rows.
+  """
+  v_codes = _row_array('v_codes')
+  j_codes = _row_array('j_codes')
+  freq = _row_array('freq')
+  subject_codes = _row_array('subject_codes')
+  subject_rank = _row_array('subject_rank')
+
+  def __init__(self, ref, occur_n = None):
+    if not isinstance(ref, CompactReference):
+      ref = CompactReference.from_dataframe(ref, compact = False)
+    self.v_genes = ref.v_genes
+    self.j_genes = ref.j_genes
+    self.subjects = ref.subjects
+    n_v, n_j = self.v_genes.shape[0], self.j_genes.shape[0]
+    self._rows = [self._chunk(ref)]
+    self.freq_table = np.zeros((n_v, n_j), dtype = np.float64)
+    self.clone_table = np.zeros((n_v, n_j), dtype = np.int64)
+    self.clones_per_subject = np.zeros(0, dtype = np.int64)
+    self.active = None
+    self._add_tables(np.ones(len(ref), dtype = bool), sign = 1)
+    self.set_occurrence_cutoff(occur_n)
+
+  @staticmethod
+  def _chunk(ref):
+    """ Per-row arrays of the rows of ref """
+    freq = np.asarray(ref.freq, dtype = np.float64)
+    subject_codes = np.zeros(len(ref), dtype = np.int32) if ref.subject_codes is None else ref.subject_codes
+    return {'v_codes'       : ref.v_codes,
+            'j_codes'       : ref.j_codes,
+            'freq'          : freq,
+            'subject_codes' : subject_codes,
+            'subject_rank'  : _rank_within_subject(freq, subject_codes)}
+
+  def _consolidated(self):
+    """ Join the pending chunks of rows; the list is replaced, never changed, as views share it """
+    if len(self._rows) > 1:
+      self._rows = [{name : np.concatenate([r[name] for r in self._rows]) for name in _row_fields}]
+    return self._rows[0]
+
+  def _vj_key(self, rows, chunk = None):
+    r = self._consolidated() if chunk is None else chunk
+    v_codes, j_codes = r['v_codes'][rows], r['j_codes'][rows]
+    valid = (v_codes >= 0) & (j_codes >= 0)
+    key = v_codes.astype(np.int64) * self.j_genes.shape[0] + j_codes
+    return key, valid
+
+  def _add_tables(self, rows, sign, chunk = None):
+    """ Add (sign = 1) or subtract (sign = -1) the contribution of the masked rows (of chunk, if given) """
+    r = self._consolidated() if chunk is None else chunk
+    n_v, n_j = self.freq_table.shape
+    key, valid = self._vj_key(rows, chunk)
+    self.freq_table += sign * np.bincount(key[valid], weights = r['freq'][rows][valid], minlength = n_v * n_j).reshape(n_v, n_j)
+    self.clone_table += sign * np.bincount(key[valid], minlength = n_v * n_j).reshape(n_v, n_j)
+    subjects = r['subject_codes'][rows]
+    counts = np.bincount(subjects[subjects >= 0])
+    if counts.shape[0] > self.clones_per_subject.shape[0]:
+      self.clones_per_subject = np.append(self.clones_per_subject, np.zeros(counts.shape[0] - self.clones_per_subject.shape[0], dtype = np.int64))
+    self.clones_per_subject[:counts.shape[0]] += sign * counts
+
+  def _default_occur_n(self):
+    present = self.clones_per_subject[self.clones_per_subject > 0]
+    return int(np.min(present)) if present.shape[0] else 0
+
+  def _occur_counts(self, rows, occur_n, chunk = None):
+    r = self._consolidated() if chunk is None else chunk
+    n_v, n_j = self.freq_table.shape
+    key, valid = self._vj_key(rows, chunk)
+    rank = r['subject_rank'][rows]
+    top = valid & (rank >= 0) & (rank < occur_n)
+    return np.bincount(key[top], minlength = n_v * n_j).reshape(n_v, n_j)
+
+  def set_occurrence_cutoff(self, occur_n = None):
+    """
+    Recompute the OCCURRENCE METHOD table for a new top-N cutoff without re-sorting.
+
+    Parameters
+    ----------
+    occur_n : int or None
+      number of top clones per subject; None uses the number of clones in the least diverse subject
+    """
+    self._occur_n_arg = occur_n
+    self.occur_n = self._default_occur_n() if occur_n is None else occur_n
+    self.occur_table = self._occur_counts(self._active_rows(), self.occur_n)
+
+  def _active_rows(self):
+    if self.active is None:
+      return np.ones(self.v_codes.shape[0], dtype = bool)
+    return self.active
+
+  def _check_writable(self):
+    if self.active is not None:
+      raise ValueError("Statistics returned by excluding() are read-only views")
+
+  def _occur_n_changed(self):
+    occur_n = self._default_occur_n() if self._occur_n_arg is None else self._occur_n_arg
+    return occur_n != self.occur_n
+
+  def extend_vocab(self, v_genes, j_genes, subjects = None):
+    """
+    Switch to vocabularies that extend the current ones by appending new names
+    (see CompactReference.recode).
+    """
+    n_v, n_j = self.freq_table.shape
+    assert np.all(v_genes[:n_v] == self.v_genes) and np.all(j_genes[:n_j] == self.j_genes)
+    pad = ((0, v_genes.shape[0] - n_v), (0, j_genes.shape[0] - n_j))
+    self.freq_table = np.pad(self.freq_table, pad, mode = 'constant')
+    self.clone_table = np.pad(self.clone_table, pad, mode = 'constant')
+    self.occur_table = np.pad(self.occur_table, pad, mode = 'constant')
+    self.v_genes = v_genes
+    self.j_genes = j_genes
+    if subjects is not None:
+      self.subjects = subjects
+
+  def add(self, ref):
+    """
+    Append the rows of new subjects.
+
+    Parameters
+    ----------
+    ref : CompactReference
+      rows coded against this object's vocabularies (see extend_vocab); their subjects
+      must not already be present
+
+    Notes
+    -----
+    The rows are appended as a pending chunk; only they are ranked and counted.
+    """
+    self._check_writable()
+    chunk = self._chunk(ref)
+    self._rows = self._rows + [chunk]
+    everything = slice(None)
+    self._add_tables(everything, sign = 1, chunk = chunk)
+    if self._occur_n_changed():
+      self.set_occurrence_cutoff(self._occur_n_arg)
+    else:
+      self.occur_table += self._occur_counts(everything, self.occur_n, chunk = chunk)
+
+  def remove(self, rows):
+    """
+    Remove rows (whole subjects), given as a boolean mask over the current rows; unlike add,
+    this copies the per-row arrays of every remaining row.
+    """
+    self._check_writable()
+    self._add_tables(rows, sign = -1)
+    self.occur_table -= self._occur_counts(rows, self.occur_n)
+    keep = ~rows
+    self._rows = [{name : a[keep] for name, a in self._consolidated().items()}]
+    if self._occur_n_changed():
+      self.set_occurrence_cutoff(self._occur_n_arg)
+
+  def excluding(self, rows):
+    """
+    Return the statistics without some rows (whole subjects), leaving these unchanged.
+
+    Parameters
+    ----------
+    rows : np.ndarray
+      boolean mask over the current rows
+
+    Returns
+    -------
+    view : BackgroundStats
+      read-only statistics that share the per-row arrays of this object, with the rows
+      masked out by view.active
+
+    Notes
+    -----
+    Only the (v,j) tables are copied; the contribution of the rows is subtracted from
+    them. The occurrence table is recounted over the remaining rows only if leaving the
+    rows out changes the default occur_n.
+    """
+    rows = rows & self._active_rows()
+    view = copy.copy(self)
+    view.active = self._active_rows() & ~rows
+    view.freq_table = self.freq_table.copy()
+    view.clone_table = self.clone_table.copy()
+    view.clones_per_subject = self.clones_per_subject.copy()
+    view._add_tables(rows, sign = -1)
+    if view._occur_n_changed():
+      view.set_occurrence_cutoff(view._occur_n_arg)
+    else:
+      view.occur_table = self.occur_table - self._occur_counts(rows, self.occur_n)
+    return view
+
+  def _normalized(self, table, observed):
+    total = table.sum()
+    return np.where(observed, table / total, 0.0) if total > 0 else np.zeros(table.shape)
+
+  def vj_freq_array(self):
+    return self._normalized(self.freq_table, self.clone_table > 0)
+
+  def v_freq_array(self):
+    return self._normalized(self.freq_table.sum(axis = 1), self.clone_table.sum(axis = 1) > 0)
+
+  def j_freq_array(self):
+    return self._normalized(self.freq_table.sum(axis = 0), self.clone_table.sum(axis = 0) > 0)
+
+  def vj_occur_array(self):
+    return self._normalized(self.occur_table, self.occur_table > 0)
+
+  def v_occur_array(self):
+    return self._normalized(self.occur_table.sum(axis = 1), self.occur_table.sum(axis = 1) > 0)
+
+  def j_occur_array(self):
+    return self._normalized(self.occur_table.sum(axis = 0), self.occur_table.sum(axis = 0) > 0)
+
+  def _vj_dict(self, array, observed):
+    vi, ji = np.nonzero(observed)
+    return {(v, j): f for v, j, f in zip(self.v_genes[vi], self.j_genes[ji], array[vi, ji].tolist())}
+
+  def _gene_dict(self, genes, array, observed):
+    i = np.flatnonzero(observed)
+    return {g: f for g, f in zip(genes[i], array[i].tolist())}
+
+  def frequency_dicts(self):
+    """
+    Return the six distributions as dictionaries keyed on gene names (or (v,j) tuples),
+    holding only observed genes and pairs.
+
+    Returns
+    -------
+    dicts : dict
+      'vj_freq', 'v_freq', 'j_freq', 'vj_occur_freq', 'v_occur_freq' and 'j_occur_freq'
+    """
+    occur_v = self.occur_table.sum(axis = 1)
+    occur_j = self.occur_table.sum(axis = 0)
+    return {'vj_freq'       : self._vj_dict(self.vj_freq_array(), self.clone_table > 0),
+            'v_freq'        : self._gene_dict(self.v_genes, self.v_freq_array(), self.clone_table.sum(axis = 1) > 0),
+            'j_freq'        : self._gene_dict(self.j_genes, self.j_freq_array(), self.clone_table.sum(axis = 0) > 0),
+            'vj_occur_freq' : self._vj_dict(self.vj_occur_array(), self.occur_table > 0),
+            'v_occur_freq'  : self._gene_dict(self.v_genes, self.v_occur_array(), occur_v > 0),
+            'j_occur_freq'  : self._gene_dict(self.j_genes, self.j_occur_array(), occur_j > 0)}
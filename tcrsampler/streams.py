@@ -0,0 +1,152 @@
+import hashlib
+import numpy as np
+
+__all__ = ['philox4x32', 'stable_hash', 'request_uniforms', 'RequestStreams', 'RNG_MODES']
+
+# name -> description of the random number source of TCRsampler.sample and sample_background
+RNG_MODES = {'legacy'    : 'np.random.seed(seed) on the global RNG before every (v,j) request',
+             'generator' : 'one np.random.Generator seeded with seed for all requests',
+             'philox'    : 'counter-based Philox4x32-10 streams keyed on (seed, v, j, request index)'}
+
+# Philox4x32 multipliers and Weyl key increments (Salmon et al. 2011, Random123)
+_M0 = np.uint64(0xD2511F53)
+_M1 = np.uint64(0xCD9E8D57)
+_W0 = np.uint64(0x9E3779B9)
+_W1 = np.uint64(0xBB67AE85)
+_MASK = np.uint64(0xFFFFFFFF)
+_32 = np.uint64(32)
+
+
+def philox4x32(counter, key, rounds = 10):
+  """
+  Philox4x32 block function, vectorized over counters.
+
+  Parameters
+  ----------
+  counter : np.ndarray
+    (4, n) array of 32-bit counter words (any unsigned integer dtype)
+  key : np.ndarray
+    (2,) or (2, n) array of 32-bit key words
+  rounds : int
+    number of rounds (10 is the standard, crush-resistant choice)
+
+  Returns
+  -------
+  words : np.ndarray
+    (4, n) uint64 array of 32-bit output words
+  """
+  c0, c1, c2, c3 = [np.asarray(c, dtype = np.uint64) & _MASK for c in counter]
+  k0, k1 = [np.asarray(k, dtype = np.uint64) & _MASK for k in key]
+  for r in range(rounds):
+    if r > 0:
+      k0 = (k0 + _W0) & _MASK
+      k1 = (k1 + _W1) & _MASK
+    p0 = _M0 * c0
+    p1 = _M1 * c2
+    c0, c1, c2, c3 = ((p1 >> _32) ^ c1 ^ k0), (p1 & _MASK), ((p0 >> _32) ^ c3 ^ k1), (p0 & _MASK)
+  return np.stack([c0, c1, c2, c3])
+
+
+def stable_hash(*parts):
+  """
+  64-bit hash of strings that, unlike hash(), is the same in every process and session.
+
+  Returns
+  -------
+  h : int
+  """
+  data = "\x1f".join(str(p) for p in parts).encode('utf-8')
+  return int.from_bytes(hashlib.blake2b(data, digest_size = 8).digest(), 'little')
+
+
+def request_uniforms(seed, hashes, indices, sizes):
+  """
+  Uniform random numbers for many requests, each from its own counter-based stream.
+
+  Draw t of request i is a pure function of (seed, hashes[i], indices[i], t), so any
+  subset of requests can be computed in any order, process or thread and gives the
+  same numbers.
+
+  Parameters
+  ----------
+  seed : int
+    Philox key (taken modulo 2**64)
+  hashes : array-like of int
+    64-bit hash of each request's (v,j), see stable_hash
+  indices : array-like of int
+    index of each request (e.g. its position in a usage table), below 2**32
+  sizes : array-like of int
+    numbers to draw for each request
+
+  Returns
+  -------
+  u : np.ndarray
+    float64 array of sum(sizes) numbers in [0,1), grouped by request
+
+  Notes
+  -----
+  The 128-bit Philox counter of draw t is (t // 2, index, hash low word, hash high word);
+  each block of four 32-bit words gives two doubles with 53 random bits each.
+  """
+  sizes = np.asarray(sizes, dtype = np.int64)
+  total = int(sizes.sum())
+  if total == 0:
+    return np.zeros(0, dtype = np.float64)
+  seed = int(seed) % 2**64
+  key = np.array([seed & 0xFFFFFFFF, seed >> 32], dtype = np.uint64)
+  request = np.repeat(np.arange(sizes.shape[0]), sizes)
+  t = np.arange(total, dtype = np.int64) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+  hashes = np.asarray([int(h) % 2**64 for h in hashes], dtype = np.uint64)[request]
+  counter = [(t // 2).astype(np.uint64),
+             np.asarray(indices, dtype = np.uint64)[request],
+             hashes & _MASK,
+             hashes >> _32]
+  words = philox4x32(counter, key)
+  half = (t % 2).astype(bool)
+  hi = np.where(half, words[2], words[0]) >> np.uint64(5)
+  lo = np.where(half, words[3], words[1]) >> np.uint64(6)
+  return ((hi << np.uint64(26)) + lo).astype(np.float64) * 2.0**-53
+
+
+class RequestStreams():
+  """
+  Counter-based random streams of a list of (v,j) requests.
+
+  Stands in for a np.random.Generator in BackgroundBlocks.draw_many and draw_distinct,
+  which ask it for sizes[i] numbers from the stream of request i.
+
+  Parameters
+  ----------
+  seed : int
+  pairs : list of tuple
+    requested (v,j) of every request
+  indices : array-like of int or None
+    index of every request; by default its position in pairs. Pass the positions in
+    the full usage table when sampling a subset of it.
+
+  Example
+  -------
+  >>> streams = RequestStreams(1, [('TRBV9*01','TRBJ2-7*01')], [3])
+  >>> streams.uniforms([5])
+  """
+  def __init__(self, seed, pairs, indices = None):
+    self.seed = int(seed)
+    cache = dict()
+    self.hashes = [cache[p] if p in cache else cache.setdefault(p, stable_hash(*p)) for p in map(tuple, pairs)]
+    self.indices = np.arange(len(self.hashes)) if indices is None else np.asarray(indices, dtype = np.int64)
+    if self.indices.shape[0] != len(self.hashes):
+      raise ValueError("indices must have one entry per request")
+
+  def take(self, positions):
+    """ Return the streams of a subset of the requests """
+    sub = RequestStreams.__new__(RequestStreams)
+    sub.seed = self.seed
+    sub.hashes = [self.hashes[i] for i in positions]
+    sub.indices = self.indices[np.asarray(positions, dtype = np.int64)]
+    return sub
+
+  def uniforms(self, sizes):
+    """
+    Return sizes[i] numbers in [0,1) from the stream of request i, grouped by request.
+    """
+    return request_uniforms(self.seed, self.hashes, self.indices, sizes)
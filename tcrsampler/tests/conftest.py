@@ -0,0 +1,25 @@
+import pytest
+import os
+from tcrsampler.sampler import TCRsampler
+
+@pytest.fixture(scope = 'session')
+def _example_ref_df():
+	t = TCRsampler()
+	fn= os.path.join('tcrsampler' ,'tests', 'pmbc_mixcr_example_data.txt')
+	t.clean_mixcr(filename = fn)
+	return t.ref_df
+
+@pytest.fixture
+def ref_df(_example_ref_df):
+	""" cleaned example reference, a fresh copy per test """
+	return _example_ref_df.copy()
+
+@pytest.fixture
+def built_sampler(_example_ref_df):
+	""" factory of samplers built on the example reference; keyword arguments go to build_background """
+	def build(**kwargs):
+		t = TCRsampler()
+		t.ref_df = _example_ref_df.copy()
+		t.build_background(**kwargs)
+		return t
+	return build
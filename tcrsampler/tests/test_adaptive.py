@@ -0,0 +1,63 @@
+import pytest 
+import os
+import numpy as np
+import pandas as pd
+from tcrsampler.sampler import TCRsampler
+from tcrsampler.adaptive import adaptive_to_imgt, expand_gene_ties, import_adaptive
+
+def _adaptive_df():
+	return pd.DataFrame({'sample_name'     : ['S1', 'S1', 'S1', 'S2'],
+						 'v_gene'          : ['TCRBV07-02', 'unresolved', 'TCRBV05-01', 'unresolved'],
+						 'v_gene_ties'     : [np.nan, 'TCRBV06-02,TCRBV06-03', np.nan, 'TCRBV12-03,TCRBV12-04'],
+						 'j_gene'          : ['TCRBJ01-01', 'TCRBJ02-07', 'unresolved', 'unresolved'],
+						 'j_gene_ties'     : [np.nan, np.nan, 'TCRBJ02-01,TCRBJ02-07', 'TCRBJ01-01,TCRBJ01-02'],
+						 'cdr3_amino_acid' : ['CASSLF', 'CASSQYF', np.nan, 'CASS*F'],
+						 'frequency'       : [0.5, 0.25, 0.25, 1.0],
+						 'templates'       : [2, 1, 1, 4]})
+
+def test_adaptive_to_imgt():
+	assert adaptive_to_imgt('TCRBV07-02') == 'TRBV7-2*01'
+	assert adaptive_to_imgt('TCRBJ01-01*01') == 'TRBJ1-1*01'
+	assert adaptive_to_imgt('TCRBV10-01') == 'TRBV10-1*01'
+	assert adaptive_to_imgt('TCRBV20') == 'TRBV20*01'
+
+def test_expand_gene_ties_makes_every_combination():
+	df = expand_gene_ties(_adaptive_df())
+	assert df.shape[0] == 1 + 2 + 2 + 4
+	s2 = df[df.sample_name == 'S2']
+	assert list(zip(s2.v_gene, s2.j_gene)) == [('TCRBV12-03','TCRBJ01-01'), ('TCRBV12-03','TCRBJ01-02'), 
+											   ('TCRBV12-04','TCRBJ01-01'), ('TCRBV12-04','TCRBJ01-02')]
+	assert s2.templates.tolist() == [4, 4, 4, 4]
+
+def test_import_adaptive():
+	df = import_adaptive(df = _adaptive_df())
+	assert list(df.columns) == ['v_reps','j_reps','cdr3', 'count','freq','subject']
+	assert df.v_reps.tolist() == ['TRBV7-2*01', 'TRBV6-2*01', 'TRBV6-3*01']
+	assert df.j_reps.tolist() == ['TRBJ1-1*01', 'TRBJ2-7*01', 'TRBJ2-7*01']
+	assert df.cdr3.tolist() == ['CASSLF', 'CASSQYF', 'CASSQYF']
+
+def test_clean_adaptive_file_and_build(tmpdir):
+	fn = os.path.join(str(tmpdir), 'adaptive.tsv')
+	_adaptive_df().to_csv(fn, sep = "\t", index = False)
+	t = TCRsampler()
+	t.clean_adaptive(filename = fn, chunksize = 2)
+	assert t.ref_df.shape[0] == 3
+	t.build_background()
+	assert t.sample([['TRBV6-3*01', 'TRBJ2-7*01', 2]]) == [['CASSQYF', 'CASSQYF']]
+
+def test_import_adaptive_drops_unresolved_without_ties():
+	df = pd.DataFrame({'sample_name'     : ['S1', 'S1', 'S1'],
+					   'v_gene'          : ['unresolved', 'TCRBV07-02', 'TCRBV07-02'],
+					   'v_gene_ties'     : [np.nan, np.nan, np.nan],
+					   'j_gene'          : ['TCRBJ01-01', 'unresolved', 'TCRBJ01-01'],
+					   'j_gene_ties'     : [np.nan, '', np.nan],
+					   'cdr3_amino_acid' : ['CASSLF', 'CASSQYF', 'CASSRF'],
+					   'frequency'       : [0.25, 0.25, 0.5],
+					   'templates'       : [1, 1, 2]})
+	assert expand_gene_ties(df).v_gene.isna().tolist() == [True, False, False]
+	rejected = dict()
+	out = import_adaptive(df = df, rejected = rejected)
+	assert out.v_reps.tolist() == ['TRBV7-2*01']
+	assert out.j_reps.tolist() == ['TRBJ1-1*01']
+	assert out.cdr3.tolist() == ['CASSRF']
+	assert rejected['unresolved'] == 2
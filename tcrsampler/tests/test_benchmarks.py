@@ -0,0 +1,27 @@
+import pytest 
+import os
+import numpy as np
+import pandas as pd
+from tcrsampler.sampler import TCRsampler
+from benchmarks.synthetic import synthetic_mixcr, write_synthetic_mixcr
+from benchmarks.bench import run_benchmarks, compare
+
+def test_synthetic_mixcr_is_seeded_and_cleanable(tmpdir):
+	df = synthetic_mixcr(2000, n_subjects = 4, seed = 3)
+	assert df.shape[0] == 2000
+	assert df['subject'].nunique() == 4
+	assert np.allclose(df.groupby('subject')['cloneFraction'].sum(), 1.0)
+	pd.testing.assert_frame_equal(df, synthetic_mixcr(2000, n_subjects = 4, seed = 3))
+	fn = write_synthetic_mixcr(os.path.join(str(tmpdir), 'synthetic.tsv'), 2000, n_subjects = 4, seed = 3)
+	t = TCRsampler()
+	t.clean_mixcr(filename = fn)
+	assert t.ref_df.shape[0] == 2000
+	assert t.cdr3_rejected == {'missing': 0, 'alphabet': 0, 'anchors': 0, 'length': 0}
+
+def test_run_benchmarks_and_compare():
+	results = run_benchmarks([2000], n_subjects = 2, n_keys = 10, phases = ['build_background', 'sample'])
+	assert set(results['results']['2000']) == {'generate', 'build_background', 'sample'}
+	assert compare(results, results).shape[0] == 0
+	slower = {'results': {'2000': {'sample': {'seconds': 10.0, 'peak_mb': 0.0}}}}
+	regressions = compare(slower, results)
+	assert regressions['phase'].tolist() == ['sample']
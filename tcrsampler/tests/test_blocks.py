@@ -0,0 +1,208 @@
+import pytest 
+import pickle
+import os
+import pandas as pd
+import numpy as np
+from tcrsampler.sampler import TCRsampler
+from tcrsampler.blocks import build_blocks, BlockDict, PackedStrings, CompactReference, LazyBlocks
+
+def test_build_blocks_offsets_are_csr(ref_df):
+	b = build_blocks(ref_df, max_rows = 10)
+	assert b.offsets[0] == 0
+	assert b.offsets[-1] == b.n_rows == b.cdr3.__len__()
+	assert np.all(np.diff(b.offsets) > 0)
+	assert np.all(np.diff(b.offsets) <= 10)
+
+def test_build_blocks_matches_groupwise_sort(ref_df):
+	df = ref_df
+	b = build_blocks(df, max_rows = 7, use_frequency = False)
+	for (v,j), group in df.groupby(['v_reps','j_reps']):
+		expected = group.sort_values(['count'], ascending = False, kind = 'mergesort').head(7)
+		block = b.frame(b.index[(v,j)])
+		assert block['cdr3'].to_list() == expected['cdr3'].to_list()
+
+def test_build_blocks_stratified_max_rows_per_subject(ref_df):
+	df = ref_df
+	b = build_blocks(df, max_rows = 2, stratify_by_subject = True)
+	block = b.frame(b.index[('TRBV9*01','TRBJ2-7*01')])
+	assert block['subject'].to_list() == ['X', 'X', 'Y', 'Y']
+	assert block.groupby('subject')['freq'].apply(lambda x: x.is_monotonic_decreasing).all()
+
+def test_build_blocks_singleton_keeps_rank_but_reports_one(ref_df):
+	df = ref_df
+	b = build_blocks(df, max_rows = 3, make_singleton = True)
+	block = b.frame(b.index[('TRBV9*01','TRBJ2-7*01')])
+	assert np.all(block['freq'] == 1) and np.all(block['count'] == 1)
+	start, stop = b.offsets[b.index[('TRBV9*01','TRBJ2-7*01')]:][:2]
+	assert np.all(np.diff(b.freq[start:stop]) <= 0)
+
+def test_build_background_ref_dict_is_lazy_view(ref_df):
+	t = TCRsampler()
+	t.ref_df = ref_df
+	t.build_background()
+	assert isinstance(t.ref_dict, BlockDict)
+	assert len(dict.keys(t.ref_dict)) == 0
+	t.ref_dict[('TRBV9*01','TRBJ2-7*01')]
+	assert len(dict.keys(t.ref_dict)) == 1
+
+def test_built_sampler_pickles(built_sampler):
+	t = built_sampler()
+	key = ('TRBV9*01','TRBJ2-7*01')
+	t.ref_dict[('TRBV0*01','TRBJ0*01')] = t.ref_dict[key].head(2)
+	del t.ref_dict[('TRBV7-7*01', 'TRBJ2-4*01')]
+	t2 = pickle.loads(pickle.dumps(t))
+	assert isinstance(t2.ref_dict, BlockDict)
+	# only frames that were handed out or set are pickled, the rest are rebuilt on access
+	assert len(dict.keys(t2.ref_dict)) == 2
+	assert set(t2.ref_dict.keys()) == set(t.ref_dict.keys())
+	pd.testing.assert_frame_equal(t2.ref_dict[key], t.ref_dict[key])
+	pd.testing.assert_frame_equal(t2.ref_dict[('TRBV0*01','TRBJ0*01')], t.ref_dict[('TRBV0*01','TRBJ0*01')])
+	usage = [['TRBV9*01','TRBJ2-7*01', 5]]
+	assert t2.sample(usage, seed = 3) == t.sample(usage, seed = 3)
+
+def test_ref_dict_frames_edited_in_place_are_sampled(built_sampler):
+	t = built_sampler()
+	key = ('TRBV9*01','TRBJ2-7*01')
+	usage = [['TRBV9*01','TRBJ2-7*01', 20]]
+	df = t.ref_dict[key]
+	df['freq'] = 0.0
+	df.loc[0, 'freq'] = 1.0
+	cdr3 = df['cdr3'].iloc[0]
+	assert t.sample(usage, seed = 3) == [[cdr3] * 20]
+	assert t.sample(usage, seed = 3, rng = 'generator') == [[cdr3] * 20]
+	assert t.sample(usage, seed = 3, fallback = 'v') == [[cdr3] * 20]
+	t2 = pickle.loads(pickle.dumps(t))
+	assert t2.sample(usage, seed = 3) == [[cdr3] * 20]
+
+def test_cdf_is_normalized_per_block(ref_df):
+	b = build_blocks(ref_df, max_rows = 10)
+	for use_frequency in [True, False]:
+		cdf = b.cdf(use_frequency = use_frequency)
+		assert np.all(cdf[b.offsets[1:] - 1] == 1.0)
+		assert np.all(cdf > 0) and np.all(cdf <= 1.0)
+		assert np.all(np.diff(cdf)[np.diff(b.block_ids()) == 0] >= 0)
+
+def test_cdf_zero_weight_block_is_uniform():
+	df = pd.DataFrame({'v_reps':['V1','V1','V2'], 'j_reps':['J1','J1','J1'], 'cdr3':['CAF','CASF','CASSF'], 'count':[0,0,3], 'freq':[0.0,0.0,1.0]})
+	b = build_blocks(df)
+	assert b.cdf().tolist() == [0.5, 1.0, 1.0]
+
+def test_sample_background_precomputed_tables_match_legacy_dict_sampling(ref_df):
+	t = TCRsampler()
+	t.ref_df = ref_df
+	t.build_background()
+	legacy = {k:v for k,v in t.ref_dict.items()}
+	for use_frequency in [True, False]:
+		r = t.sample_background('TRBV7-7*01', 'TRBJ2-4*01', n = 25, seed = 11, use_frequency = use_frequency)
+		r_legacy = t.sample_background('TRBV7-7*01', 'TRBJ2-4*01', n = 25, d = legacy, seed = 11, use_frequency = use_frequency)
+		assert r == r_legacy
+
+def test_PackedStrings_subset():
+	p = PackedStrings.from_strings(['CASSF', 'CAF', '', 'CASSLGQAARGIQYF'])
+	assert p.subset([3, 0, 2, 0]).to_list() == ['CASSLGQAARGIQYF', 'CASSF', '', 'CASSF']
+
+def test_CompactReference_roundtrip_and_memory_usage(ref_df):
+	df = ref_df
+	ref = CompactReference.from_dataframe(df)
+	assert len(ref) == df.shape[0]
+	assert ref.freq.dtype == np.float32 and ref.count.dtype == np.int32
+	assert ref.v_codes.dtype == np.int32
+	df2 = ref.to_dataframe()
+	assert list(df2.columns) == list(df.columns)
+	assert df2['cdr3'].tolist() == df['cdr3'].tolist()
+	assert df2['subject'].tolist() == df['subject'].tolist()
+	assert np.allclose(df2['freq'], df['freq'])
+	# against the frame as pandas stores it (Arrow-backed strings under pandas 3)
+	report = ref.memory_usage(df)
+	assert report.loc['total', 'compact'] < report.loc['total', 'dataframe']
+	assert report.loc['v_reps', 'compact'] < report.loc['v_reps', 'dataframe'] / 2
+	assert report.loc['cdr3', 'compact'] <= report.loc['cdr3', 'dataframe'] * 1.05
+	# against Python string columns
+	report = ref.memory_usage(df.astype({c : object for c in ['v_reps', 'j_reps', 'cdr3', 'subject']}))
+	assert report.loc['total', 'compact'] < report.loc['total', 'dataframe'] / 3
+
+def test_build_background_from_compact_reference(ref_df):
+	t = TCRsampler()
+	t.ref_df = ref_df
+	t.build_background(stratify_by_subject = True)
+	t2 = TCRsampler()
+	t2.ref_df = ref_df.copy()
+	report = t2.compact()
+	assert isinstance(t2.ref_df, CompactReference)
+	assert 'total' in report.index
+	t2.build_background(stratify_by_subject = True)
+	assert list(t2.ref_dict.keys()) == list(t.ref_dict.keys())
+	assert t2.ref_dict[('TRBV9*01','TRBJ2-7*01')]['cdr3'].tolist() == t.ref_dict[('TRBV9*01','TRBJ2-7*01')]['cdr3'].tolist()
+	assert t2.vj_occur_freq == t.vj_occur_freq
+	assert np.isclose(sum(t2.vj_freq.values()), 1.0)
+
+def test_LazyBlocks_matches_build_blocks(ref_df):
+	df = ref_df
+	b = build_blocks(df, max_rows = 10, stratify_by_subject = True)
+	lazy = LazyBlocks(df, max_rows = 10, stratify_by_subject = True)
+	assert lazy.keys() == b.keys()
+	assert lazy.n_materialized == 0
+	for gid in [0, 5, len(b) - 1]:
+		pd.testing.assert_frame_equal(lazy.frame(gid), b.frame(gid))
+		assert np.allclose(lazy.block(gid).cdf(), b.cdf()[b.offsets[gid]:b.offsets[gid+1]])
+	assert lazy.n_materialized == 3
+
+def test_build_background_lazy_samples_like_eager(ref_df):
+	t = TCRsampler()
+	t.ref_df = ref_df
+	t.build_background(max_rows = 10)
+	t_lazy = TCRsampler()
+	t_lazy.ref_df = ref_df.copy()
+	t_lazy.build_background(max_rows = 10, lazy = True)
+	assert t_lazy.vj_freq == t.vj_freq
+	assert set(t_lazy.ref_dict.keys()) == set(t.ref_dict.keys())
+	usage = [['TRBV9*01','TRBJ2-7*01', 4], ['TRBV7-7*01','TRBJ2-4*01', 2]]
+	assert t_lazy.sample(usage, depth = 2, seed = 3) == t.sample(usage, depth = 2, seed = 3)
+	assert t_lazy.blocks.n_materialized == 2
+	cdr3, offsets = t_lazy.sample_batch(['TRBV9*01'], ['TRBJ2-7*01'], [4])
+	assert cdr3.tolist() == t.sample_batch(['TRBV9*01'], ['TRBJ2-7*01'], [4])[0].tolist()
+
+def test_draw_distinct_is_weighted_sampling_without_replacement():
+	from tcrsampler.blocks import _weighted_top_k
+	rng = np.random.default_rng(1)
+	w = np.array([5., 3., 1., 1., 0.])
+	reps = 20000
+	index, counts = _weighted_top_k(np.tile(w, reps), np.full(reps, 5), np.full(reps, 2), rng)
+	assert np.all(counts == 2)
+	draws = (index % 5).reshape(reps, 2)
+	assert np.all(draws[:,0] != draws[:,1])
+	p = w / w.sum()
+	second = [sum(p[j] * p[i] / (1 - p[j]) for j in range(5) if j != i) for i in range(5)]
+	assert np.allclose(np.bincount(draws[:,0], minlength = 5) / reps, p, atol = 0.02)
+	assert np.allclose(np.bincount(draws[:,1], minlength = 5) / reps, second, atol = 0.02)
+	# requests larger than the block return all of it, zero weight rows last
+	index, counts = _weighted_top_k(w, [5], [10], rng)
+	assert counts.tolist() == [5] and sorted(index.tolist()) == [0,1,2,3,4] and index[-1] == 4
+
+def test_sample_without_replacement_gives_distinct_cdr3s():
+	t = TCRsampler()
+	fn= os.path.join('tcrsampler' ,'tests', 'pmbc_mixcr_example_data.txt')
+	t.clean_mixcr(filename = fn)
+	t.build_background()
+	usage = [['TRBV9*01','TRBJ2-7*01', 2],['TRBV7-7*01', 'TRBJ2-4*01', 4], ['TRBV7-7*01', 'TRBJ2-4*01', 1000]]
+	r = t.sample(usage, replace = False)
+	sizes = [min(n, t.ref_dict[(v,j)].shape[0]) for v,j,n in usage]
+	assert [len(x) for x in r] == sizes
+	for x in r:
+		assert len(set(x)) == len(x)
+	assert sorted(r[2]) == sorted(t.ref_dict[('TRBV7-7*01', 'TRBJ2-4*01')]['cdr3'].to_list())
+	assert r == t.sample(usage, replace = False)
+	cdr3, offsets = t.sample_batch([u[0] for u in usage], [u[1] for u in usage], [u[2] for u in usage], replace = False)
+	assert np.diff(offsets).tolist() == sizes
+	assert t.sample_background('TRBV9*01', 'TRBJ2-7*01', n = 3, replace = False, seed = 2) == \
+		t.sample_background('TRBV9*01', 'TRBJ2-7*01', n = 3, replace = False, seed = 2, d = dict(t.ref_dict))
+
+def test_draw_distinct_singleton_is_uniform():
+	df = pd.DataFrame({'v_reps':['V1']*3, 'j_reps':['J1']*3, 'cdr3':['CAF','CASF','CASSF'], 'count':[1000,1,1], 'freq':[1000/1002,1/1002,1/1002]})
+	t = TCRsampler(metrics = False)
+	t.ref_df = df
+	t.build_background(make_singleton = True)
+	first = [t.sample([['V1','J1', 1]], seed = s, replace = False)[0][0] for s in range(300)]
+	assert 0.2 < first.count('CAF') / 300 < 0.47
+	cdr3, offsets = t.sample_batch(['V1'] * 3000, ['J1'] * 3000, [1] * 3000, replace = False)
+	assert np.allclose(pd.Series(cdr3).value_counts(normalize = True).values, 1/3, atol = 0.05)
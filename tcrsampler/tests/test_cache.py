@@ -0,0 +1,89 @@
+import pytest 
+import os
+import pandas as pd
+import numpy as np
+from tcrsampler.sampler import TCRsampler
+from tcrsampler.cache import BackgroundCache
+
+def test_fingerprint_depends_on_data_and_params(tmpdir, ref_df):
+	c = BackgroundCache(path = str(tmpdir))
+	df = ref_df
+	k = c.fingerprint(df, {'max_rows' : 100})
+	assert k == c.fingerprint(df.copy(), {'max_rows' : 100})
+	assert k != c.fingerprint(df, {'max_rows' : 50})
+	df2 = df.copy()
+	df2.loc[0, 'count'] = df2.loc[0, 'count'] + 1
+	assert k != c.fingerprint(df2, {'max_rows' : 100})
+
+def test_build_background_reuses_cache(tmpdir, ref_df):
+	cache = BackgroundCache(path = str(tmpdir))
+	t = TCRsampler()
+	t.ref_df = ref_df
+	t.build_background(max_rows = 20, stratify_by_subject = True, cache = cache)
+	assert len(cache.entries()) == 1
+	assert not isinstance(t.blocks.freq, np.memmap)
+	t2 = TCRsampler()
+	t2.ref_df = ref_df.copy()
+	t2.build_background(max_rows = 20, stratify_by_subject = True, cache = cache)
+	assert len(cache.entries()) == 1
+	assert isinstance(t2.blocks.freq, np.memmap)
+	assert t2.vj_occur_freq == t.vj_occur_freq
+	assert t2.build_params == t.build_params
+	usage = [['TRBV9*01','TRBJ2-7*01', 10]]
+	assert t2.sample(usage) == t.sample(usage)
+
+def test_cache_evicts_least_recently_used(tmpdir, ref_df):
+	cache = BackgroundCache(path = str(tmpdir))
+	t = TCRsampler()
+	t.ref_df = ref_df
+	t.build_background(max_rows = 10, cache = cache)
+	t.build_background(max_rows = 11, cache = cache)
+	assert len(cache.entries()) == 2
+	first, second = [k for k,_,_ in cache.entries()]
+	cache.max_bytes = 1
+	t.build_background(max_rows = 12, cache = cache)
+	keys = [k for k,_,_ in cache.entries()]
+	assert len(keys) == 1
+	assert first not in keys and second not in keys
+
+def test_cache_hit_drops_statistics_of_previous_build(tmpdir, ref_df):
+	cache = BackgroundCache(path = str(tmpdir))
+	small = ref_df.iloc[:1000].reset_index(drop = True)
+	t = TCRsampler()
+	t.ref_df = small
+	t.build_background(cache = cache)
+	vj_freq = dict(t.vj_freq)
+	t2 = TCRsampler()
+	t2.ref_df = ref_df
+	t2.build_background()
+	assert t2.stats is not None and t2.vj_freq != vj_freq
+	t2.build_background(df = small, cache = cache)
+	assert t2.stats is None
+	assert t2.vj_freq == vj_freq
+	with pytest.raises(ValueError):
+		t2.set_occurrence_cutoff(10)
+	with pytest.warns(UserWarning):
+		t2.build_background(df = small, cache = cache, lazy = True)
+
+def test_concurrent_store_of_same_entry_is_a_hit(tmpdir, built_sampler, monkeypatch):
+	import tcrsampler.compiled
+	cache = BackgroundCache(path = str(tmpdir))
+	t = built_sampler()
+	to_arrays = tcrsampler.compiled._to_arrays
+	def racing_to_arrays(sampler):
+		# another process stores the same entry while this one is writing
+		monkeypatch.setattr(tcrsampler.compiled, '_to_arrays', to_arrays)
+		cache.store('key', t)
+		return to_arrays(sampler)
+	monkeypatch.setattr(tcrsampler.compiled, '_to_arrays', racing_to_arrays)
+	cache.store('key', t)
+	assert [e[0] for e in cache.entries()] == ['key']
+	assert not [f for f in os.listdir(str(tmpdir)) if f.startswith('.')]
+	t2 = TCRsampler(metrics = False)
+	assert cache.load('key', sampler = t2)
+	assert t2.vj_freq == t.vj_freq
+	# compiling over an existing directory replaces it
+	path = os.path.join(str(tmpdir), 'example.tcrs')
+	t.compile_background(path)
+	t.compile_background(path)
+	assert os.path.isfile(os.path.join(path, 'meta.json'))
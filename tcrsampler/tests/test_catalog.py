@@ -0,0 +1,50 @@
+import pytest 
+import os
+import numpy as np
+from tcrsampler.sampler import TCRsampler
+from tcrsampler.catalog import Catalog, MANIFEST_NAME
+from tcrsampler.compiled import COMPILED_SUFFIX
+
+def _db(tmpdir, ref_df):
+	t = TCRsampler(metrics = False)
+	t.ref_df = ref_df
+	name = 'example_human_beta_t.tsv.sampler.tsv'
+	t.ref_df.to_csv(os.path.join(str(tmpdir), name), sep = "\t", index = False)
+	return t, name
+
+def test_Catalog_register_query_open(tmpdir, ref_df):
+	t, name = _db(tmpdir, ref_df)
+	cat = Catalog(str(tmpdir))
+	assert cat.query().shape[0] == 0
+	assert cat.unregistered() == [name]
+	r = cat.register(name, source = 'example')
+	assert os.path.isfile(os.path.join(str(tmpdir), MANIFEST_NAME))
+	assert r['rows'] == t.ref_df.shape[0]
+	assert r['subjects'] == t.ref_df['subject'].nunique()
+	assert (r['species'], r['chain'], r['source']) == ('human', 'beta', 'example')
+	assert r['compiled'] is None
+	# a new catalog reads the manifest, not the file
+	cat = Catalog(str(tmpdir))
+	assert cat.names() == [name]
+	assert cat.unregistered() == []
+	assert cat.query(species = 'human', chain = ['alpha', 'beta']).name.tolist() == [name]
+	assert cat.query(species = 'mouse').shape[0] == 0
+	assert cat.query(rows = lambda n: n > 1).shape[0] == 1
+	with pytest.raises(KeyError):
+		cat.get('missing.tsv')
+	t.build_background()
+	t2 = cat.open(name, metrics = False)
+	usage = [['TRBV9*01','TRBJ2-7*01', 5],['TRBV7-7*01', 'TRBJ2-4*01', 4]]
+	assert t2.sample(usage, seed = 1) == t.sample(usage, seed = 1)
+
+def test_Catalog_open_compiled(tmpdir, ref_df):
+	t, name = _db(tmpdir, ref_df)
+	t.ref_df = t._read_background_file(os.path.join(str(tmpdir), name))
+	t.build_background(max_rows = 50)
+	t.compile_background(os.path.join(str(tmpdir), name + COMPILED_SUFFIX))
+	r = Catalog(str(tmpdir)).register(name, sampler = t)
+	assert r['compiled'] == name + COMPILED_SUFFIX
+	assert r['build_params']['max_rows'] == 50
+	t2 = Catalog(str(tmpdir)).open(name, metrics = False)
+	assert isinstance(t2.blocks.v_codes, np.memmap)
+	assert t2.vj_freq == t.vj_freq
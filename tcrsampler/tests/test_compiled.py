@@ -0,0 +1,55 @@
+import pytest 
+import os
+import pandas as pd
+import numpy as np
+from tcrsampler.blocks import BlockDict, PackedStrings
+from tcrsampler.compiled import compile_background, load_compiled_background
+
+def test_PackedStrings_roundtrip():
+	strings = ['CASSF', 'CAF', '', 'CASSLGQAARGIQYF']
+	p = PackedStrings.from_strings(strings)
+	assert len(p) == 4
+	assert p.to_list() == strings
+	assert p[3] == 'CASSLGQAARGIQYF'
+	assert p.take([1,1,0]).tolist() == ['CAF', 'CAF', 'CASSF']
+
+def test_compile_and_load_background(tmpdir, built_sampler):
+	t = built_sampler()
+	path = compile_background(t, os.path.join(str(tmpdir), 'example.tcrs'))
+	assert os.path.isfile(os.path.join(path, 'meta.json'))
+	t2 = load_compiled_background(path)
+	assert isinstance(t2.ref_dict, BlockDict)
+	assert isinstance(t2.blocks.v_codes, np.memmap)
+	# sampling tables are mapped from the directory, not recomputed
+	for use_frequency in [True, False]:
+		assert isinstance(t2.blocks.cdf(use_frequency), np.memmap)
+		assert isinstance(t2.blocks.keyed_cdf(use_frequency), np.memmap)
+		assert np.array_equal(t2.blocks.cdf(use_frequency), t.blocks.cdf(use_frequency))
+	assert t2.vj_freq == t.vj_freq
+	assert t2.j_occur_freq == t.j_occur_freq
+	assert t2.build_params == t.build_params
+	assert set(t2.ref_dict.keys()) == set(t.ref_dict.keys())
+	for k in [('TRBV9*01','TRBJ2-7*01'), ('TRBV7-7*01', 'TRBJ2-4*01')]:
+		a = t.ref_dict[k]
+		b = t2.ref_dict[k]
+		assert b['cdr3'].to_list() == a['cdr3'].to_list()
+		assert np.all(b['freq'].values == a['freq'].values)
+		assert b['subject'].to_list() == a['subject'].to_list()
+
+def test_compiled_background_samples_like_built_background(tmpdir, built_sampler):
+	t = built_sampler(stratify_by_subject = True)
+	t2 = load_compiled_background(t.compile_background(os.path.join(str(tmpdir), 'example.tcrs')), mmap = False)
+	usage = [['TRBV9*01','TRBJ2-7*01', 10],['TRBV7-7*01', 'TRBJ2-4*01', 4]]
+	assert t2.sample(usage, seed = 3) == t.sample(usage, seed = 3)
+
+def test_BlockDict_is_dict_compatible(tmpdir, built_sampler):
+	t = built_sampler()
+	t2 = load_compiled_background(t.compile_background(os.path.join(str(tmpdir), 'example.tcrs')))
+	n = len(t2.ref_dict)
+	assert n == len(t.ref_dict)
+	assert ('TRBV9*01','TRBJ2-7*01') in t2.ref_dict
+	assert ('TRBV999*01','TRBJ2-7*01') not in t2.ref_dict
+	k, v = t2.ref_dict.popitem()
+	assert isinstance(v, pd.DataFrame)
+	assert k not in t2.ref_dict
+	assert len(t2.ref_dict) == n - 1
@@ -0,0 +1,66 @@
+import pytest 
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from tcrsampler.sampler import TCRsampler
+from tcrsampler.fallback import FallbackIndex, strip_allele
+
+def test_strip_allele():
+	assert strip_allele('TRBV9*01') == 'TRBV9'
+	assert strip_allele('TRBV9') == 'TRBV9'
+
+def test_FallbackIndex_resolve_pools_genes():
+	keys = [('V1*01','J1*01'), ('V1*01','J2*01'), ('V2*01','J2*01'), ('V2*02','J2*01')]
+	fb = FallbackIndex(keys, weights = {('V1*01','J1*01'): 0.1, ('V1*01','J2*01'): 0.5, ('V2*01','J2*01'): 0.3, ('V2*02','J2*01'): 0.1})
+	assert fb.resolve('V1*01', 'J9*01', 'v') == ('V1*01', None)
+	assert fb.members(('V1*01', None)) == [('V1*01','J2*01'), ('V1*01','J1*01')]
+	assert fb.resolve('V9*01', 'J2*01', 'j') == (None, 'J2*01')
+	assert fb.members((None, 'J2*01')) == [('V1*01','J2*01'), ('V2*01','J2*01'), ('V2*02','J2*01')]
+	assert fb.resolve('V2*03', 'J2*01', 'allele') == ('V2*01','J2*01')
+	assert fb.members(('V2*01','J2*01')) == [('V2*01','J2*01')]
+	assert fb.resolve('V9*01', 'J9*01', ['allele', 'v', 'j']) is None
+	with pytest.raises(ValueError):
+		fb.resolve('V9*01', 'J9*01', 'd')
+
+def test_sample_fallback_and_missing_report():
+	t = TCRsampler()
+	fn= os.path.join('tcrsampler' ,'tests', 'pmbc_mixcr_example_data.txt')
+	t.clean_mixcr(filename = fn)
+	t.build_background()
+	usage = [['TRBV9*02','TRBJ2-7*01', 2], ['TRBV999*01','TRBJ2-7*01', 3], ['TRBV999*01','TRBJ2-7*01', 1], ['TRBV9*01','TRBJ2-7*01', 2]]
+	with warnings.catch_warnings(record = True) as w:
+		warnings.simplefilter('always')
+		r = t.sample(usage)
+	assert len(w) == 1
+	assert r[0] == [None] and r[1] == [None]
+	assert t.missing_report.shape[0] == 2
+	assert t.missing_report.set_index('v_reps').loc['TRBV999*01', 'requests'] == 2
+	assert t.missing_report.set_index('v_reps').loc['TRBV999*01', 'n'] == 4
+	r = t.sample(usage, fallback = ['allele', 'j'])
+	assert r[0] == r[3] == t.sample_background('TRBV9*01', 'TRBJ2-7*01', n = 2)
+	assert t.missing_report['fallback'].tolist() == [('TRBV9*01','TRBJ2-7*01'), (None, 'TRBJ2-7*01')]
+	pooled = pd.concat([df for (v, j), df in t.ref_dict.items() if j == 'TRBJ2-7*01'])
+	assert set(r[1]) <= set(pooled['cdr3'])
+	assert t.sample_background('TRBV9*02', 'TRBJ2-7*01', n = 2, fallback = 'allele') == r[0]
+
+def test_fallback_v_pools_every_j(built_sampler):
+	t = built_sampler()
+	pooled = pd.concat([df for (v, j), df in t.ref_dict.items() if v == 'TRBV9*01'], ignore_index = True)
+	assert pooled['j_reps'].nunique() > 1
+	usage = [['TRBV9*01', 'TRBJ9*01', 2000]]
+	with pytest.warns(UserWarning):
+		for rng in ['legacy', 'generator', 'philox']:
+			r = t.sample(usage, fallback = 'v', rng = rng)[0]
+			assert set(r) <= set(pooled['cdr3'])
+			# draws follow the frequencies of the pooled rows, across J genes
+			j_of = pooled.groupby('cdr3')['j_reps'].first()
+			observed = pd.Series(j_of[r].values).value_counts(normalize = True)
+			expected = pooled.groupby('j_reps')['freq'].sum() / pooled['freq'].sum()
+			assert np.allclose(observed.reindex(expected.index, fill_value = 0), expected, atol = 0.05)
+		df = t.sample_counts(usage, depth = 5, fallback = 'v')
+	assert df['count'].sum() == 10000
+	assert set(df['cdr3']) <= set(pooled['cdr3'])
+	r = t.sample_background('TRBV9*01', 'TRBJ9*01', n = 5, fallback = 'v')
+	# a plain dict pools its frames and draws the same rows
+	assert r == t.sample_background('TRBV9*01', 'TRBJ9*01', n = 5, d = {k : v for k, v in t.ref_dict.items()}, fallback = 'v')
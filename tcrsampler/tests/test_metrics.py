@@ -0,0 +1,44 @@
+import pytest 
+import os
+import numpy as np
+import pandas as pd
+from tcrsampler.sampler import TCRsampler
+from tcrsampler.metrics import Metrics, ProgressBars, Silent
+
+fn = os.path.join('tcrsampler' ,'tests', 'pmbc_mixcr_example_data.txt')
+
+def test_Metrics_records_phases_and_calls_consumers():
+	seen = list()
+	m = Metrics(consumers = [seen.append], memory = True)
+	t = TCRsampler(metrics = m)
+	t.clean_mixcr(filename = fn)
+	t.build_background()
+	t.sample([['TRBV9*01','TRBJ2-7*01', 2], ['TRBV7-7*01','TRBJ2-4*01', 4]])
+	df = m.to_dataframe()
+	assert df['phase'].tolist() == ['clean', 'statistics', 'build', 'sample']
+	assert [r['phase'] for r in seen] == df['phase'].tolist()
+	assert (df['seconds'] >= 0).all()
+	assert (df['peak_mb'] > 0).all()
+	assert df.set_index('phase').loc['clean', 'rows'] == t.ref_df.shape[0] + sum(t.cdr3_rejected.values())
+	assert df.set_index('phase').loc['build', 'groups'] == len(t.blocks)
+	assert df.set_index('phase').loc['sample', 'rows'] == 6
+
+def test_silent_metrics_record_nothing(capsys):
+	t = TCRsampler(metrics = False)
+	assert isinstance(t.metrics, Silent)
+	t.clean_mixcr(filename = fn)
+	t.build_background()
+	assert t.metrics.to_dataframe().shape[0] == 0
+	assert capsys.readouterr().err == ''
+
+def test_default_metrics_show_progress_bars():
+	t = TCRsampler()
+	assert isinstance(t.metrics.consumers[0], ProgressBars)
+	t.clean_mixcr(filename = fn)
+	t.build_background()
+	for i in range(50):
+		t.sample([['TRBV9*01','TRBJ2-7*01', 2]])
+	# progress bars only; records are not kept
+	assert len(t.metrics.records) == 0
+	with pytest.raises(TypeError):
+		TCRsampler(metrics = 'quiet')
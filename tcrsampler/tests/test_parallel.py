@@ -0,0 +1,21 @@
+import pytest 
+import pandas as pd
+import numpy as np
+from tcrsampler.parallel import sample_many
+
+def test_sample_many_independent_of_worker_count(built_sampler):
+	t = built_sampler()
+	usage_tables = [ [['TRBV9*01','TRBJ2-7*01', 5],['TRBV7-7*01', 'TRBJ2-4*01', 4]],
+					 [['TRBV9*01','TRBJ2-7*01', 5]],
+					 pd.DataFrame({'v_reps':['TRBV9*01'], 'j_reps':['TRBJ2-7*01'], 'n':[5]}),
+					 [] ]
+	serial = sample_many(t, usage_tables, seed = 42, max_workers = 1)
+	parallel = sample_many(t, usage_tables, seed = 42, max_workers = 2)
+	assert len(serial) == len(parallel) == 4
+	for (c1, o1), (c2, o2) in zip(serial, parallel):
+		assert c1.tolist() == c2.tolist()
+		assert o1.tolist() == o2.tolist()
+	assert serial[0][1].tolist() == [0, 5, 9]
+	assert serial[3][1].tolist() == [0]
+	# identical tables get independent streams
+	assert serial[1][0].tolist() != serial[2][0].tolist()
@@ -0,0 +1,49 @@
+import pytest 
+import os
+import numpy as np
+from tcrsampler.sampler import TCRsampler
+from tcrsampler.catalog import Catalog
+
+pa = pytest.importorskip('pyarrow')
+from tcrsampler.parquet import write_parquet_background, read_parquet_background
+
+@pytest.mark.parametrize("partition_by_subject", [False, True])
+def test_parquet_background_roundtrip_and_filters(tmpdir, partition_by_subject, ref_df):
+	df = ref_df
+	path = write_parquet_background(df, os.path.join(str(tmpdir), 'example.parquet'), row_group_size = 100, partition_by_subject = partition_by_subject)
+	columns = ['v_reps','j_reps','cdr3','subject','count','freq']
+	x = read_parquet_background(path, columns = columns)
+	assert x.shape == df.shape
+	assert x.columns.tolist() == columns
+	key = lambda d: d.sort_values(columns).reset_index(drop = True)
+	assert key(x[columns]).equals(key(df[columns]))
+	x = read_parquet_background(path, columns = ['cdr3', 'subject'], subjects = ['X'], v_genes = ['TRBV9*01', 'TRBV7-7*01'])
+	expected = df[(df.subject == 'X') & df.v_reps.isin(['TRBV9*01', 'TRBV7-7*01'])]
+	assert x.columns.tolist() == ['cdr3', 'subject']
+	assert sorted(x.cdr3) == sorted(expected.cdr3)
+	# filters apply to columns that are not read
+	x = read_parquet_background(path, columns = ['cdr3'], j_genes = ['TRBJ2-7*01'])
+	assert sorted(x.cdr3) == sorted(df[df.j_reps == 'TRBJ2-7*01'].cdr3)
+
+def test_parquet_row_groups_are_sorted_for_pushdown(tmpdir, ref_df):
+	import pyarrow.parquet as pq
+	path = write_parquet_background(ref_df, os.path.join(str(tmpdir), 'example.parquet'), row_group_size = 100)
+	meta = pq.ParquetFile(path).metadata
+	assert meta.num_row_groups > 1
+	v = meta.schema.to_arrow_schema().get_field_index('v_reps')
+	# a V gene spans a few row groups per subject, the rest are skipped by a filter on it
+	stats = [(meta.row_group(i).column(v).statistics.min, meta.row_group(i).column(v).statistics.max) for i in range(meta.num_row_groups)]
+	assert sum(lo <= 'TRBV9*01' <= hi for lo, hi in stats) < meta.num_row_groups / 10
+
+def test_read_background_parquet_builds_like_tsv(tmpdir, ref_df):
+	df = ref_df
+	write_parquet_background(df, os.path.join(str(tmpdir), 'example_human_beta.parquet'))
+	t1 = TCRsampler()
+	t1.ref_df = df[df.subject == 'Y'].reset_index(drop = True)
+	t1.build_background()
+	t2 = TCRsampler()
+	t2.read_background(os.path.join(str(tmpdir), 'example_human_beta.parquet'), subjects = ['Y'])
+	t2.build_background()
+	assert t2.vj_freq == pytest.approx(t1.vj_freq)
+	r = Catalog(str(tmpdir)).register('example_human_beta.parquet')
+	assert (r['rows'], r['subjects'], r['chain']) == (df.shape[0], 2, 'beta')
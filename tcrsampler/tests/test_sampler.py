@@ -139,3 +139,202 @@ def test_get_download_address():
 
 
 
+
+def test_sample_batch():
+	t = TCRsampler()
+	fn= os.path.join('tcrsampler' ,'tests', 'pmbc_mixcr_example_data.txt')
+	t.clean_mixcr(filename = fn)
+	t.build_background()
+	v = ['TRBV9*01', 'TRBV999*01', 'TRBV7-7*01']
+	j = ['TRBJ2-7*01', 'TRBJ2-7*01', 'TRBJ2-4*01']
+	cdr3, offsets, rows = t.sample_batch(v, j, [2, 3, 4], depth = 2, return_index = True)
+	assert offsets.tolist() == [0, 4, 4, 12]
+	assert cdr3.shape[0] == 12
+	assert set(cdr3[0:4]) <= set(t.ref_dict[('TRBV9*01','TRBJ2-7*01')]['cdr3'])
+	assert set(cdr3[4:12]) <= set(t.ref_dict[('TRBV7-7*01','TRBJ2-4*01')]['cdr3'])
+	assert np.all(t.blocks.block_ids()[rows] == t.blocks.lookup(['TRBV9*01']*4 + ['TRBV7-7*01']*8, ['TRBJ2-7*01']*4 + ['TRBJ2-4*01']*8))
+	usage = pd.DataFrame({'v_reps':v, 'j_reps':j, 'n':[2, 3, 4]})
+	cdr3_df, offsets_df = t.sample_batch(usage, depth = 2)
+	assert cdr3_df.tolist() == cdr3.tolist()
+	assert offsets_df.tolist() == offsets.tolist()
+
+def test_TCRsampler_clean_mixcr_chunked():
+	fn= os.path.join('tcrsampler' ,'tests', 'pmbc_mixcr_example_data.txt')
+	t = TCRsampler()
+	t.clean_mixcr(filename = fn)
+	t_chunked = TCRsampler()
+	t_chunked.clean_mixcr(filename = fn, chunksize = 1000)
+	assert list(t_chunked.ref_df.columns) == ['v_reps','j_reps','cdr3', 'count','freq','subject']
+	pd.testing.assert_frame_equal(t.ref_df, t_chunked.ref_df)
+	assert t_chunked.ref_df['cdr3'].str.match(r'^C[ACDEFGHIKLMNPQRSTVWY]*F$').all()
+	assert t_chunked.ref_df['v_reps'].str.endswith('*01').all()
+
+def test_TCRsampler_clean_mixcr_chunked_count_dtype_decided_once(tmpdir):
+	df = pd.DataFrame({'bestVGene':['TRBV9']*4, 'bestJGene':['TRBJ2-7']*4, 
+					   'aaSeqCDR3':['CASSF', 'CASSY', 'CASRF', 'CASRY'], 'cloneCount':[2, 1, 1.5, 1], 'cloneFraction':[0.4, 0.2, 0.3, 0.2]})
+	fn = str(tmpdir.join('mixcr.tsv'))
+	df.to_csv(fn, sep = "\t", index = False)
+	t = TCRsampler()
+	t.clean_mixcr(filename = fn)
+	t_chunked = TCRsampler()
+	t_chunked.clean_mixcr(filename = fn, chunksize = 2)
+	assert t_chunked.ref_df['count'].dtype == np.float64
+	pd.testing.assert_frame_equal(t.ref_df, t_chunked.ref_df)
+
+def test_TCRsampler_clean_mixcr_df_without_subject():
+	df = pd.DataFrame({'bestVGene':['TRBV9', 'TRBV9', 'TRBV9'], 'bestJGene':['TRBJ2-7', 'TRBJ2-7', 'TRBJ2-7'], 
+					   'aaSeqCDR3':['CASSF', 'CAS_SF', 'CASSY'], 'cloneCount':[2, 1, 1], 'cloneFraction':[0.5, 0.25, 0.25]})
+	t = TCRsampler()
+	t.clean_mixcr(df = df)
+	assert t.ref_df.to_dict('list') == {'v_reps':['TRBV9*01'], 'j_reps':['TRBJ2-7*01'], 'cdr3':['CASSF'], 'count':[2], 'freq':[0.5]}
+
+def test_add_remove_subject_matches_build_background():
+	fn= os.path.join('tcrsampler' ,'tests', 'pmbc_mixcr_example_data.txt')
+	t = TCRsampler()
+	t.clean_mixcr(filename = fn)
+	df = t.ref_df
+	df['subject'] = np.where(np.arange(df.shape[0]) % 3 == 0, 'A', 'B')
+	new = df.iloc[:50].drop(columns = 'subject')
+	new['v_reps'] = new['v_reps'].where(np.arange(50) % 10 != 0, 'TRBV999*01')
+	t.build_background(max_rows = 5)
+	t.add_subject(new, subject = 'C')
+	t2 = TCRsampler()
+	t2.ref_df = pd.concat([df, new.assign(subject = 'C')], ignore_index = True)
+	t2.build_background(max_rows = 5)
+	assert t.ref_df.shape[0] == t2.ref_df.shape[0]
+	assert set(t.ref_dict.keys()) == set(t2.ref_dict.keys())
+	for k in t2.ref_dict.keys():
+		pd.testing.assert_frame_equal(t.ref_dict[k], t2.ref_dict[k])
+	assert t.vj_occur_freq.keys() == t2.vj_occur_freq.keys()
+	assert np.allclose([t.vj_occur_freq[k] for k in t2.vj_occur_freq], list(t2.vj_occur_freq.values()))
+	assert np.allclose([t.v_freq[k] for k in t2.v_freq], list(t2.v_freq.values()))
+
+	t.remove_subject('A')
+	t3 = TCRsampler()
+	t3.ref_df = t2.ref_df[t2.ref_df.subject != 'A'].reset_index(drop = True)
+	t3.build_background(max_rows = 5)
+	assert set(t.ref_dict.keys()) == set(t3.ref_dict.keys())
+	for k in t3.ref_dict.keys():
+		pd.testing.assert_frame_equal(t.ref_dict[k], t3.ref_dict[k])
+	assert np.allclose([t.vj_freq[k] for k in t3.vj_freq], list(t3.vj_freq.values()))
+	assert t.stats.occur_n == t3.stats.occur_n
+	with pytest.raises(KeyError):
+		t.remove_subject('A')
+	with pytest.raises(ValueError):
+		t.add_subject(new, subject = 'B')
+
+def test_add_subject_joins_reference_once(ref_df):
+	df = ref_df
+	df['subject'] = np.where(np.arange(df.shape[0]) % 3 == 0, 'A', 'B')
+	t = TCRsampler()
+	t.ref_df = df
+	t.build_background(max_rows = 5)
+	t.add_subject(df.iloc[:40].drop(columns = 'subject'), subject = 'C')
+	t.add_subject(df.iloc[40:90].drop(columns = 'subject'), subject = 'D')
+	assert len(t._build_pending) == 2
+	t2 = TCRsampler()
+	t2.ref_df = pd.concat([df, df.iloc[:40].assign(subject = 'C'), df.iloc[40:90].assign(subject = 'D')], ignore_index = True)
+	t2.build_background(max_rows = 5)
+	pd.testing.assert_frame_equal(t.ref_df, t2.ref_df)
+	assert len(t._build_pending) == 0
+	assert t.vj_occur_freq == t2.vj_occur_freq
+	for k in t2.ref_dict.keys():
+		pd.testing.assert_frame_equal(t.ref_dict[k], t2.ref_dict[k])
+	t.remove_subject('C')
+	assert t.ref_df.shape[0] == df.shape[0] + 50
+
+def test_without_subjects_matches_build_background():
+	fn= os.path.join('tcrsampler' ,'tests', 'pmbc_mixcr_example_data.txt')
+	t = TCRsampler()
+	t.clean_mixcr(filename = fn)
+	df = t.ref_df
+	i = np.arange(df.shape[0])
+	# C is the least diverse subject, so leaving it out changes the default occur_n
+	df['subject'] = np.where(i % 7 == 0, 'C', np.where(i % 2 == 0, 'A', 'B'))
+	# without stratification, groups truncated by max_rows are re-selected from the reference
+	unstratified = TCRsampler()
+	unstratified.ref_df = df
+	unstratified.build_background(max_rows = 5)
+	n_rows = unstratified.blocks.n_rows
+	for excluded in [['C'], ['A', 'C']]:
+		view = unstratified.without_subjects(excluded)
+		t2 = TCRsampler()
+		t2.ref_df = df[~df.subject.isin(excluded)].reset_index(drop = True)
+		t2.build_background(max_rows = 5)
+		assert list(view.ref_dict.keys()) == list(t2.ref_dict.keys())
+		for k in t2.ref_dict.keys():
+			pd.testing.assert_frame_equal(view.ref_dict[k], t2.ref_dict[k])
+		assert view.vj_freq.keys() == t2.vj_freq.keys()
+	assert unstratified.blocks.n_rows == n_rows
+
+	t.build_background(max_rows = 5, stratify_by_subject = True)
+	vj_freq = dict(t.vj_freq)
+	n_rows = t.blocks.n_rows
+	for excluded in [['C'], ['A', 'C']]:
+		view = t.without_subjects(excluded)
+		t2 = TCRsampler()
+		t2.ref_df = df[~df.subject.isin(excluded)].reset_index(drop = True)
+		t2.build_background(max_rows = 5, stratify_by_subject = True)
+		assert view.stats.occur_n == t2.stats.occur_n
+		assert list(view.ref_dict.keys()) == list(t2.ref_dict.keys())
+		for k in t2.ref_dict.keys():
+			pd.testing.assert_frame_equal(view.ref_dict[k], t2.ref_dict[k])
+		for name in ['vj_freq', 'v_freq', 'j_freq', 'vj_occur_freq', 'v_occur_freq', 'j_occur_freq']:
+			a, b = getattr(view, name), getattr(t2, name)
+			assert a.keys() == b.keys()
+			assert np.allclose([a[k] for k in b], list(b.values()))
+		usage = [['TRBV9*01','TRBJ2-7*01', 3],['TRBV7-7*01', 'TRBJ2-4*01', 2]]
+		assert view.sample(usage, depth = 5, seed = 2) == t2.sample(usage, depth = 5, seed = 2)
+	# the background itself is unchanged and views do not copy the CDR3 strings
+	assert t.vj_freq == vj_freq and t.blocks.n_rows == n_rows
+	assert view.blocks.cdr3.strings is t.blocks.cdr3
+	assert view.without_subjects('B').blocks.n_rows == 0
+	with pytest.raises(KeyError):
+		view.without_subjects('C')
+	with pytest.raises(ValueError):
+		view.remove_subject('B')
+
+def test_sample_counts_singleton_is_uniform():
+	df = pd.DataFrame({'v_reps':['V1']*3, 'j_reps':['J1']*3, 'cdr3':['CAF','CASF','CASSF'], 'count':[1000,1,1], 'freq':[1000/1002,1/1002,1/1002]})
+	t = TCRsampler(metrics = False)
+	t.ref_df = df
+	t.build_background(make_singleton = True)
+	counts = t.sample_counts([['V1','J1', 3000]], seed = 1)['count']
+	assert counts.sum() == 3000
+	assert np.allclose(counts / 3000, 1/3, atol = 0.05)
+
+def test_synthesize_follows_vj_freq():
+	t = TCRsampler()
+	fn= os.path.join('tcrsampler' ,'tests', 'pmbc_mixcr_example_data.txt')
+	t.clean_mixcr(filename = fn)
+	t.build_background()
+	df = t.synthesize(n = 20000, seed = 3)
+	assert list(df.columns) == ['v_reps','j_reps','cdr3']
+	assert df.shape[0] == 20000
+	usage = df.groupby(['v_reps','j_reps']).size() / df.shape[0]
+	key = max(t.vj_freq, key = t.vj_freq.get)
+	assert abs(usage[key] - t.vj_freq[key]) < 0.02
+	assert set(df[(df.v_reps == key[0]) & (df.j_reps == key[1])]['cdr3']) <= set(t.ref_dict[key]['cdr3'])
+	pd.testing.assert_frame_equal(df, t.synthesize(n = 20000, seed = 3))
+	assert t.synthesize(n = 100, method = 'occurrence').shape[0] == 100
+	with pytest.raises(ValueError):
+		t.synthesize(n = 10, method = 'other')
+
+def test_sample_counts_aggregates_draws():
+	t = TCRsampler()
+	fn= os.path.join('tcrsampler' ,'tests', 'pmbc_mixcr_example_data.txt')
+	t.clean_mixcr(filename = fn)
+	t.build_background()
+	usage = [['TRBV9*01','TRBJ2-7*01', 5],['TRBV7-7*01', 'TRBJ2-4*01', 4], ['TRBV99*01', 'TRBJ2-4*01', 2]]
+	with pytest.warns(UserWarning):
+		df = t.sample_counts(usage, depth = 10000, seed = 1)
+	assert df.columns.tolist() == ['request','v_reps','j_reps','cdr3','count']
+	assert df.groupby('request')['count'].sum().to_dict() == {0 : 50000, 1 : 40000}
+	assert df.groupby('request')['cdr3'].apply(lambda x: x.is_unique).all()
+	assert t.missing_report['v_reps'].tolist() == ['TRBV99*01']
+	# counts follow the block frequencies
+	block = t.ref_dict[('TRBV9*01','TRBJ2-7*01')]
+	p = (block.set_index('cdr3')['freq'] / block['freq'].sum()).groupby(level = 0).sum()
+	observed = df[df.request == 0].set_index('cdr3')['count'] / 50000
+	assert np.allclose(observed.reindex(p.index, fill_value = 0).values, p.values, atol = 0.01)
+	assert df.equals(t.sample_counts(usage, depth = 10000, seed = 1))
@@ -1,4 +1,5 @@
 import pytest
+import os
 from tcrsampler import setup_db
 
 def test_install_all_next_gen(dry_run = True):
@@ -43,3 +44,46 @@ def test_install_nextgen_dry_run_true(download_file = 'ruggiero_mouse_sampler.zi
 										download_from = download_from , 
 										dry_run = dry_run)
 
+
+def test_fetch_file_resumes_verifies_and_skips(tmp_path):
+	import hashlib
+	data = b"v_reps\tj_reps\tcdr3\n" * 1000
+	src = tmp_path / "mirror.tsv"
+	src.write_bytes(data)
+	digest = hashlib.sha256(data).hexdigest()
+	dest = str(tmp_path / "db.tsv")
+	# a partial download from an earlier attempt
+	with open(dest + ".part", 'wb') as fh:
+		fh.write(data[:100])
+	assert setup_db.fetch_file(src.as_uri(), dest, sha256 = digest) == 'downloaded'
+	assert open(dest, 'rb').read() == data
+	assert not os.path.isfile(dest + ".part")
+	assert setup_db.fetch_file(src.as_uri(), dest, sha256 = digest) == 'skipped'
+	assert setup_db.fetch_file(src.as_uri(), dest) == 'skipped'
+	with pytest.raises(ValueError):
+		setup_db.fetch_file(src.as_uri(), str(tmp_path / "bad.tsv"), sha256 = "0" * 64)
+	assert not os.path.isfile(str(tmp_path / "bad.tsv"))
+
+def test_install_nextgen_data_to_db_from_mirror(tmp_path, monkeypatch):
+	import zipfile
+	mirror = tmp_path / "mirror"
+	mirror.mkdir()
+	db = tmp_path / "db"
+	db.mkdir()
+	fn = 'ruggiero_mouse_sampler.zip'
+	with zipfile.ZipFile(mirror / fn, 'w') as zf:
+		zf.writestr('ruggiero_mouse_beta_t.tsv.sampler.tsv', "v_reps\tj_reps\tcdr3\n")
+	(mirror / "SHA256SUMS").write_text(f"{setup_db.sha256sum(str(mirror / fn))}  {fn}\n")
+	monkeypatch.setattr(setup_db, '_db_path', lambda: str(db))
+	for download_from in [str(mirror), mirror.as_uri()]:
+		setup_db.install_nextgen_data_to_db(download_file = fn, download_from = download_from, raise_errors = True)
+		assert (db / 'ruggiero_mouse_beta_t.tsv.sampler.tsv').read_text() == "v_reps\tj_reps\tcdr3\n"
+	from tcrsampler.catalog import Catalog
+	r = Catalog(str(db)).get('ruggiero_mouse_beta_t.tsv.sampler.tsv')
+	assert (r['species'], r['chain'], r['rows']) == ('mouse', 'beta', 0)
+	(mirror / "SHA256SUMS").write_text(f"{'0' * 64}  {fn}\n")
+	os.remove(db / fn)
+	with pytest.raises(ValueError):
+		setup_db.install_nextgen_data_to_db(download_file = fn, download_from = str(mirror), raise_errors = True)
+	with pytest.warns(UserWarning):
+		setup_db.install_nextgen_data_to_db(download_file = fn, download_from = str(mirror))
@@ -0,0 +1,28 @@
+import pytest 
+import pickle
+import numpy as np
+import pandas as pd
+from tcrsampler.shared import SharedBackground
+from tcrsampler.parallel import sample_many
+
+def test_SharedBackground_attach_samples_like_owner(built_sampler):
+	t = built_sampler()
+	usage = [['TRBV9*01','TRBJ2-7*01', 5],['TRBV7-7*01', 'TRBJ2-4*01', 4]]
+	with SharedBackground.publish(t) as shared:
+		handle = pickle.loads(pickle.dumps(shared.handle))
+		t2 = SharedBackground.attach(handle)
+		assert t2.sample(usage, seed = 3) == t.sample(usage, seed = 3)
+		assert t2.sample_batch(['TRBV9*01'], ['TRBJ2-7*01'], [5])[0].tolist() == t.sample_batch(['TRBV9*01'], ['TRBJ2-7*01'], [5])[0].tolist()
+		assert t2.vj_freq == t.vj_freq
+		assert not t2.blocks.freq.flags.writeable
+		assert not t2.blocks._cdf['freq'].flags.writeable
+
+def test_sample_many_shared_memory_matches_serial(built_sampler):
+	t = built_sampler()
+	usage_tables = [ [['TRBV9*01','TRBJ2-7*01', 5],['TRBV7-7*01', 'TRBJ2-4*01', 4]],
+					 [['TRBV9*01','TRBJ2-7*01', 5]] ]
+	serial = sample_many(t, usage_tables, seed = 42, max_workers = 1)
+	shared = sample_many(t, usage_tables, seed = 42, max_workers = 2, shared_memory = True)
+	for (c1, o1), (c2, o2) in zip(serial, shared):
+		assert c1.tolist() == c2.tolist()
+		assert o1.tolist() == o2.tolist()
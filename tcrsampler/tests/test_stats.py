@@ -0,0 +1,71 @@
+import pytest 
+import numpy as np
+import pandas as pd
+from tcrsampler.sampler import TCRsampler
+from tcrsampler.stats import BackgroundStats
+from tcrsampler.blocks import CompactReference
+
+def test_BackgroundStats_matches_groupby(ref_df):
+	df = ref_df
+	s = BackgroundStats(df)
+	d = s.frequency_dicts()
+	vj = df.groupby(['v_reps','j_reps'])['freq'].sum()
+	vj = vj / vj.sum()
+	assert set(d['vj_freq'].keys()) == set(vj.index)
+	assert np.allclose([d['vj_freq'][k] for k in vj.index], vj.values)
+	N = df.groupby('subject').size().min()
+	assert s.occur_n == N
+	top = df.sort_values(['freq','subject'], ascending = False).groupby('subject').head(N)
+	j_occur = top.groupby('j_reps').size() / top.shape[0]
+	assert np.allclose([d['j_occur_freq'][k] for k in j_occur.index], j_occur.values)
+
+def test_BackgroundStats_ranks_within_subject():
+	df = pd.DataFrame({'v_reps':['V1','V2','V1','V2'], 'j_reps':['J1','J1','J2','J2'], 'cdr3':['CAF']*4,
+					   'count':[1, 2, 3, 4], 'freq':[0.1, 0.9, 0.25, 0.75], 'subject':['A','A','B','B']})
+	s = BackgroundStats(df)
+	assert s.subject_rank.tolist() == [1, 0, 1, 0]
+	s.set_occurrence_cutoff(1)
+	assert s.frequency_dicts()['vj_occur_freq'] == {('V2','J1'): 0.5, ('V2','J2'): 0.5}
+	assert s.frequency_dicts()['v_occur_freq'] == {'V2': 1.0}
+
+def test_set_occurrence_cutoff_matches_build(ref_df):
+	t = TCRsampler()
+	t.ref_df = ref_df
+	t.build_background(occur_n = 50)
+	assert np.isclose(sum(t.v_occur_freq.values()), 1.0)
+	t2 = TCRsampler()
+	t2.ref_df = ref_df.copy()
+	t2.build_background()
+	assert t2.vj_occur_freq != t.vj_occur_freq
+	t2.set_occurrence_cutoff(50)
+	assert t2.vj_occur_freq == t.vj_occur_freq
+	assert t2.v_occur_freq == t.v_occur_freq
+	assert t2.build_params['occur_n'] == 50
+
+def test_BackgroundStats_add_remove_subject():
+	df = pd.DataFrame({'v_reps':['V1','V2','V1','V2'], 'j_reps':['J1','J1','J2','J2'], 'cdr3':['CAF']*4,
+					   'count':[1, 2, 3, 4], 'freq':[0.1, 0.9, 0.25, 0.75], 'subject':['A','A','B','B']})
+	s = BackgroundStats(df)
+	s.remove(s.subject_codes == 1)
+	assert s.frequency_dicts() == BackgroundStats(df.iloc[:2]).frequency_dicts()
+	assert s.occur_n == 2
+	s.remove(s.subject_codes == 0)
+	assert s.freq_table.sum() == 0
+	assert s.frequency_dicts()['vj_freq'] == {}
+
+def test_BackgroundStats_add_keeps_rows_pending():
+	df = pd.DataFrame({'v_reps':['V1','V2','V1','V2','V1','V1'], 'j_reps':['J1','J1','J2','J2','J1','J2'], 'cdr3':['CAF']*6,
+					   'count':[1, 2, 3, 4, 5, 6], 'freq':[0.1, 0.9, 0.25, 0.75, 0.4, 0.6], 'subject':['A','A','B','B','C','C']})
+	ref = CompactReference.from_dataframe(df, compact = False)
+	s = BackgroundStats(ref.take(np.arange(2)))
+	s.extend_vocab(ref.v_genes, ref.j_genes, ref.subjects)
+	s.add(ref.take(np.arange(2, 4)))
+	view = s.excluding(s.subject_codes == 0)
+	s.add(ref.take(np.arange(4, 6)))
+	# the new rows are only joined to the others when the per-row arrays are read
+	assert len(s._rows) == 2
+	full = BackgroundStats(df)
+	assert s.frequency_dicts() == full.frequency_dicts()
+	assert s.subject_rank.tolist() == full.subject_rank.tolist()
+	assert len(s._rows) == 1
+	assert view.v_codes.shape[0] == view.active.shape[0] == 4
@@ -0,0 +1,43 @@
+import pytest 
+import numpy as np
+from tcrsampler.streams import philox4x32, request_uniforms, stable_hash
+
+def test_philox4x32_known_answers():
+	""" Known answer tests of Random123 for philox4x32_10 """
+	def words(counter, key):
+		out = philox4x32(np.array(counter, dtype = np.uint64).reshape(4, 1), np.array(key, dtype = np.uint64))
+		return [int(x) for x in out[:,0]]
+	assert words([0, 0, 0, 0], [0, 0]) == [0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8]
+	assert words([0xffffffff] * 4, [0xffffffff] * 2) == [0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd]
+	assert words([0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344], [0xa4093822, 0x299f31d0]) == [0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1]
+
+def test_request_uniforms_are_per_request():
+	h = [stable_hash('TRBV9*01', 'TRBJ2-7*01'), stable_hash('TRBV9*01', 'TRBJ2-7*01')]
+	u = request_uniforms(1, h, [0, 1], [5, 7])
+	assert u.shape == (12,) and np.all((u >= 0) & (u < 1))
+	assert np.all(request_uniforms(1, h[1:], [1], [7]) == u[5:])
+	assert np.all(request_uniforms(1, h[:1], [0], [3]) == u[:3])
+	assert not np.any(u[:5] == u[5:10])
+	assert not np.any(request_uniforms(2, h[:1], [0], [5]) == u[:5])
+
+def test_sample_philox_is_order_and_subset_independent(built_sampler):
+	t = built_sampler()
+	usage = [['TRBV9*01','TRBJ2-7*01', 5], ['TRBV7-7*01', 'TRBJ2-4*01', 4], ['TRBV9*01','TRBJ2-7*01', 5], ['TRBV99*01', 'TRBJ2-4*01', 2]]
+	state = np.random.get_state()[1].copy()
+	full = t.sample(usage, seed = 3, rng = 'philox')
+	assert np.all(np.random.get_state()[1] == state)
+	# the same pair gets independent streams at different positions, unlike rng = 'legacy'
+	assert full[0] != full[2]
+	legacy = t.sample(usage, seed = 3)
+	assert legacy[0] == legacy[2]
+	order = [2, 0, 3, 1]
+	part = t.sample([usage[i] for i in order], seed = 3, rng = 'philox', index = order)
+	assert [full[i] for i in order] == part
+	assert t.sample_background('TRBV9*01','TRBJ2-7*01', n = 5, seed = 3, rng = 'philox', index = 2) == full[2]
+	assert t.sample_background('TRBV9*01','TRBJ2-7*01', n = 5, seed = 3, rng = 'philox', index = 2, d = dict(t.ref_dict)) == full[2]
+	cdr3, offsets = t.sample_batch(*zip(*usage), seed = 3, rng = 'philox')
+	assert [cdr3[a:b].tolist() for a, b in zip(offsets[:-1], offsets[1:])][:3] == full[:3]
+	distinct = t.sample(usage, seed = 3, rng = 'philox', replace = False)
+	assert [distinct[i] for i in order] == t.sample([usage[i] for i in order], seed = 3, rng = 'philox', replace = False, index = order)
+	with pytest.raises(ValueError):
+		t.sample(usage, rng = 'mt19937')
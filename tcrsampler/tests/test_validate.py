@@ -0,0 +1,30 @@
+import pytest 
+import numpy as np
+import pandas as pd
+from tcrsampler.validate import validate_cdr3, valid_cdr3
+
+def test_validate_cdr3_mask_and_reasons():
+	cdr3 = pd.Series(['CASSF', 'CAS.F', 'CASSY', np.nan, 'CF', 'CASSLGQAARGIQYF', 'CASSÉF', ''])
+	valid, rejected = validate_cdr3(cdr3, min_length = 3)
+	assert valid.tolist() == [True, False, False, False, False, True, False, False]
+	assert rejected == {'missing': 1, 'alphabet': 2, 'anchors': 2, 'length': 1}
+
+def test_validate_cdr3_without_anchors_or_length():
+	valid, rejected = validate_cdr3(['AAAA', 'AA.A', 'CASSY'], anchors = False)
+	assert valid.tolist() == [True, False, True]
+	assert rejected == {'missing': 0, 'alphabet': 1, 'anchors': 0, 'length': 0}
+
+def test_validate_cdr3_max_length():
+	valid, rejected = validate_cdr3(['CASSF', 'CASSSSSSSSF'], max_length = 10)
+	assert valid.tolist() == [True, False]
+	assert rejected['length'] == 1
+
+def test_validate_cdr3_empty_input():
+	valid, rejected = validate_cdr3([])
+	assert valid.shape == (0,)
+	assert sum(rejected.values()) == 0
+
+def test_valid_cdr3():
+	assert valid_cdr3("AAAA")
+	assert not valid_cdr3("AA.A")
+	assert not valid_cdr3(None)